@@ -4,19 +4,35 @@ import google.generativeai as genai
 from dotenv import load_dotenv
 import json
 import time 
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 # --- 画像処理・バーコード関連 ---
-import cv2
-import numpy as np
-from pyzbar.pyzbar import decode
 from PIL import Image
 
+from smartcart_sys.barcode_decoder import DecodeCascade
+from smartcart_sys.checkout_scanner import CheckoutScanner
+from smartcart_sys.catalog import get_catalog
+from smartcart_sys.chat_sessions import ChatSessionManager
+from smartcart_sys.chat_stream import StreamMetrics, StreamingReply
+from smartcart_sys.gemini_stub import StubModel, stub_enabled
+from smartcart_sys.order_bridge import OrderBridge
+from smartcart_sys.response_cache import ResponseCache
+
+try:
+    from streamlit_webrtc import webrtc_streamer
+except ImportError:
+    webrtc_streamer = None  # 無い場合は st.camera_input で1枚ずつ読む
+
 # --- ROS 2 関連 ---
 import rclpy
 from rclpy.node import Node
 from std_msgs.msg import String
 import threading
 
+from smartcart_sys.cart_state import CartState
+from smartcart_sys.order_topics import ORDER_TOPIC, ACK_TOPIC, EVENT_TOPIC, ORDER_QOS
+
 # .envファイル読み込み
 load_dotenv()
 
@@ -26,7 +42,26 @@ load_dotenv()
 class ShoppingListNode(Node):
     def __init__(self):
         super().__init__('shopping_list_ui_node')
-        self.publisher_ = self.create_publisher(String, 'shopping_list', 10)
+        self.publisher_ = self.create_publisher(String, ORDER_TOPIC, ORDER_QOS)
+
+        # 全ての画面(セッション)の注文をこの1つのノードで送り、返事を注文番号で各画面に仕分ける
+        self.bridge = OrderBridge()
+        self.ack_subscription = self.create_subscription(
+            String, ACK_TOPIC, lambda msg: self.route_message(msg, self.bridge.on_ack), ORDER_QOS)
+        self.event_subscription = self.create_subscription(
+            String, EVENT_TOPIC, lambda msg: self.route_message(msg, self.bridge.on_event), ORDER_QOS)
+
+        # カートのスキャナー(cart_scanner.py)の中身を差分で受け取って再現する
+        self.cart_mirror = CartState()
+        self.cart_command_publisher = self.create_publisher(String, 'cart_command', 10)
+        self.cart_subscription = self.create_subscription(
+            String, 'cart_update', self.cart_update_callback, 10)
+
+        # ナビゲーターの走行状況（現在地・到着見込み・到着済みの棚）のカートごとの最新の1件と受信時刻
+        # 複数台運用ではディスパッチャーがカート名(cart)を付けて /trip_status にまとめて送る
+        self.trip_statuses = {}
+        self.status_subscription = self.create_subscription(
+            String, 'trip_status', self.trip_status_callback, 10)
         self.get_logger().info('Shopping List UI Node Started!')
 
     def send_list(self, items_json):
@@ -35,6 +70,41 @@ class ShoppingListNode(Node):
         self.publisher_.publish(msg)
         self.get_logger().info(f'Published: {msg.data}')
 
+    def send_order(self, session_id, items):
+        """注文番号を付けて送る。返事待ちの注文が多すぎる場合は送らずに None"""
+        envelope = self.bridge.new_order(session_id, items)
+        if envelope is not None:
+            self.send_list(json.dumps(envelope, ensure_ascii=False))
+        return envelope
+
+    def route_message(self, msg, handler):
+        try:
+            data = json.loads(msg.data)
+        except Exception:
+            return
+        handler(data)
+
+    def trip_status_callback(self, msg):
+        try:
+            status = json.loads(msg.data)
+        except Exception:
+            return
+        self.trip_statuses[status.get('cart') or ''] = (status, time.monotonic())
+
+    def cart_update_callback(self, msg):
+        try:
+            event = json.loads(msg.data)
+        except Exception:
+            return
+        if not self.cart_mirror.apply(event):
+            # 途中のメッセージを取りこぼしたので全体を送ってもらう
+            self.send_cart_command({"action": "snapshot"})
+
+    def send_cart_command(self, command):
+        msg = String()
+        msg.data = json.dumps(command)
+        self.cart_command_publisher.publish(msg)
+
 @st.cache_resource
 def setup_ros():
     if not rclpy.ok():
@@ -46,27 +116,113 @@ def setup_ros():
 
 ros_node = setup_ros()
 
+def get_session_id():
+    """この画面(Streamlit のセッション)の識別子。注文の返事の仕分けやチャットの保持に使う"""
+    if 'session_id' not in st.session_state:
+        st.session_state['session_id'] = uuid.uuid4().hex
+    return st.session_state['session_id']
+
+def send_order(items):
+    """買い物リストを注文としてロボットに送る。前の注文の返事待ちが多すぎて送れなければ False"""
+    order = ros_node.send_order(get_session_id(), items)
+    if order is None:
+        st.toast("⏳ 前の注文の受付を待っています。少し待ってから送ってください。")
+        return False
+    st.session_state.setdefault('orders', {})[order['order_id']] = {'items': items, 'status': '送信中'}
+    return True
+
+ORDER_STATUS_TEXT = {
+    'trip_started': '🛒 出発しました',
+    'arrived': '📍 {stop} に到着',
+    'failed': '⚠️ {stop} に行けませんでした',
+    'skipped': '⏭️ {stop} の棚を飛ばしました',
+    'returning': '🏠 レジに戻っています',
+    'part_finished': '🚚 1台が完了しました（ほかのカートが走行中）',
+    'trip_finished': '✅ 完了',
+    'trip_canceled': '🛑 中止されました',
+}
+
+@st.fragment(run_every=1.0)
+def show_order_updates():
+    """この画面の注文への返事・ロボットの節目を取り込んで表示する（この部分だけ再描画する）"""
+    orders = st.session_state.setdefault('orders', {})
+    for message in ros_node.bridge.drain(get_session_id()):
+        order = orders.get(message.get('order_id'))
+        if order is None:
+            continue
+        if message.get('trip_order_id'):
+            # 分割・合流した注文は、走行状況を行程の注文番号で探す
+            order.setdefault('trips', set()).add(message['trip_order_id'])
+        if message['kind'] == 'ack':
+            if message.get('status') == 'accepted':
+                order['status'] = '✅ 受付済み'
+                st.toast(f"ロボットが注文を受け付けました ({message.get('latency', 0.0) * 1000:.0f}ms)")
+            else:
+                order['status'] = f"❌ 受付できませんでした ({message.get('reason', '')})"
+        elif message['kind'] == 'timeout':
+            order['status'] = '⌛ ロボットから返事がありません'
+        elif message.get('event') in ORDER_STATUS_TEXT:
+            order['status'] = ORDER_STATUS_TEXT[message['event']].format(stop=message.get('stop', ''))
+        if message['kind'] == 'event':
+            if message.get('event') in ('arrived', 'failed'):
+                check_memo_from_robot(message)
+
+    for order_id, order in list(orders.items())[-3:]:
+        st.caption(f"注文 {order_id}: {order['status']}")
+
 
 # ==========================================
 # 2. Gemini API 設定
 # ==========================================
-def configure_gemini():
+GEMINI_MODEL = 'gemini-2.5-flash'
+
+@st.cache_resource
+def configure_gemini_client():
+    # .env の読み込みと genai.configure はプロセスで1回だけ行う
     load_dotenv() 
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
+        return False
+    genai.configure(api_key=api_key)
+    return True
+
+def configure_gemini():
+    if stub_enabled():
+        return True  # 偽モデルはAPIキー不要
+    if not configure_gemini_client():
+        configure_gemini_client.clear()  # .env を直したら次の呼び出しで読み直す
         st.error("❌ エラー: APIキーが読み込めていません。")
         return None
-    genai.configure(api_key=api_key)
     return True
     
+def make_gemini_model(system_instruction=None):
+    # SMARTCART_GEMINI_STUB=1 ならAPIを使わない偽モデル（動作確認用）
+    if stub_enabled():
+        return StubModel(GEMINI_MODEL, system_instruction=system_instruction, delay=1.0, chunk_delay=0.03)
+    if system_instruction is None:
+        return genai.GenerativeModel(GEMINI_MODEL)
+    return genai.GenerativeModel(GEMINI_MODEL, system_instruction=system_instruction)
+
 @st.cache_resource
 def get_gemini_model():
-    return genai.GenerativeModel('gemini-2.5-flash')
+    return make_gemini_model()
+
+@st.cache_resource
+def get_response_cache():
+    # 同じ相談への応答をディスクに保存し、全セッション・再起動後も使い回す
+    return ResponseCache()
+
+@st.cache_resource
+def get_chat_sessions():
+    # セッションごとのモデルとチャットを画面の再実行をまたいで保持する
+    return ChatSessionManager(make_gemini_model)
+
+@st.cache_resource
+def get_stream_metrics():
+    # チャットの最初の文字が出るまでの時間(TTFT)を全セッション分集計する
+    return StreamMetrics()
 
 def analyze_recipe_with_gemini(prompt_text):
-    configure_gemini()
-    model = get_gemini_model()
-    
     system_instruction = """
     あなたはスーパーマーケットの買い物支援AIです。
     ユーザーの要望に応じたレシピを提案してください。
@@ -82,10 +238,15 @@ def analyze_recipe_with_gemini(prompt_text):
     
     full_prompt = f"{system_instruction}\n\nユーザーの要望: {prompt_text}"
 
+    def generate():
+        configure_gemini()
+        return get_gemini_model().generate_content(full_prompt).text
+
     try:
         with st.spinner('Geminiが分析中...'):
-            response = model.generate_content(full_prompt)
-            return response.text
+            text, _ = get_response_cache().get_or_generate(
+                GEMINI_MODEL, system_instruction, prompt_text, generate)
+            return text
     except Exception as e:
         st.error(f"エラーが発生しました: {str(e)}")
         return "分析に失敗しました。"
@@ -111,6 +272,24 @@ def extract_json_from_text(text):
     except:
         return None
 
+# ==========================================
+# 2.2 バーコード読み取り
+# ==========================================
+@st.cache_resource
+def get_decode_cascade():
+    # 全セッションで共有し、どの読み取り手法がよく当たるかを学習させる
+    return DecodeCascade()
+
+@st.cache_resource
+def get_scan_executor():
+    # 全セッション共有の読み取りスレッド。画面の実行はデコードを待たない
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix='checkout-scan')
+
+def get_checkout_scanner():
+    if 'checkout_scanner' not in st.session_state:
+        st.session_state['checkout_scanner'] = CheckoutScanner(get_scan_executor(), get_decode_cascade())
+    return st.session_state['checkout_scanner']
+
 # ==========================================
 # 2.5 商品データベース & カート設定
 # ==========================================
@@ -123,29 +302,7 @@ def init_cart_session():
     if 'robot_list' not in st.session_state:
         st.session_state['robot_list'] = []
     
-CATEGORY_ITEMS = {
-    "野菜・果物": ["キャベツ", "レタス", "トマト", "玉ねぎ", "人参", "バナナ", "リンゴ"],
-    "精肉・鮮魚": ["鶏もも肉", "豚バラ肉", "牛ミンチ", "サケの切り身", "マグロ刺身"],
-    "乳製品・卵": ["牛乳", "ヨーグルト", "チーズ", "卵(10個入)", "バター"],
-    "調味料・粉": ["醤油", "マヨネーズ", "カレールー", "小麦粉", "パン粉"],
-    "お菓子・飲料": ["ポテトチップス", "チョコレート", "コーラ", "お茶", "水(2L)"]
-}
-
-# 画像に合わせて更新したデータベース
-PRODUCT_DB = {
-    "4902777003665": {"name": "あらびきウインナー", "price": 398},
-    "4902380198406": {"name": "日清 サラダ油", "price": 450},
-    "4900000001006": {"name": "野菜（じゃがいも/なす）", "price": 158},
-    "4902402854501": {"name": "ジャワカレー 中辛", "price": 350},
-    "4973360566850": {"name": "サトウのごはん", "price": 140},
-    "4902402848357": {"name": "こくまろカレー 中辛", "price": 220},
-    "4901002113520": {"name": "S&B 味付塩こしょう", "price": 190},
-    "4908011502444": {"name": "お米 5kg", "price": 2400},
-    "4902402853818": {"name": "バーモントカレー 中辛", "price": 298},
-    # 既存テストデータ
-    "4902102000186": {"name": "コカ・コーラ 500ml", "price": 160},
-    "4517586001667": {"name": "広島レモンケーキ", "price": 250},
-}
+# 売り場一覧とバーコードの商品データは data/catalog.csv（smartcart_sys/catalog.py で読む）
 
 # ==========================================
 # 3. 画面表示関数群
@@ -155,7 +312,7 @@ def show_category_select_screen():
     st.header("売り場から探す")
     st.write("どの売り場の商品をお探しですか？")
 
-    categories = list(CATEGORY_ITEMS.keys())
+    categories = list(get_catalog().categories().keys())
     cols = st.columns(2)
     for i, category in enumerate(categories):
         with cols[i % 2]:
@@ -183,8 +340,7 @@ def show_category_select_screen():
     if st.session_state['robot_list']:
         st.info(f"現在選択中の商品: {st.session_state['robot_list']}")
         if st.button("このリストでロボットに依頼する (確定)", type="primary"):
-            json_str = json.dumps(st.session_state['robot_list'], ensure_ascii=False)
-            ros_node.send_list(json_str)
+            send_order(st.session_state['robot_list'])
             st.toast("ロボットに出発指令を送りました！")
             st.session_state['step'] = 'checkout' # ここでもレジへ移動させる
             st.rerun()
@@ -203,7 +359,7 @@ def show_category_products_screen():
         st.rerun()
         
     st.divider()
-    items = CATEGORY_ITEMS.get(category, [])
+    items = get_catalog().categories().get(category, [])
     current_selection = [item for item in st.session_state['robot_list'] if item in items]
     
     selected_items = st.multiselect(
@@ -240,7 +396,7 @@ def show_analysis_result_screen():
                 st.success(f"検出された買い物リスト: {shopping_list}")
                 
                 if st.button("🛒 このリストで買い物に行く！ (レジ画面へ)", type="primary"):
-                    ros_node.send_list(json_str)
+                    send_order(shopping_list)
                     st.toast("ロボットに指令を送りました！")
                     st.session_state['step'] = 'checkout'
                     time.sleep(1)
@@ -273,6 +429,40 @@ def show_free_input_screen():
         st.session_state['step'] = 'category_select'
         st.rerun()
 
+def show_chat_list_action(json_str):
+    """チャットの買い物リストから「買い物に行く」ボタンを出す（ストリーミング中にも同じキーで出す）"""
+    st.divider()
+    st.success("💡 買い物リストが作成されました！")
+    
+    if st.button("🛒 このリストで買い物に行く (レジへ)", type="primary", key="chat_go_shopping"):
+        try:
+            # 1. JSONをパース（辞書のリストとして読み込む）
+            raw_list = json.loads(json_str)
+            
+            # 2. ロボット用のリストを送信
+            # データ形式は [{"en": "Carrot", "ja": "人参"}, ...]。ロボット側は英語名で
+            # 見つからなければ日本語名でも棚を探すので、組のまま送る
+            send_order(raw_list)
+            
+            # 3. 人間用（日本語＋チェック状態）を保存
+            # 'checked': False を追加しておくのがポイント
+            st.session_state['shopping_memo'] = []
+            for item in raw_list:
+                st.session_state['shopping_memo'].append({
+                    'en': item['en'],
+                    'ja': item['ja'],
+                    'checked': False
+                })
+                
+        except Exception as e:
+            st.error(f"リストの読み込みに失敗しました: {e}")
+            st.session_state['shopping_memo'] = []
+
+        st.toast("ロボットに出発指令を送りました！🚀")
+        st.session_state['step'] = 'checkout'
+        time.sleep(1)
+        st.rerun()
+
 def show_chat_consultation_screen():
     st.header("👨‍🍳 AIシェフと献立相談")
     
@@ -285,84 +475,77 @@ def show_chat_consultation_screen():
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
+    # 入力欄は画面下に固定される。新しい相談の実行中は、ボタンを応答の下にだけ出す
+    prompt = st.chat_input("例: チキンカレーが食べたい")
+
     # --- ボタン表示判定ロジック (修正版) ---
-    if st.session_state.messages:
+    if st.session_state.messages and not prompt:
         last_msg = st.session_state.messages[-1]
         if last_msg["role"] == "assistant":
             json_str = extract_json_from_text(last_msg["content"])
             
             if json_str:
-                st.divider()
-                st.success("💡 買い物リストが作成されました！")
-                
-                if st.button("🛒 このリストで買い物に行く (レジへ)", type="primary"):
-                    try:
-                        # 1. JSONをパース（辞書のリストとして読み込む）
-                        raw_list = json.loads(json_str)
-                        
-                        # 2. ロボット用（英語のみのリスト）を作成して送信
-                        # データ形式が [{"en": "Carrot", "ja": "人参"}, ...] となるため
-                        robot_list = [item['en'] for item in raw_list]
-                        ros_node.send_list(json.dumps(robot_list))
-                        
-                        # 3. 人間用（日本語＋チェック状態）を保存
-                        # 'checked': False を追加しておくのがポイント
-                        st.session_state['shopping_memo'] = []
-                        for item in raw_list:
-                            st.session_state['shopping_memo'].append({
-                                'en': item['en'],
-                                'ja': item['ja'],
-                                'checked': False
-                            })
-                            
-                    except Exception as e:
-                        st.error(f"リストの読み込みに失敗しました: {e}")
-                        st.session_state['shopping_memo'] = []
-
-                    st.toast("ロボットに出発指令を送りました！🚀")
-                    st.session_state['step'] = 'checkout'
-                    time.sleep(1)
-                    st.rerun()
+                show_chat_list_action(json_str)
     # ---------------------------
 
-    if prompt := st.chat_input("例: チキンカレーが食べたい"):
+    if prompt:
         st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            with st.spinner("シェフが思考中..."):
-                configure_gemini()
-                
-                # ★重要変更★: 出力形式を {en: "...", ja: "..."} のリストに変更
-                system_instruction = """
-                あなたはプロの家庭料理シェフ兼買い物アドバイザーです。
-                ユーザーと合意してメニューが決定した場合のみ、回答の最後に必ず「買い物リスト」を以下のJSON形式で出力してください。
-                
-                【重要：出力フォーマット】
-                ロボット用の英語名("en")と、人間用の日本語名("ja")をセットにしてください。
-                
-                出力例:
-                ```json
-                [
-                    {"en": "Chicken", "ja": "鶏肉"},
-                    {"en": "Onion", "ja": "玉ねぎ"},
-                    {"en": "Curry Roux", "ja": "カレールー"}
-                ]
-                ```
-                """
-                model = genai.GenerativeModel('gemini-2.5-flash', system_instruction=system_instruction)
-                gemini_history = []
-                for msg in st.session_state.messages[:-1]:
-                    role = "user" if msg["role"] == "user" else "model"
-                    gemini_history.append({"role": role, "parts": [msg["content"]]})
-                
-                chat = model.start_chat(history=gemini_history)
-                response = chat.send_message(prompt)
-                
-                st.markdown(response.text)
-                st.session_state.messages.append({"role": "assistant", "content": response.text})
-                st.rerun()
+            # ★重要変更★: 出力形式を {en: "...", ja: "..."} のリストに変更
+            system_instruction = """
+            あなたはプロの家庭料理シェフ兼買い物アドバイザーです。
+            ユーザーと合意してメニューが決定した場合のみ、回答の最後に必ず「買い物リスト」を以下のJSON形式で出力してください。
+            
+            【重要：出力フォーマット】
+            ロボット用の英語名("en")と、人間用の日本語名("ja")をセットにしてください。
+            
+            出力例:
+            ```json
+            [
+                {"en": "Chicken", "ja": "鶏肉"},
+                {"en": "Onion", "ja": "玉ねぎ"},
+                {"en": "Curry Roux", "ja": "カレールー"}
+            ]
+            ```
+            """
+            history = [("user" if msg["role"] == "user" else "model", msg["content"])
+                       for msg in st.session_state.messages[:-1]]
+
+            configure_gemini()
+            # モデルとチャットはセッションごとに使い回し、新しい発言の分だけ足す
+            managed_chat = get_chat_sessions().get(get_session_id(), system_instruction)
+
+            # 会話の流れまで同じならキャッシュの応答を返す
+            cache = get_response_cache()
+            cache_key, cached_text = cache.lookup(GEMINI_MODEL, system_instruction, prompt, history=history)
+            if cached_text is not None:
+                managed_chat.add_turn(history, prompt, cached_text)
+                chunks = [cached_text]
+            else:
+                chunks = cache.record_stream(
+                    cache_key, managed_chat.send(history, prompt), GEMINI_MODEL, prompt)
+
+            # 届いた分から表示する。途中で画面が再実行されても消えないよう、返答は先に履歴へ入れておく
+            reply_msg = {"role": "assistant", "content": ""}
+            st.session_state.messages.append(reply_msg)
+            text_slot = st.empty()
+            action_slot = st.empty()
+            reply = StreamingReply(chunks, metrics=get_stream_metrics(), cached=cached_text is not None)
+            list_shown = False
+            # スピナーは出さず、届いた文字と末尾の「▌」で進み具合を見せる
+            for _ in reply:
+                reply_msg["content"] = reply.text
+                text_slot.markdown(reply.text + "▌")
+                # リストが閉じた時点でボタンを出す（応答の残りを待たない）
+                if reply.list_json is not None and not list_shown:
+                    list_shown = True
+                    with action_slot.container():
+                        show_chat_list_action(reply.list_json)
+            text_slot.markdown(reply.text)
+            st.rerun()
 
 def show_checkout_screen():
     st.header("🛒 スマート・セルフレジ")
@@ -385,8 +568,21 @@ def show_checkout_screen():
         # （ここは変更なしなので省略、前のコードのまま）
         st.info("カメラにバーコードをかざしてください")
         
-        current_key = f"camera_{st.session_state['camera_key_id']}"
-        img_file_buffer = st.camera_input("バーコードをスキャン", key=current_key)
+        # 読み取りは別スレッドで行い、結果は show_scan_results() が取り込む
+        scanner = get_checkout_scanner()
+        if webrtc_streamer is not None:
+            # 連続スキャン: 映像を流しっぱなしにして、かざした商品を次々に読む
+            def on_video_frame(frame):
+                scanner.submit_frame(frame.to_ndarray(format="bgr24"))
+                return frame
+
+            webrtc_streamer(key="checkout_scan", video_frame_callback=on_video_frame,
+                            media_stream_constraints={"video": True, "audio": False})
+        else:
+            current_key = f"camera_{st.session_state['camera_key_id']}"
+            img_file_buffer = st.camera_input("バーコードをスキャン", key=current_key)
+            if img_file_buffer is not None:
+                scanner.submit_image(img_file_buffer.getvalue())
         
         manual_code = st.text_input("またはバーコードを手入力")
         if st.button("手入力で追加"):
@@ -394,25 +590,8 @@ def show_checkout_screen():
                 process_barcode(manual_code)
                 st.session_state['camera_key_id'] += 1
                 st.rerun()
-            
-        if img_file_buffer is not None:
-            bytes_data = img_file_buffer.getvalue()
-            cv2_img = cv2.imdecode(np.frombuffer(bytes_data, np.uint8), cv2.IMREAD_COLOR)
-            
-            gray_img = cv2.cvtColor(cv2_img, cv2.COLOR_BGR2GRAY)
-            decoded_objects = decode(gray_img)
-            if not decoded_objects:
-                _, thresh_img = cv2.threshold(gray_img, 100, 255, cv2.THRESH_BINARY)
-                decoded_objects = decode(thresh_img)
-            
-            if decoded_objects:
-                for obj in decoded_objects:
-                    barcode_data = obj.data.decode("utf-8")
-                    st.success(f"読み取り成功: {barcode_data}")
-                    process_barcode(barcode_data)
-                    st.session_state['camera_key_id'] += 1
-                    st.rerun()
-                    break 
+
+        show_scan_results()
 
     with col2:
         # （...買い物リスト表示部分はそのまま...）
@@ -443,23 +622,10 @@ def show_checkout_screen():
 
     # --- 右側：買い物リスト ＆ カート ---
     with col2:
-        # --- 買い物リスト表示 ---
-        if 'shopping_memo' in st.session_state and st.session_state['shopping_memo']:
-            st.warning("📝 **買うものリスト**")
-            
-            for item in st.session_state['shopping_memo']:
-                if isinstance(item, dict):
-                    name = item.get('ja', item.get('en', '商品'))
-                    is_checked = item.get('checked', False)
-                    
-                    if is_checked:
-                        st.markdown(f"##### ✅ ~~{name}~~ (GET!)")
-                    else:
-                        st.markdown(f"##### ⬜ {name}")
-                else:
-                    st.write(item)
-            st.divider()
-        # --------------------------------
+        # --- ロボットの走行状況 ＆ 買い物リスト表示（この部分だけ1秒ごとに描き直す） ---
+        show_trip_progress()
+
+        show_cart_scanner_section()
         
         # --- カート表示 ---
         st.subheader("🧾 お会計 (Current Cart)")
@@ -485,6 +651,151 @@ def show_checkout_screen():
         else:
             st.write("カートは空です")
 
+ROBOT_STATE_TEXT = {
+    'navigating': '🚀 棚に向かっています',
+    'dwelling': '🛒 棚で停車中',
+    'returning': '🏠 レジに戻っています',
+}
+
+# この秒数 trip_status が届かなければ、表示が古い可能性を知らせる
+TRIP_STATUS_STALE = 5.0
+
+def format_eta(seconds):
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    return f"{minutes}分{seconds}秒" if minutes else f"{seconds}秒"
+
+@st.fragment(run_every=1.0)
+def show_trip_progress():
+    """この画面の注文を運んでいるロボットの走行状況と、買うものリストを描く"""
+    # カートのスキャナーで読んだ商品もリストに反映する
+    for line in ros_node.cart_mirror.snapshot()['items']:
+        check_memo_from_scan(line['name'])
+
+    orders = st.session_state.get('orders', {})
+    my_trips = set(orders)
+    for order in orders.values():
+        my_trips |= order.get('trips', set())
+    for cart, (status, received_at) in sorted(ros_node.trip_statuses.items()):
+        trip_ids = {status.get('order_id'), status.get('parent_order_id')} | set(status.get('merged_order_ids') or [])
+        if not (trip_ids & my_trips) or status.get('state') not in ROBOT_STATE_TEXT:
+            continue
+        current = '、'.join(status.get('current_items') or []) or status.get('current') or ''
+        robot = f"{cart} " if cart else ''
+        lines = [f"🤖 {robot}**{ROBOT_STATE_TEXT[status['state']]}** {current}"]
+        if status['state'] == 'navigating' and status.get('next_eta_s') is not None:
+            lines.append(f"到着まで約{format_eta(status['next_eta_s'])}")
+        if status['state'] == 'dwelling':
+            lines.append("商品をカートでスキャンすると次へ向かいます")
+        if status.get('eta_s') is not None:
+            lines.append(f"レジに戻るまで約{format_eta(status['eta_s'])}")
+        st.info("　".join(lines))
+
+        shelves = [stop for stop in status.get('stops', []) if stop.get('items')]
+        done = len(status.get('picked', [])) + len(status.get('failed', []))
+        if shelves:
+            st.progress(min(1.0, done / len(shelves)), text=f"{done} / {len(shelves)} か所の棚")
+        for failed in status.get('failed', []):
+            st.warning(f"⚠️ {'、'.join(failed['items'])} の棚に行けませんでした")
+        if time.monotonic() - received_at > TRIP_STATUS_STALE:
+            st.caption("⚠️ ロボットからの更新が途絶えています")
+
+    # --- 買い物リスト表示 ---
+    if 'shopping_memo' in st.session_state and st.session_state['shopping_memo']:
+        st.warning("📝 **買うものリスト**")
+        
+        for item in st.session_state['shopping_memo']:
+            if isinstance(item, dict):
+                name = item.get('ja', item.get('en', '商品'))
+                is_checked = item.get('checked', False)
+                
+                if is_checked and item.get('source') == 'robot':
+                    st.markdown(f"##### ✅ ~~{name}~~ (🤖 棚に到着)")
+                elif is_checked:
+                    st.markdown(f"##### ✅ ~~{name}~~ (GET!)")
+                elif item.get('missed'):
+                    st.markdown(f"##### ⚠️ {name} (ロボットが行けませんでした)")
+                else:
+                    st.markdown(f"##### ⬜ {name}")
+            else:
+                st.write(item)
+        st.divider()
+
+def check_memo_from_robot(event):
+    """ロボットが着いた（行けなかった）棚の商品を、買うものリストに反映する"""
+    labels = set(event.get('items', []))
+    for item in st.session_state.get('shopping_memo', []):
+        if not isinstance(item, dict) or not (item.get('en') in labels or item.get('ja') in labels):
+            continue
+        if event['event'] == 'arrived' and not item.get('checked'):
+            item['checked'] = True
+            item['source'] = 'robot'
+            st.toast(f"🤖 リストの「{item['ja']}」の棚に着きました")
+        elif event['event'] == 'failed':
+            item['missed'] = True
+
+def check_memo_from_scan(scanned_name):
+    """読み取った商品名に合う買うものリストの項目をチェックする"""
+    for item in st.session_state.get('shopping_memo', []):
+        if not isinstance(item, dict):
+            continue
+        target_name = item['ja']   # 例: "カレールー"
+        
+        # 部分一致判定（どちらかがどちらかを含んでいればOKとする）
+        # 例: "カレー" が "バーモントカレー" に含まれるならチェック
+        if target_name in scanned_name or scanned_name in target_name:
+            if not item['checked']:
+                item['checked'] = True
+                item['source'] = 'scan'
+                st.toast(f"✅ リストの「{target_name}」をコンプリート！")
+
+def show_cart_scanner_section():
+    """カートのスキャナーで読み取った商品（/cart_update の差分から再現したもの）"""
+    snapshot = ros_node.cart_mirror.snapshot()
+    if not snapshot['items']:
+        return
+    st.subheader("🛒 カートで読み取った商品")
+    for line in snapshot['items']:
+        col_name, col_btn = st.columns([3, 1])
+        with col_name:
+            st.write(f"・{line['name']} × {line['qty']}: ¥{line['price'] * line['qty']}")
+        with col_btn:
+            if st.button("1つ取り消す", key=f"cart_remove_{line['sku']}"):
+                ros_node.send_cart_command({"action": "remove", "sku": line['sku']})
+                time.sleep(0.2)
+                st.rerun()
+    st.markdown(f"**小計: ¥{snapshot['total_price']}** （{snapshot['item_count']}点）")
+    if st.button("↩️ 直前の操作を取り消す", key="cart_undo_btn"):
+        ros_node.send_cart_command({"action": "undo"})
+        time.sleep(0.2)
+        st.rerun()
+    st.divider()
+
+@st.fragment(run_every=0.5)
+def show_scan_results():
+    """読み取りスレッドの結果を取り込み、新しく入った商品だけを描く（画面全体は再実行しない）"""
+    codes = get_checkout_scanner().drain()
+    if codes:
+        before = len(st.session_state['cart'])
+        for code in codes:
+            process_barcode(code)
+        recent = st.session_state.setdefault('recent_scans', [])
+        recent[:0] = reversed(st.session_state['cart'][before:])
+        del recent[5:]
+        if webrtc_streamer is None:
+            # 静止画の場合は撮り直せるようカメラを新しくし、カート全体も描き直す
+            st.session_state['camera_key_id'] += 1
+            st.rerun()
+
+    cart = st.session_state['cart']
+    # お会計・カートを空にした後は消えた商品を出さない
+    recent = [item for item in st.session_state.get('recent_scans', [])
+              if any(item is entry for entry in cart)]
+    st.session_state['recent_scans'] = recent
+    for item in recent:
+        st.write(f"🆕 {item['name']}: ¥{item['price']}")
+    if cart:
+        st.caption(f"カート: {len(cart)}点 / ¥{sum(item['price'] for item in cart)}")
+
 def process_barcode(code):
     current_time = time.time()
     
@@ -499,26 +810,15 @@ def process_barcode(code):
     if code == last_code and (current_time - last_time) < 3.0:
         return 
     
-    if code in PRODUCT_DB:
-        product = PRODUCT_DB[code]
+    product = get_catalog().lookup(code)
+    if product is not None:
         st.session_state['cart'].append(product)
         st.session_state['last_scanned_code'] = code
         st.session_state['last_scan_time'] = current_time
         st.toast(f"追加: {product['name']}")
 
         # --- ★追加機能: 買い物リストの自動チェック機能 ---
-        if 'shopping_memo' in st.session_state:
-            scanned_name = product['name'] # 例: "バーモントカレー 中辛"
-            
-            for item in st.session_state['shopping_memo']:
-                target_name = item['ja']   # 例: "カレールー"
-                
-                # 部分一致判定（どちらかがどちらかを含んでいればOKとする）
-                # 例: "カレー" が "バーモントカレー" に含まれるならチェック
-                if target_name in scanned_name or scanned_name in target_name:
-                    if not item['checked']:
-                        item['checked'] = True
-                        st.toast(f"✅ リストの「{target_name}」をコンプリート！")
+        check_memo_from_scan(product['name']) # 例: "バーモントカレー 中辛"
         # -----------------------------------------------
 
     else:
@@ -546,8 +846,11 @@ def show_payment_complete_screen():
                 st.divider()
                 st.info("続けてロボットに買い物リストを送りますか？")
                 if st.button("🛒 送る"):
-                    ros_node.send_list(json_str)
-                    st.toast("送信しました！")
+                    try:
+                        if send_order(json.loads(json_str)):
+                            st.toast("送信しました！")
+                    except ValueError as e:
+                        st.error(f"リストの読み込みに失敗しました: {e}")
 
 def show_navigation_screen():
     with st.sidebar:
@@ -556,6 +859,16 @@ def show_navigation_screen():
             st.session_state['step'] = 'category_select'
             st.rerun()
         st.write("ROS2: ✅ Connected")
+        show_order_updates()
+        order_stats = ros_node.bridge.latency_summary()
+        st.caption(f"注文の受付までの時間: p50 {order_stats['p50_ms']}ms / p90 {order_stats['p90_ms']}ms")
+        cache_stats = get_response_cache().metrics()
+        st.caption(f"AI応答キャッシュ: {cache_stats['hits']} hit / {cache_stats['misses']} miss "
+                   f"({cache_stats['entries']}件保存)")
+        stream_stats = get_stream_metrics().summary()
+        st.caption(f"AIシェフ TTFT: p50 {stream_stats['ttft_p50_s']}s / p90 {stream_stats['ttft_p90_s']}s")
+        if 'checkout_scanner' in st.session_state:
+            st.caption(f"バーコード読み取り: {st.session_state['checkout_scanner'].summary()}")
 
 def main():
     init_cart_session()
@@ -1,32 +1,24 @@
 import rclpy
 from rclpy.node import Node
+from rclpy.callback_groups import MutuallyExclusiveCallbackGroup
+from rclpy.executors import MultiThreadedExecutor
 from std_msgs.msg import String
-from geometry_msgs.msg import PoseStamped
-from nav2_simple_commander.robot_navigator import BasicNavigator, TaskResult
+from geometry_msgs.msg import PoseStamped, PoseWithCovarianceStamped
+from nav2_simple_commander.robot_navigator import BasicNavigator
 import json
-import time
 import math
 
-# ==========================================
-# ★ここをあなたの計測した座標に書き換えてください★
-# 形式: [x(m), y(m), 向き(ラジアン)]
-# 向き: 0.0=東, 1.57=北, 3.14=西, -1.57=南
-# ==========================================
-ITEM_LOCATIONS = {
-    "curry roux":    [6.563,  7.9155,  1.57],  
-    "beef":         [12.267, 10.7331,  3.14],   
-    "pork":         [8.56, 11.03,  3.14],   
-    "onion":        [8.413, -1.271, 1.57], 
-    "carrot":        [10.81, -1.382, 1.57],
-    "garlic":        [12.507,  -1.453,  1.57],
-    "milk":        [12.288,  8.156,  1.57],
-    "soy sauce":        [8.794,  8.1634,  1.57],
-    "egg":        [12.742,  8.3377,  1.57],
-    "rice":        [3.876,  9.521,  1.57],
-}
-
-# レジ（帰還場所）
-CASHIER_LOCATION = [4.303, -1.636, -1.57]
+from smartcart_sys.map_distance import load_distance_matrix
+from smartcart_sys.nav_sim import SimNavigator
+from smartcart_sys.path_cache import PathCache, CachedPathNavigator, CostmapView
+from smartcart_sys.pickup import scanned_shelf, SKIP_POLICIES
+from smartcart_sys.order_topics import ORDER_TOPIC, ACK_TOPIC, EVENT_TOPIC, ORDER_QOS, unwrap_order
+from smartcart_sys.route_planner import plan_shopping_route, euclidean_distance
+from smartcart_sys.shelf_poses import load_shelf_report, SNAPPED, UNREACHABLE
+from smartcart_sys.item_resolver import find_location, item_label
+from smartcart_sys.store_layout import CASHIER_LOCATION
+from smartcart_sys.trip_executor import TripExecutor, Stop
+from smartcart_sys.trip_status import TripStatusReporter
 
 def get_quaternion_from_euler(yaw):
     """向き(Yawラジアン)をクォータニオン(x,y,z,w)に変換する関数"""
@@ -39,20 +31,166 @@ def get_quaternion_from_euler(yaw):
 class ShoppingNavigator(Node):
     def __init__(self):
         super().__init__('shopping_navigator')
+
+        # 注文・中止・状態問い合わせは、走行管理のタイマーとは別スレッドで受け付ける
+        self.command_group = MutuallyExclusiveCallbackGroup()
+        self.trip_group = MutuallyExclusiveCallbackGroup()
+        # 経路の先読みは計画を待つ間ブロックするので、走行管理のタイマーとは別スレッドで回す
+        self.prefetch_group = MutuallyExclusiveCallbackGroup()
         
         self.subscription = self.create_subscription(
             String,
-            'shopping_list',
+            ORDER_TOPIC,
             self.listener_callback,
-            10)
+            ORDER_QOS,
+            callback_group=self.command_group)
+        # 注文の受付の返事と行程の節目を、注文番号付きで画面側へ返す
+        self.ack_publisher = self.create_publisher(String, ACK_TOPIC, ORDER_QOS)
+        self.event_publisher = self.create_publisher(String, EVENT_TOPIC, ORDER_QOS)
+        # "all" を送ると待ち中の注文も含めて中止
+        self.cancel_subscription = self.create_subscription(
+            String,
+            'shopping_cancel',
+            self.cancel_callback,
+            10,
+            callback_group=self.command_group)
+        self.status_request_subscription = self.create_subscription(
+            String,
+            'trip_status_request',
+            self.status_request_callback,
+            10,
+            callback_group=self.command_group)
+        self.status_publisher = self.create_publisher(String, 'trip_status', 10)
+        # カートのスキャナーの差分イベント。今の棚の商品がスキャンされたらすぐ次へ向かう
+        self.cart_subscription = self.create_subscription(
+            String,
+            'cart_update',
+            self.cart_update_callback,
+            10,
+            callback_group=self.command_group)
+
+        # 巡回ルート計算の出発地点に使う現在位置（AMCLの推定値）
+        self.current_pose = None
+        self.pose_subscription = self.create_subscription(
+            PoseWithCovarianceStamped,
+            'amcl_pose',
+            self.pose_callback,
+            10,
+            callback_group=self.command_group)
         
-        self.navigator = BasicNavigator()
+        # 棚間の経路長（地図から前計算したキャッシュ）。読めなければ直線距離で代用
+        try:
+            self.route_distance = load_distance_matrix()
+        except (OSError, ValueError) as e:
+            self.get_logger().warn(f'⚠️ DEBUG: Distance matrix unavailable, using straight lines: {e}')
+            self.route_distance = euclidean_distance
+
+        # 棚の座標を地図で確かめたもの。障害物に近すぎる座標は近くの安全な位置に寄せてある
+        self.shelf_poses = {}
+        try:
+            for name, entry in load_shelf_report().items():
+                self.shelf_poses[name] = entry['pose']
+                if entry['status'] == SNAPPED:
+                    self.get_logger().warn(
+                        f'📐 DEBUG: Shelf pose "{name}" moved {entry["shift"]:.2f}m to {entry["pose"]} (too close to obstacles)')
+                elif entry['status'] == UNREACHABLE:
+                    self.get_logger().error(f'🚧 DEBUG: Shelf pose "{name}" {entry["pose"]} looks unreachable')
+        except (OSError, ValueError) as e:
+            self.get_logger().warn(f'⚠️ DEBUG: Shelf poses not validated, using them as measured: {e}')
+        self.home = self.shelf_poses.get('cashier', CASHIER_LOCATION)
+
+        # trip_status を送る最短間隔[秒]と、走行中に変化が無くても送る間隔[秒]
+        self.declare_parameter('status_interval', 0.5)
+        self.declare_parameter('status_heartbeat', 2.0)
+        # 'serial': 棚ごとに goToPose を送る / 'waypoints': 全行程を followWaypoints で一括送信
+        self.declare_parameter('trip_mode', 'serial')
+        # 棚での待ち時間[秒]
+        self.declare_parameter('pickup_time', 2.0)
+        # 棚で積み込み(/cart_update)を待つ最大の秒数。棚の商品が全てスキャンされたらすぐ出発する
+        # （0 なら積み込みを待たず、pickup_time だけ止まる）
+        self.declare_parameter('load_timeout', 20.0)
+        # load_timeout までに揃わなかったとき: 'skip'（次の棚へ）/ 'wait'（揃うまで待つ）/ 'abort'（レジへ戻る）
+        self.declare_parameter('pickup_skip', 'skip')
+        # 走行中に届いた注文を今の行程に合流させるか（False なら次の行程として待たせる）
+        self.declare_parameter('merge_orders', True)
+
+        # True なら Gazebo・Nav2 を使わず、地図上の簡易シミュレーターで走らせる（ロジックの確認用）
+        self.declare_parameter('simulate', False)
+        # よく通る区間の経路を使い回す（出発地点は path_cache_cell[m] のマスに丸めて鍵にする）
+        self.declare_parameter('path_cache', True)
+        self.declare_parameter('path_cache_cell', 0.5)
+        # 棚に向かう間・積み込みを待つ間に、次の区間とレジへ戻る区間の経路を先に計算しておく
+        self.declare_parameter('prefetch_paths', True)
+
+        if self.get_parameter('simulate').value:
+            self.get_logger().info('🧪 DEBUG: Using the headless navigation simulator')
+            self.navigator = SimNavigator()
+        else:
+            # 複数台運用では各カートを名前空間付きで起動する（例: --ros-args -r __ns:=/cart1）
+            self.navigator = BasicNavigator(namespace=self.get_namespace().strip('/'))
         
         # 初期位置の設定（とりあえず0,0,0とする）
         #self.set_initial_pose()
 
         self.get_logger().info('🔍 DEBUG: Waiting for Nav2 to activate...')
         self.navigator.waitUntilNav2Active()
+
+        self.trip_navigator = self.navigator
+        self.sim_costmap = None
+        prefetch = None
+        planner = None
+        if self.get_parameter('path_cache').value:
+            if not isinstance(self.navigator, SimNavigator):
+                # 先読みの getPath は走行中にも呼ぶので、走行の指令とは別のノードから出す
+                planner = BasicNavigator(node_name='path_prefetcher', namespace=self.get_namespace().strip('/'))
+            self.trip_navigator = CachedPathNavigator(
+                self.navigator,
+                PathCache(cell_size=self.get_parameter('path_cache_cell').value),
+                make_pose=self.make_pose,
+                get_start=self.current_start,
+                get_costmap=self.fetch_costmap,
+                planner=planner)
+            if self.get_parameter('prefetch_paths').value:
+                prefetch = self.trip_navigator.prefetch
+        load_timeout = self.get_parameter('load_timeout').value
+        trip_mode = self.get_parameter('trip_mode').value
+        if trip_mode == 'waypoints' and load_timeout > 0:
+            # 一括送信では棚で止まる時間を Nav2 の wait_at_waypoint が決めるので、スキャンを待てない
+            self.get_logger().warn('⚠️ DEBUG: trip_mode "waypoints" ignores load_timeout, pickup_skip and pickup_time '
+                                   '(shelves only pause for waypoint_pause_duration); not waiting for scans')
+            load_timeout = 0.0
+        skip_policy = self.get_parameter('pickup_skip').value
+        if skip_policy not in SKIP_POLICIES:
+            self.get_logger().warn(f'⚠️ DEBUG: Unknown pickup_skip "{skip_policy}", using "skip"')
+            skip_policy = 'skip'
+
+        self.trip_executor = TripExecutor(
+            self.trip_navigator,
+            planner=self.plan_stops,
+            make_pose=self.make_pose,
+            home=self.home,
+            on_event=self.on_trip_event,
+            mode=trip_mode,
+            pickup_time=self.get_parameter('pickup_time').value,
+            merge_orders=self.get_parameter('merge_orders').value,
+            prefetch=prefetch,
+            load_timeout=load_timeout if load_timeout > 0 else None,
+            skip_policy=skip_policy)
+        # 現在の立ち寄り先・到着見込み・到着済みの棚を trip_status に送る（送る頻度は間引く）
+        self.status_reporter = TripStatusReporter(
+            self.trip_executor,
+            publish=self.publish_status,
+            distance=self.route_distance,
+            min_interval=self.get_parameter('status_interval').value,
+            heartbeat=self.get_parameter('status_heartbeat').value)
+        # time.sleep で待つ代わりに、タイマーで状態機械を進める
+        self.trip_timer = self.create_timer(0.1, self.on_trip_timer, callback_group=self.trip_group)
+        self.prefetch_timer = None
+        if prefetch is not None and planner is not None:
+            # 先読みは別ノード(path_prefetcher)の getPath で計画するので、走行管理と並行して進められる
+            self.prefetch_timer = self.create_timer(
+                0.1, self.trip_navigator.run_prefetch, callback_group=self.prefetch_group)
+
         self.get_logger().info('✅ DEBUG: Nav2 is Ready! Waiting for shopping list...')
         self.get_logger().info('👉 Hint: Run "ros2 topic pub /shopping_list std_msgs/msg/String \"data: \'[\\\"vegetable\\\", \\\"meat\\\"]\'\" -1"')
 
@@ -68,48 +206,168 @@ class ShoppingNavigator(Node):
         initial_pose.pose.orientation.w = qw
         self.navigator.setInitialPose(initial_pose)
 
+    def pose_callback(self, msg):
+        pose = msg.pose.pose
+        yaw = 2.0 * math.atan2(pose.orientation.z, pose.orientation.w)
+        self.current_pose = [pose.position.x, pose.position.y, yaw]
+
     def listener_callback(self, msg):
         self.get_logger().info(f'📩 DEBUG: Message Received: {msg.data}')
         try:
-            shopping_list = json.loads(msg.data)
-            self.execute_shopping_trip(shopping_list)
+            message = json.loads(msg.data)
         except Exception as e:
             self.get_logger().error(f'❌ DEBUG: JSON Error: {e}')
+            return
+        # 画面からの注文は {"type": "order", "order_id", "session_id", "items"} の形。素のリストも受け付ける
+        envelope, shopping_list = unwrap_order(message)
+        if not shopping_list:
+            if envelope is not None:
+                self.publish_ack(envelope, 'rejected', reason='empty or invalid item list')
+            else:
+                # お会計完了の通知など、買い物リスト以外のメッセージ
+                self.get_logger().info(f'ℹ️ DEBUG: Not a shopping list, ignored: {message}')
+            return
+        order_id = self.execute_shopping_trip(
+            shopping_list, order_id=envelope.get('order_id') if envelope else None)
+        if envelope is not None:
+            unknown = [item_label(item) for item in shopping_list if find_location(item)[0] is None]
+            self.publish_ack(envelope, 'accepted', unknown=unknown,
+                             queued=len(self.trip_executor.status()['queued']))
+        self.get_logger().info(f'🧾 DEBUG: Order #{order_id} accepted')
+
+    def publish_ack(self, envelope, status, **info):
+        ack = String()
+        ack.data = json.dumps(dict(info, order_id=envelope.get('order_id'),
+                                   session_id=envelope.get('session_id'), status=status,
+                                   robot=self.get_namespace()), ensure_ascii=False)
+        self.ack_publisher.publish(ack)
+
+    def cancel_callback(self, msg):
+        clear_queue = msg.data.strip().lower() == 'all'
+        self.get_logger().warn(f'🛑 DEBUG: Cancel requested (clear queue: {clear_queue})')
+        self.trip_executor.cancel(clear_queue=clear_queue)
+
+    def status_request_callback(self, msg):
+        # 走行状態はタイマーのスレッドでまとめて送る
+        self.status_reporter.request()
+
+    def cart_update_callback(self, msg):
+        try:
+            event = json.loads(msg.data)
+        except ValueError:
+            return
+        # 商品の棚をカタログから引き、今の行程の棚と突き合わせる（スナップショットは数えない）
+        scanned = scanned_shelf(event, resolve=self.resolve_location)
+        if scanned is not None:
+            self.trip_executor.item_scanned(*scanned)
+
+    def publish_status(self, data):
+        status = String()
+        status.data = json.dumps(dict(data, robot=self.get_namespace()), ensure_ascii=False, default=str)
+        self.status_publisher.publish(status)
 
-    def execute_shopping_trip(self, shopping_list):
-        for item_name in shopping_list:
-            target_coords = self.find_coordinates(item_name)
-            
-            if target_coords:
-                x, y, yaw = target_coords
-                self.get_logger().info(f'🚀 DEBUG: Trying to go to "{item_name}" at [x={x}, y={y}]')
-                
-                # 移動実行
-                success = self.go_to_spot(target_coords)
-                
-                if success:
-                    self.get_logger().info(f'🏁 DEBUG: Arrived at {item_name}. (Picking up...)')
-                    time.sleep(2.0)
-                else:
-                    self.get_logger().error(f'💀 DEBUG: Failed to reach {item_name}.')
+    def on_trip_timer(self):
+        self.trip_executor.tick()
+        self.status_reporter.tick()
+        if isinstance(self.trip_navigator, CachedPathNavigator) and self.prefetch_timer is None:
+            # シミュレーターはその場で計画が終わるので、走行管理と同じスレッドで先読みする
+            self.trip_navigator.run_prefetch()
+
+    def plan_stops(self, shopping_list, start=None):
+        """買い物リストを棚ごとにまとめ、移動距離が最短になる順番に並べ替える"""
+        # 現在位置が分からない場合はレジから出発したものとみなす
+        if start is None:
+            start = self.current_pose if self.current_pose else self.home
+        plan, items_by_key, unknown = plan_shopping_route(
+            shopping_list,
+            ('start', start),
+            ('cashier', self.home),
+            resolve=self.resolve_location,
+            distance=self.route_distance)
+
+        if unknown:
+            self.get_logger().warn(f'❓ DEBUG: Location unknown for {len(unknown)} item(s): {unknown}')
+        self.get_logger().info(
+            f'🧭 DEBUG: Route planned ({plan.method}): {[key for key, _ in plan.stops]} '
+            f'{plan.planned_distance:.1f}m (naive {plan.naive_distance:.1f}m, saved {plan.saving:.1f}m)')
+        return [Stop(key, coords, items_by_key[key]) for key, coords in plan.stops]
+
+    def execute_shopping_trip(self, shopping_list, order_id=None):
+        """注文を行程キューに入れる（移動はタイマーから進むので、ここではブロックしない）"""
+        return self.trip_executor.submit(shopping_list, order_id=order_id)
+
+    def publish_order_event(self, event, trip, stop, info):
+        """行程の節目を order_event に出す（走行中の残り距離は出さない）"""
+        if event == 'progress':
+            return
+        data = dict(info, event=event, order_id=trip.order_id, robot=self.get_namespace())
+        if stop is not None:
+            data['stop'] = stop.key
+            data['items'] = [item_label(item) for item in stop.items]
+        out = String()
+        out.data = json.dumps(data, ensure_ascii=False, default=str)
+        self.event_publisher.publish(out)
+
+    def on_trip_event(self, event, trip, stop, info):
+        self.publish_order_event(event, trip, stop, info)
+        self.status_reporter.on_event(event, trip, stop, info)
+        logger = self.get_logger()
+        if event == 'trip_started':
+            logger.info(f'🛒 DEBUG: Order #{trip.order_id} started')
+        elif event == 'heading':
+            x, y = stop.coords[0], stop.coords[1]
+            logger.info(f'🚀 DEBUG: Trying to go to "{stop.name}" at [x={x}, y={y}]')
+        elif event == 'progress' and info.get('distance_remaining') is not None:
+            logger.info(f'   🚶 Moving... Distance remaining: {info["distance_remaining"]:.2f}m',
+                        throttle_duration_sec=0.5)
+        elif event == 'arrived':
+            logger.info(f'🏁 DEBUG: Arrived at {stop.name}. (Picking up...)')
+        elif event == 'departed':
+            if info['reason'] == 'timeout':
+                logger.warn(f'⏰ DEBUG: Gave up waiting at {stop.name} after {info["dwell"]:.1f}s '
+                            f'({info["scanned"]}/{len(stop.items)} scanned)')
             else:
-                self.get_logger().warn(f'❓ DEBUG: Location unknown for "{item_name}"')
+                logger.info(f'📦 DEBUG: Left {stop.name} after {info["dwell"]:.1f}s ({info["reason"]})')
+        elif event == 'skipped':
+            logger.info(f'⏭️ DEBUG: Skipped {stop.name} ({info["reason"]})')
+        elif event == 'failed':
+            logger.error(f'💀 DEBUG: Failed to reach {stop.name}.')
+        elif event == 'order_merged':
+            logger.info(f'🔀 DEBUG: Order #{info["merged_order_id"]} merged into order #{trip.order_id}')
+        elif event == 'returning':
+            logger.info('🏠 DEBUG: Returning to Cashier...')
+        elif event == 'trip_finished':
+            logger.info(f'✅ DEBUG: Order #{trip.order_id} finished in {info["duration"]:.1f}s '
+                        f'({info["dwell"]:.1f}s at shelves)')
+            if isinstance(self.trip_navigator, CachedPathNavigator):
+                logger.info(f'🗺️ DEBUG: Path cache: {self.trip_navigator.summary()}')
+        elif event == 'trip_canceled':
+            logger.warn(f'⚠️ DEBUG: Order #{trip.order_id} was CANCELED')
+
+    def current_start(self):
+        """経路キャッシュの鍵にする現在位置（分からなければ None）"""
+        if isinstance(self.navigator, SimNavigator):
+            return self.navigator.current_pose()
+        return self.current_pose
 
-        # 帰還
-        self.get_logger().info('🏠 DEBUG: Returning to Cashier...')
-        self.go_to_spot(CASHIER_LOCATION)
+    def fetch_costmap(self):
+        """キャッシュした経路の確認に使うグローバルコストマップ"""
+        if isinstance(self.navigator, SimNavigator):
+            # シミュレーターの地図は変わらないので1回だけ作る
+            if self.sim_costmap is None:
+                self.sim_costmap = CostmapView.from_grid(self.navigator.planner.grid, self.navigator.planner.blocked)
+            return self.sim_costmap
+        return CostmapView.from_msg(self.navigator.getGlobalCostmap())
 
-    def find_coordinates(self, item_name):
-        search_key = item_name.lower()
-        for key, coords in ITEM_LOCATIONS.items():
-            if key in search_key or search_key in key:
-                return coords
-        return None
+    def resolve_location(self, item):
+        """商品 -> (棚の名前, 確かめた座標)"""
+        key, coords = find_location(item)
+        return key, self.shelf_poses.get(key, coords)
 
-    def go_to_spot(self, coords):
+    def make_pose(self, coords):
         goal_pose = PoseStamped()
         goal_pose.header.frame_id = 'map'
-        goal_pose.header.stamp = self.navigator.get_clock().now().to_msg()
+        goal_pose.header.stamp = self.get_clock().now().to_msg()
         
         # 座標のセット
         goal_pose.pose.position.x = float(coords[0])
@@ -122,37 +380,15 @@ class ShoppingNavigator(Node):
         goal_pose.pose.orientation.y = qy
         goal_pose.pose.orientation.z = qz
         goal_pose.pose.orientation.w = qw
-        
-        # --- 移動コマンド送信 ---
-        self.navigator.goToPose(goal_pose)
-
-        # --- 移動中の監視ループ ---
-        i = 0
-        while not self.navigator.isTaskComplete():
-            i += 1
-            feedback = self.navigator.getFeedback()
-            if feedback and i % 5 == 0:
-                rem = feedback.distance_remaining
-                self.get_logger().info(f'   🚶 Moving... Distance remaining: {rem:.2f}m')
-            
-            time.sleep(0.1)
-
-        result = self.navigator.getResult()
-        if result == TaskResult.SUCCEEDED:
-            return True
-        elif result == TaskResult.CANCELED:
-            self.get_logger().warn('⚠️ DEBUG: Task was CANCELED')
-            return False
-        elif result == TaskResult.FAILED:
-            self.get_logger().error('⚠️ DEBUG: Task FAILED')
-            return False
-        return False
+        return goal_pose
 
 def main():
     rclpy.init()
     node = ShoppingNavigator()
+    executor = MultiThreadedExecutor()
+    executor.add_node(node)
     try:
-        rclpy.spin(node)
+        executor.spin()
     except KeyboardInterrupt:
         pass
     finally:
@@ -0,0 +1,241 @@
+"""
+バーコード読み取りの共通処理（app.py のセルフレジと cart_scanner.py の両方で使う）。
+
+DecodeCascade は グレースケール → 縮小 → 二値化(大津/適応的) → シャープ化 → 回転 の順に
+読めるまで試す。各手法の成功率と処理時間を記録し、「1msあたりの成功率」が高い順に並べ替える。
+
+GatedDecoder は毎フレーム全体を pyzbar に渡す代わりに、
+  1. グレースケール化
+  2. 前回デコードした画像から動きが無ければスキップ
+  3. 直前に見つかったバーコードの周辺(ROI)だけを先に読む
+  4. 一定間隔で必ず全体を読み直す
+を行い、低スペックなカート用PCでの1フレームあたりのCPU使用量を減らす。
+"""
+import threading
+import time
+
+import cv2
+import numpy as np
+from pyzbar.locations import Point, Rect
+from pyzbar.pyzbar import decode
+
+
+def to_gray(frame):
+    if frame.ndim == 2:
+        return frame
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+
+def offset_result(obj, dx, dy):
+    """ROIで読んだ結果の座標を元の画像の座標に戻す"""
+    rect = Rect(obj.rect.left + dx, obj.rect.top + dy, obj.rect.width, obj.rect.height)
+    polygon = [Point(p.x + dx, p.y + dy) for p in obj.polygon]
+    return obj._replace(rect=rect, polygon=polygon)
+
+
+def _rect_from_polygon(polygon):
+    xs = [p.x for p in polygon]
+    ys = [p.y for p in polygon]
+    return Rect(min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))
+
+
+def _scale_back(factor):
+    def unmap(obj, shape):
+        polygon = [Point(int(p.x / factor), int(p.y / factor)) for p in obj.polygon]
+        return obj._replace(rect=_rect_from_polygon(polygon), polygon=polygon)
+    return unmap
+
+
+def _rotate_back(obj, shape):
+    # ROTATE_90_CLOCKWISE で (x, y) -> (H-1-y, x) になるので逆変換する
+    height = shape[0]
+    polygon = [Point(p.y, height - 1 - p.x) for p in obj.polygon]
+    return obj._replace(rect=_rect_from_polygon(polygon), polygon=polygon)
+
+
+def _same(obj, shape):
+    return obj
+
+
+_SHARPEN_KERNEL = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]], dtype=np.float32)
+
+# (名前, 画像の変換, 結果の座標を元に戻す関数)。この並びが初期の試行順
+DEFAULT_STRATEGIES = [
+    ('gray', lambda gray: gray, _same),
+    ('downscaled', lambda gray: cv2.resize(gray, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA),
+     _scale_back(0.5)),
+    ('otsu', lambda gray: cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1], _same),
+    ('adaptive', lambda gray: cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10), _same),
+    ('sharpened', lambda gray: cv2.filter2D(gray, -1, _SHARPEN_KERNEL), _same),
+    ('rotated', lambda gray: cv2.rotate(gray, cv2.ROTATE_90_CLOCKWISE), _rotate_back),
+]
+
+
+class Strategy:
+    def __init__(self, name, transform, unmap):
+        self.name = name
+        self.transform = transform
+        self.unmap = unmap
+        self.attempts = 0
+        self.hits = 0
+        self.total_ms = 0.0
+
+    def score(self):
+        """1msあたりの成功率（試行回数が少ないうちは楽観的に見積もる）"""
+        hit_rate = (self.hits + 1.0) / (self.attempts + 2.0)
+        avg_ms = self.total_ms / self.attempts if self.attempts else 1.0
+        return hit_rate / (avg_ms + 0.1)
+
+
+class DecodeCascade:
+    """
+    max_attempts  : 1回の decode() で試す手法の数の上限（None なら全て）
+    explore_every : 上限があっても、この回数に1回は全手法を試して統計を更新する
+    """
+
+    def __init__(self, strategies=DEFAULT_STRATEGIES, max_attempts=None, explore_every=20):
+        self.strategies = [Strategy(*strategy) for strategy in strategies]
+        self.max_attempts = max_attempts
+        self.explore_every = explore_every
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def decode(self, image):
+        """読めた手法で打ち切って結果を返す（座標は元の画像の座標）"""
+        gray = to_gray(image)
+        with self._lock:
+            self._calls += 1
+            order = list(self.strategies)
+            limit = self.max_attempts
+            if limit is not None and self._calls % self.explore_every == 0:
+                limit = None
+
+        for strategy in order[:limit]:
+            start = time.perf_counter()
+            results = decode(strategy.transform(gray))
+            elapsed = (time.perf_counter() - start) * 1000.0
+            with self._lock:
+                strategy.attempts += 1
+                strategy.total_ms += elapsed
+                if results:
+                    strategy.hits += 1
+            if results:
+                self._reorder()
+                return [strategy.unmap(obj, gray.shape) for obj in results]
+        self._reorder()
+        return []
+
+    def _reorder(self):
+        with self._lock:
+            self.strategies.sort(key=lambda strategy: strategy.score(), reverse=True)
+
+    def summary(self):
+        with self._lock:
+            return ', '.join(
+                f'{s.name} {s.hits}/{s.attempts} {s.total_ms / s.attempts if s.attempts else 0.0:.1f}ms'
+                for s in self.strategies)
+
+
+class GatedDecoder:
+    """
+    motion_threshold   : 縮小画像の平均輝度差がこれ未満なら「動き無し」
+    settle_frames      : 動きが止まってからも続けて読むフレーム数（ぶれた画像で読み損ねた場合の保険）
+    roi_padding        : ROIを前回のバーコード枠から広げる割合
+    roi_ttl            : 前回のバーコード位置をROIとして使う期間[秒]
+    full_scan_interval : 動きが無くても全体を読み直す間隔[秒]
+    cascade            : 実際の読み取りに使う DecodeCascade（毎フレーム呼ぶので試す手法は絞る）
+    """
+
+    def __init__(self, motion_threshold=4.0, settle_frames=3, roi_padding=0.5,
+                 roi_ttl=1.5, full_scan_interval=1.0, cascade=None, clock=time.monotonic):
+        self.cascade = cascade if cascade is not None else DecodeCascade(max_attempts=2)
+        self.motion_threshold = motion_threshold
+        self.settle_frames = settle_frames
+        self.roi_padding = roi_padding
+        self.roi_ttl = roi_ttl
+        self.full_scan_interval = full_scan_interval
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._reference = None      # 前回デコードしたときの縮小画像
+        self._still_count = 0
+        self._last_rect = None      # (left, top, width, height, 時刻)
+        self._last_full_scan = 0.0
+        self.stats = {'frames': 0, 'skipped': 0, 'roi': 0, 'roi_hits': 0, 'full': 0}
+
+    def _thumbnail(self, gray):
+        return cv2.resize(gray, (80, 60), interpolation=cv2.INTER_AREA)
+
+    def _should_decode(self, thumb, now):
+        """動きの有無と前回の全体スキャンからの時間で、このフレームを読むか決める"""
+        if self._reference is None or now - self._last_full_scan >= self.full_scan_interval:
+            return True
+        motion = float(cv2.absdiff(thumb, self._reference).mean())
+        if motion >= self.motion_threshold:
+            self._still_count = 0
+            return True
+        self._still_count += 1
+        return self._still_count <= self.settle_frames
+
+    def _roi(self, shape, now):
+        if self._last_rect is None:
+            return None
+        left, top, width, height, seen_at = self._last_rect
+        if now - seen_at > self.roi_ttl:
+            return None
+        pad_x = int(width * self.roi_padding) + 16
+        pad_y = int(height * self.roi_padding) + 16
+        x0, y0 = max(0, left - pad_x), max(0, top - pad_y)
+        x1, y1 = min(shape[1], left + width + pad_x), min(shape[0], top + height + pad_y)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return x0, y0, x1, y1
+
+    def decode(self, frame):
+        """
+        バーコードを読む。動きが無くて読まなかったフレームは None を返す
+        （読んだが見つからなかった場合は空のリスト）
+        """
+        now = self.clock()
+        gray = to_gray(frame)
+        thumb = self._thumbnail(gray)
+
+        with self._lock:
+            self.stats['frames'] += 1
+            if not self._should_decode(thumb, now):
+                self.stats['skipped'] += 1
+                return None
+            self._reference = thumb
+            roi = self._roi(gray.shape, now)
+            full_scan_due = now - self._last_full_scan >= self.full_scan_interval
+
+        results = []
+        if roi is not None and not full_scan_due:
+            x0, y0, x1, y1 = roi
+            results = [offset_result(obj, x0, y0) for obj in self.cascade.decode(gray[y0:y1, x0:x1])]
+            with self._lock:
+                self.stats['roi'] += 1
+                if results:
+                    self.stats['roi_hits'] += 1
+
+        if not results:
+            results = self.cascade.decode(gray)
+            with self._lock:
+                self.stats['full'] += 1
+                self._last_full_scan = now
+
+        with self._lock:
+            if results:
+                rect = results[0].rect
+                self._last_rect = (rect.left, rect.top, rect.width, rect.height, now)
+        return results
+
+    def summary(self):
+        """集計を文字列にしてリセットする"""
+        with self._lock:
+            stats = dict(self.stats)
+            for key in self.stats:
+                self.stats[key] = 0
+        return (f"gate: {stats['frames']} frames, skipped {stats['skipped']}, "
+                f"roi {stats['roi_hits']}/{stats['roi']}, full {stats['full']} | cascade: {self.cascade.summary()}")
@@ -0,0 +1,357 @@
+"""
+買い物の行程の処理性能を測るベンチマーク（ROS・Gazebo 不要）。
+
+合成した注文（リストの長さ・売れ筋の偏り・到着間隔を指定）を、ナビゲーターと同じ
+TripExecutor + 巡回ルート計画に流し、nav_sim のシミュレーター（または直線距離の StubNavigator）で走らせる。
+行程時間・注文の待ち時間・棚で待った時間のパーセンタイル、走行距離、1時間あたりの商品数、失敗数を JSON で出す。
+plan_ms は出発のたびに経路を用意して走り出すまでにかかった時間（経路キャッシュの有無で同じ測り方）、
+route_ms は注文の棚を回る順番を決めるのにかかった時間。
+--scan-delay を付けると、棚に着いてから商品ごとに平均その秒数でスキャンされたものとして、
+決まった待ち時間の代わりにスキャンで出発する動き（--load-timeout まで待つ）を測る。
+
+    python3 -m smartcart_sys.benchmark --orders 500 --rate 60 --output data/cache/bench.json
+    python3 -m smartcart_sys.benchmark --orders 500 --rate 60 --compare data/cache/bench.json
+"""
+import argparse
+import datetime
+import heapq
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from smartcart_sys.catalog import get_catalog
+from smartcart_sys.fleet import StubNavigator, VirtualClock, make_stub_planner
+from smartcart_sys.item_resolver import find_location
+from smartcart_sys.map_distance import load_distance_matrix
+from smartcart_sys.nav_sim import SimNavigator
+from smartcart_sys.path_cache import PathCache, CachedPathNavigator, CostmapView
+from smartcart_sys.pickup import SKIP_POLICIES
+from smartcart_sys.store_layout import ITEM_LOCATIONS, CASHIER_LOCATION
+from smartcart_sys.trip_executor import TripExecutor, IDLE, DWELLING
+
+REPORT_VERSION = 2
+
+# 比較のときに見る値と、大きいほど良いか
+COMPARED_METRICS = [
+    ('trip_s.p50', False), ('trip_s.p90', False), ('latency_s.p50', False), ('latency_s.p90', False),
+    ('items_per_hour', True), ('distance_per_item_m', False), ('failed_stops', False), ('dwell_s.mean', False),
+]
+
+
+def item_pool(source):
+    """'shelves' は棚の名前、'catalog' はカタログの商品名（棚の無い商品も混ざる）"""
+    if source == 'shelves':
+        return sorted(ITEM_LOCATIONS)
+    return [name for names in get_catalog().categories().values() for name in names]
+
+
+class Workload:
+    """
+    注文を作る。売れ筋は Zipf 分布（skew=0 なら一様、大きいほど上位の商品に偏る）、
+    到着はポアソン過程（rate は1時間あたりの注文数。0 なら前の注文が終わるとすぐ次が来る）。
+    """
+
+    def __init__(self, pool, min_items=2, max_items=6, skew=1.0, rate=60.0, seed=0):
+        self.rng = random.Random(seed)
+        self.pool = list(pool)
+        self.rng.shuffle(self.pool)   # どの商品が売れ筋になるかも seed で決める
+        self.weights = [1.0 / (rank + 1) ** skew for rank in range(len(self.pool))]
+        self.min_items = min_items
+        self.max_items = min(max_items, len(self.pool))
+        self.rate = rate
+
+    def shopping_list(self):
+        size = self.rng.randint(min(self.min_items, self.max_items), self.max_items)
+        # 重み付きの非復元抽出（Efraimidis-Spirakis）
+        keys = [(self.rng.random() ** (1.0 / weight), name) for weight, name in zip(self.weights, self.pool)]
+        return [name for _, name in sorted(keys, reverse=True)[:size]]
+
+    def orders(self, count):
+        """[(到着時刻, 商品リスト), ...]。rate=0 のときの到着時刻は None"""
+        t = 0.0
+        orders = []
+        for _ in range(count):
+            if self.rate > 0:
+                t += self.rng.expovariate(self.rate / 3600.0)
+            orders.append((t if self.rate > 0 else None, self.shopping_list()))
+        return orders
+
+
+def percentiles(values):
+    if not values:
+        return {'mean': 0.0, 'p50': 0.0, 'p90': 0.0, 'p99': 0.0, 'max': 0.0}
+    values = sorted(values)
+
+    def at(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 2)
+    return {'mean': round(sum(values) / len(values), 2), 'p50': at(0.5), 'p90': at(0.9),
+            'p99': at(0.99), 'max': round(values[-1], 2)}
+
+
+class TimedNavigator:
+    """goToPose / followWaypoints が返るまでの時間（出発時に経路を用意する時間）を plan_ms に記録する"""
+
+    def __init__(self, navigator, plan_ms):
+        self.navigator = navigator
+        self.plan_ms = plan_ms
+
+    def __getattr__(self, name):
+        return getattr(self.navigator, name)
+
+    def _timed(self, send, *args, **kwargs):
+        begin = time.perf_counter()
+        try:
+            return send(*args, **kwargs)
+        finally:
+            self.plan_ms.append((time.perf_counter() - begin) * 1000.0)
+
+    def goToPose(self, *args, **kwargs):
+        return self._timed(self.navigator.goToPose, *args, **kwargs)
+
+    def followWaypoints(self, *args, **kwargs):
+        return self._timed(self.navigator.followWaypoints, *args, **kwargs)
+
+
+def run_benchmark(orders, backend='sim', mode='serial', merge_orders=True, pickup_time=2.0, path_cache=False,
+                  prefetch=False, scan_delay=None, load_timeout=30.0, skip_policy='skip', seed=0, dt=0.1):
+    """注文を1台のカートで処理し、集計を返す"""
+    clock = VirtualClock()
+    rng = random.Random(seed)
+    distance = load_distance_matrix()
+    if backend == 'sim':
+        navigator = SimNavigator(clock)
+    else:
+        navigator = StubNavigator(clock, distance=distance)
+    trip_navigator = navigator
+    if path_cache and backend == 'sim':
+        costmap = CostmapView.from_grid(navigator.planner.grid, navigator.planner.blocked)
+        trip_navigator = CachedPathNavigator(navigator, PathCache(), make_pose=lambda coords: coords,
+                                             get_start=navigator.current_pose, get_costmap=lambda: costmap,
+                                             clock=clock)
+
+    planner = make_stub_planner(navigator, distance)
+    route_times = []
+    plan_times = []
+
+    def timed_planner(items, start):
+        begin = time.perf_counter()
+        stops = planner(items, start)
+        route_times.append((time.perf_counter() - begin) * 1000.0)
+        return stops
+
+    arrivals = {}
+    finished = {}
+    merged = {}
+    trip_durations = []
+    dwell_times = []
+    scans = []   # (スキャンされる時刻, 棚) のヒープ
+    counts = {'items_requested': 0, 'items_delivered': 0, 'unknown_items': 0,
+              'failed_stops': 0, 'stops': 0, 'pickup_timeouts': 0}
+
+    def on_event(event, trip, stop, info):
+        if event == 'arrived' and scan_delay is not None and stop.items:
+            # 客が棚の商品を1つずつ取ってスキャンする
+            t = clock.now
+            for _ in stop.items:
+                t += rng.expovariate(1.0 / scan_delay) if scan_delay > 0 else 0.0
+                heapq.heappush(scans, (t, stop.key))
+        if event == 'departed':
+            dwell_times.append(info['dwell'])
+            # 時間で出た・揃って出た棚は全部、待ちきれずに出た棚はスキャンされた分だけ積んだとみなす
+            if info['reason'] == 'timeout':
+                counts['pickup_timeouts'] += 1
+                counts['items_delivered'] += info['scanned']
+            else:
+                counts['items_delivered'] += len(stop.items)
+        if event == 'order_merged':
+            merged.setdefault(trip.order_id, []).append(info['merged_order_id'])
+        elif event == 'arrived' and stop.items:
+            counts['stops'] += 1
+            if mode == 'waypoints':
+                # 一括送信では棚で待たない（departed が来ない）ので、着いた時点で積んだとみなす
+                counts['items_delivered'] += len(stop.items)
+        elif event == 'skipped' and stop.items and info.get('reason') == 'prescanned':
+            # 向かう前にスキャンが揃っていた棚
+            counts['items_delivered'] += len(stop.items)
+        elif event == 'failed' and stop.items:
+            counts['stops'] += 1
+            counts['failed_stops'] += 1
+        elif event == 'trip_finished':
+            trip_durations.append(info['duration'])
+            for order_id in [trip.order_id] + merged.pop(trip.order_id, []):
+                finished[order_id] = clock()
+
+    prefetching = prefetch and trip_navigator is not navigator
+    executor = TripExecutor(TimedNavigator(trip_navigator, plan_times), timed_planner,
+                            make_pose=lambda coords: coords, home=CASHIER_LOCATION,
+                            on_event=on_event, mode=mode, pickup_time=pickup_time,
+                            merge_orders=merge_orders, prefetch=trip_navigator.prefetch if prefetching else None,
+                            load_timeout=load_timeout if scan_delay is not None else None,
+                            skip_policy=skip_policy, clock=clock)
+
+    wall_start = time.perf_counter()
+    next_order = 0
+    while next_order < len(orders) or executor.state != IDLE or executor.queue:
+        # 届いた注文を入れる（到着時刻が None の注文は、手が空いたら入れる）
+        while next_order < len(orders):
+            arrival, items = orders[next_order]
+            if arrival is None:
+                if executor.state != IDLE or executor.queue:
+                    break
+                arrival = clock.now
+            elif arrival > clock.now:
+                break
+            executor.submit(items, order_id=next_order)
+            arrivals[next_order] = arrival
+            counts['items_requested'] += len(items)
+            next_order += 1
+        while scans and scans[0][0] <= clock.now:
+            executor.item_scanned(heapq.heappop(scans)[1])
+        executor.tick()
+        if prefetching:
+            trip_navigator.run_prefetch()
+
+        # 何も起きない間は、次の出来事（到着・積み込み終わり・次の注文）まで時計を進める
+        wakes = []
+        if executor.state == DWELLING:
+            wakes.append(executor.dwell_until)
+            if scans:
+                wakes.append(scans[0][0])
+        elif executor.state != IDLE:
+            wakes.append(navigator.busy_until())
+        if next_order < len(orders) and orders[next_order][0] is not None:
+            wakes.append(orders[next_order][0])
+        wakes = [wake for wake in wakes if wake is not None]
+        clock.now = max(clock.now + dt, min(wakes)) if wakes else clock.now + dt
+    wall = time.perf_counter() - wall_start
+
+    counts['unknown_items'] = sum(1 for _, items in orders for item in items if find_location(item)[0] is None)
+    latencies = [finished[i] - arrivals[i] for i in finished]
+    span = max(finished.values()) - min(arrivals.values()) if finished else 0.0
+    hours = span / 3600.0
+    distance_m = navigator.travelled
+    results = {
+        'orders': len(orders),
+        'trips': len(trip_durations),
+        'makespan_s': round(span, 1),
+        'trip_s': percentiles(trip_durations),
+        'latency_s': percentiles(latencies),
+        'plan_ms': percentiles(plan_times),
+        'route_ms': percentiles(route_times),
+        'dwell_s': percentiles(dwell_times),
+        'distance_m': round(distance_m, 1),
+        'distance_per_item_m': round(distance_m / counts['items_delivered'], 2) if counts['items_delivered'] else 0.0,
+        'items_per_hour': round(counts['items_delivered'] / hours, 1) if hours > 0 else 0.0,
+        'orders_per_hour': round(len(finished) / hours, 1) if hours > 0 else 0.0,
+        **counts,
+        'wall_s': round(wall, 2),
+        'speedup': round(clock.now / wall, 1) if wall > 0 else 0.0,
+    }
+    if trip_navigator is not navigator:
+        # 計画時間は plan_ms（キャッシュ無しと同じ測り方）で見る
+        results['path_cache'] = {key: value for key, value in trip_navigator.summary().items() if key != 'plan_ms_mean'}
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _lookup(report, path):
+    value = report
+    for key in path.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare(report, baseline, threshold):
+    """基準の結果と比べて、threshold[%] 以上悪くなった値の一覧を返す（表示もする）"""
+    regressions = []
+    for path, higher_is_better in COMPARED_METRICS:
+        new, old = _lookup(report['results'], path), _lookup(baseline['results'], path)
+        if new is None or old is None:
+            continue
+        change = (new - old) / old * 100.0 if old else (0.0 if new == old else 100.0)
+        worse = -change if higher_is_better else change
+        mark = ' <-- regression' if worse > threshold else ''
+        print(f'{path:>22}: {old:>10} -> {new:>10} ({change:+.1f}%){mark}', file=sys.stderr)
+        if worse > threshold:
+            regressions.append(path)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end trip benchmark with synthetic orders (no ROS required)')
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--min-items', type=int, default=2)
+    parser.add_argument('--max-items', type=int, default=8)
+    parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of item popularity (0 = uniform)')
+    parser.add_argument('--rate', type=float, default=40.0, help='orders per hour (0 = back to back)')
+    parser.add_argument('--source', choices=['shelves', 'catalog'], default='shelves')
+    parser.add_argument('--backend', choices=['sim', 'stub'], default='sim')
+    parser.add_argument('--mode', choices=['serial', 'waypoints'], default='serial')
+    parser.add_argument('--no-merge', action='store_true', help='do not merge orders into a running trip')
+    parser.add_argument('--pickup-time', type=float, default=2.0)
+    parser.add_argument('--scan-delay', type=float, help='mean seconds per item scan; leave a shelf when its items '
+                                                           'are scanned instead of after --pickup-time')
+    parser.add_argument('--load-timeout', type=float, default=30.0, help='max seconds to wait for scans')
+    parser.add_argument('--skip-policy', choices=SKIP_POLICIES, default='skip')
+    parser.add_argument('--path-cache', action='store_true', help='reuse planned paths (sim backend only)')
+    parser.add_argument('--prefetch', action='store_true', help='plan the next leg while driving and dwelling '
+                                                                '(needs --path-cache)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here (default: stdout)')
+    parser.add_argument('--compare', help='baseline JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=5.0, help='allowed regression in percent')
+    args = parser.parse_args()
+    if args.mode == 'waypoints' and args.scan_delay is not None:
+        parser.error('--scan-delay needs --mode serial (waypoints mode only pauses for waypoint_pause)')
+
+    config = {
+        'orders': args.orders, 'min_items': args.min_items, 'max_items': args.max_items, 'skew': args.skew,
+        'rate': args.rate, 'source': args.source, 'backend': args.backend, 'mode': args.mode,
+        'merge_orders': not args.no_merge, 'pickup_time': args.pickup_time, 'scan_delay': args.scan_delay,
+        'load_timeout': args.load_timeout, 'skip_policy': args.skip_policy, 'path_cache': args.path_cache,
+        'prefetch': args.prefetch, 'seed': args.seed,
+    }
+    workload = Workload(item_pool(args.source), args.min_items, args.max_items, args.skew, args.rate, args.seed)
+    results = run_benchmark(workload.orders(args.orders), backend=args.backend, mode=args.mode,
+                            merge_orders=not args.no_merge, pickup_time=args.pickup_time,
+                            path_cache=args.path_cache, prefetch=args.prefetch, scan_delay=args.scan_delay,
+                            load_timeout=args.load_timeout, skip_policy=args.skip_policy, seed=args.seed)
+    report = {
+        'version': REPORT_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'config': config,
+        'results': results,
+    }
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != config:
+            print('warning: baseline was run with a different configuration', file=sys.stderr)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,19 +5,70 @@ from std_msgs.msg import String
 from sensor_msgs.msg import CompressedImage
 import cv2
 import numpy as np
-from pyzbar.pyzbar import decode
 import json
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from smartcart_sys.barcode_decoder import DecodeCascade, GatedDecoder
+from smartcart_sys.cart_state import CartState
+from smartcart_sys.catalog import get_catalog
+
+# 商品データは data/catalog.csv（手元のバーコードで試すならそこに追加。再起動は不要）
+
+class LatestFrame:
+    """長さ1のキュー。新しいフレームが来たら古いものは捨てる（処理が遅れても常に最新を扱う）"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get(self, timeout=0.5):
+        """次のフレームを取り出す（無ければ timeout 秒待って None）"""
+        with self._cond:
+            if self._frame is None:
+                self._cond.wait(timeout)
+            frame, self._frame = self._frame, None
+            return frame
+
+
+class StageStats:
+    """パイプラインの各段の処理回数と処理時間"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def summary(self, period):
+        """前回からの集計を文字列にしてリセットする"""
+        with self._lock:
+            avg = self.total / self.count * 1000.0 if self.count else 0.0
+            text = f'{self.name}: {self.count / period:4.1f}fps avg {avg:5.1f}ms max {self.max * 1000.0:5.1f}ms'
+            self.reset()
+            return text
 
-# --- 簡易商品データベース ---
-# 実際の商品のJANコード（バーコード下の数字）に書き換えてください
-PRODUCT_DB = {
-    "4900000000001": {"name": "りんご", "price": 150},
-    "4900000000002": {"name": "牛乳", "price": 200},
-    "4900000000003": {"name": "卵パック", "price": 250},
-    "4900000000004": {"name": "キャベツ", "price": 120},
-    # テスト用（手元の適当なバーコードで試すならここに追加）
-}
 
 class CartScannerNode(Node):
     def __init__(self):
@@ -30,12 +81,51 @@ class CartScannerNode(Node):
         # 画像配信用のPublisher
         self.image_publisher_ = self.create_publisher(CompressedImage, 'cart/image_raw/compressed', 10)
         
-        # カートの中身
-        self.cart_items = []
+        # カートの中身（合計金額と商品ごとの個数を差分で更新する）
+        self.cart = CartState()
+
+        # カートの操作・全体の再送要求を受けるSubscriber
+        # 例: {"action": "remove", "sku": "4900000000002"} / {"action": "undo"} / {"action": "snapshot"}
+        self.command_subscription = self.create_subscription(
+            String, 'cart_command', self.command_callback, 10)
+        # 途中から購読したノードのために、定期的に全体(スナップショット)も送る
+        self.declare_parameter('snapshot_period', 10.0)
+        self.snapshot_timer = self.create_timer(
+            self.get_parameter('snapshot_period').value, self.publish_snapshot)
         
         # 連続読み取り防止用のバッファ
         self.last_code = None
         self.last_scan_time = 0
+        self.scan_lock = threading.Lock()
+
+        # デコードを並列で行うスレッド数
+        self.declare_parameter('decode_workers', 2)
+        # 各段の処理時間をログに出す間隔[秒]
+        self.declare_parameter('stats_period', 5.0)
+        # 'gated': 動きが無いフレームは読まず、前回のバーコード周辺から読む / 'full': 毎フレーム全体を読む
+        self.declare_parameter('decode_mode', 'gated')
+        # 1フレームで試す読み取り手法の数（セルフレジの静止画と違い毎フレーム読むので絞る）
+        self.declare_parameter('decode_attempts', 2)
+        self.cascade = DecodeCascade(max_attempts=self.get_parameter('decode_attempts').value)
+        if self.get_parameter('decode_mode').value == 'gated':
+            self.decoder = GatedDecoder(cascade=self.cascade)
+        else:
+            self.decoder = None
+
+        # --- 画像配信の設定（購読者がいない間は圧縮もしない） ---
+        # バーコードを追跡していない間の配信レート[FPS]
+        self.declare_parameter('publish_fps', 5.0)
+        # バーコード追跡中の配信レート[FPS]（0 ならカメラの全フレーム）
+        self.declare_parameter('tracking_fps', 0.0)
+        # 配信前の縮小率 (1.0 = 縮小しない)
+        self.declare_parameter('publish_scale', 0.5)
+        self.declare_parameter('jpeg_quality', 70)
+        # True なら追跡中はバーコード周辺の切り抜きだけを送る
+        self.declare_parameter('publish_roi_only', False)
+        # 最後に読めてから何秒間を「追跡中」とみなすか
+        self.declare_parameter('tracking_hold', 1.0)
+        self.last_seen = None  # (left, top, width, height, 時刻)
+        self.last_publish_time = 0.0
         
         self.get_logger().info('カメラ起動中... "q"キーで終了します')
         self.run_camera_loop()
@@ -70,90 +160,227 @@ class CartScannerNode(Node):
         cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
         cap.set(cv2.CAP_PROP_FPS, 30)
         
-        try:
-            while rclpy.ok():
-                ret, frame = cap.read()
-                if not ret:
-                    self.get_logger().warn("フレームの取得に失敗しました。再試行中...")
-                    time.sleep(0.5)
-                    continue
+        # 撮影 → (最新フレーム) → デコード(スレッドプール) / JPEG圧縮・送信 を別スレッドで回す
+        # 画面表示とROSのコールバックはメインスレッドのまま
+        self.running = True
+        self.decode_slot = LatestFrame()
+        self.publish_slot = LatestFrame()
+        self.display_slot = LatestFrame()
+        self.stats = {name: StageStats(name) for name in ('capture', 'decode', 'publish')}
+        self.overlays = []  # 直近のデコード結果 (文字列, 左, 上)
+        workers = self.get_parameter('decode_workers').value
 
-                # バーコード検出
-                decoded_objects = decode(frame)
-                
-                for obj in decoded_objects:
-                    # バーコードのデータを取得
-                    barcode_data = obj.data.decode("utf-8")
-                    
-                    # 枠線を描画（視覚確認用）
-                    points = obj.polygon
-                    if len(points) == 4:
-                        pts = [(p.x, p.y) for p in points]
-                        # cv2.polylines(frame, [np.array(pts)], True, (0, 255, 0), 2)
-
-                    # --- 商品認識・計算ロジック ---
-                    # 同じ商品を連続で読み込まないように2秒あける
-                    if barcode_data != self.last_code or (time.time() - self.last_scan_time > 2.0):
-                        self.process_item(barcode_data)
-                        self.last_code = barcode_data
-                        self.last_scan_time = time.time()
-                    
-                    # 認識したコードを画面に表示
-                    cv2.putText(frame, barcode_data, (obj.rect.left, obj.rect.top - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+        threads = [
+            threading.Thread(target=self.capture_loop, args=(cap,), daemon=True),
+            threading.Thread(target=self.decode_loop, args=(workers,), daemon=True),
+            threading.Thread(target=self.publish_loop, daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
 
-                # カメラ映像を表示（デバッグ用ウィンドウ）
-                cv2.imshow('Smart Cart Scanner', frame)
-                
-                # ROSへ画像を送信
-                self.publish_image(frame)
+        stats_period = self.get_parameter('stats_period').value
+        last_stats = time.time()
+        try:
+            while rclpy.ok():
+                frame = self.display_slot.get(timeout=0.05)
+                if frame is not None:
+                    self.draw_overlays(frame)
+                    # カメラ映像を表示（デバッグ用ウィンドウ）
+                    cv2.imshow('Smart Cart Scanner', frame)
 
                 # ROSのコールバック処理を回す（Publishなど）
-                rclpy.spin_once(self, timeout_sec=0.01)
+                rclpy.spin_once(self, timeout_sec=0.001)
+
+                if time.time() - last_stats >= stats_period:
+                    period = time.time() - last_stats
+                    last_stats = time.time()
+                    summary = ' | '.join(stat.summary(period) for stat in self.stats.values())
+                    if self.decoder is not None:
+                        summary += ' | ' + self.decoder.summary()
+                    else:
+                        summary += ' | cascade: ' + self.cascade.summary()
+                    self.get_logger().info(f'{summary} | dropped {self.decode_slot.dropped}')
 
                 # 'q'キーで終了
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
                     
         finally:
+            self.running = False
+            for thread in threads:
+                thread.join(timeout=1.0)
             if cap:
                 cap.release()
             cv2.destroyAllWindows()
 
+    def capture_loop(self, cap):
+        """カメラの速度(30FPS)で読み続け、各段に最新フレームを渡す"""
+        while self.running and rclpy.ok():
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                self.get_logger().warn("フレームの取得に失敗しました。再試行中...")
+                time.sleep(0.5)
+                continue
+            self.stats['capture'].add(time.perf_counter() - start)
+            # 文字を書き込む段には別のコピーを渡す（デコード中の画像を書き換えないため）
+            self.decode_slot.put(frame)
+            if self.should_publish():
+                self.publish_slot.put(frame.copy())
+            self.display_slot.put(frame.copy())
+
+    def decode_loop(self, workers):
+        """最新フレームをスレッドプールに渡す（同時に処理するのは workers 枚まで）"""
+        slots = threading.Semaphore(workers)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode') as pool:
+            while self.running and rclpy.ok():
+                if not slots.acquire(timeout=0.5):
+                    continue
+                frame = self.decode_slot.get()
+                if frame is None:
+                    slots.release()
+                    continue
+                future = pool.submit(self.decode_frame, frame)
+                future.add_done_callback(lambda _: slots.release())
+
+    def decode_frame(self, frame):
+        start = time.perf_counter()
+        # バーコード検出
+        if self.decoder is not None:
+            decoded_objects = self.decoder.decode(frame)
+            if decoded_objects is None:
+                # 動きが無いので読まなかった（前回の表示をそのまま残す）
+                return
+        else:
+            decoded_objects = self.cascade.decode(frame)
+        self.stats['decode'].add(time.perf_counter() - start)
+
+        overlays = []
+        for obj in decoded_objects:
+            # バーコードのデータを取得
+            barcode_data = obj.data.decode("utf-8")
+
+            # --- 商品認識・計算ロジック ---
+            # 同じ商品を連続で読み込まないように2秒あける（複数スレッドから呼ばれるのでロック）
+            with self.scan_lock:
+                is_new = barcode_data != self.last_code or (time.time() - self.last_scan_time > 2.0)
+                if is_new:
+                    self.last_code = barcode_data
+                    self.last_scan_time = time.time()
+            if is_new:
+                self.process_item(barcode_data)
+
+            overlays.append((barcode_data, obj.rect.left, obj.rect.top))
+            self.last_seen = (obj.rect.left, obj.rect.top, obj.rect.width, obj.rect.height, time.time())
+        self.overlays = overlays
+
+    def draw_overlays(self, frame):
+        """認識したコードを画像に書き込む"""
+        for barcode_data, left, top in list(self.overlays):
+            cv2.putText(frame, barcode_data, (left, top - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+
+    def publish_loop(self):
+        """JPEG圧縮と送信はデコードと独立して行う"""
+        while self.running and rclpy.ok():
+            frame = self.publish_slot.get()
+            if frame is None:
+                continue
+            start = time.perf_counter()
+            self.draw_overlays(frame)
+            # ROSへ画像を送信（追跡中で publish_roi_only ならバーコード周辺だけ）
+            roi = self.tracking_roi(frame.shape) if self.get_parameter('publish_roi_only').value else None
+            self.publish_image(frame, roi)
+            self.stats['publish'].add(time.perf_counter() - start)
+
     def process_item(self, barcode):
         """図の「商品認識」→「計算」を行う部分"""
-        if barcode in PRODUCT_DB:
-            item = PRODUCT_DB[barcode]
-            self.cart_items.append(item)
-            
-            # 合計金額計算
-            total_price = sum(i['price'] for i in self.cart_items)
-            
-            # JSON作成
-            cart_data = {
-                "latest_item": item['name'],
-                "total_price": total_price,
-                "item_count": len(self.cart_items),
-                "items": self.cart_items
-            }
-            
-            # JSON送信
-            msg = String()
-            msg.data = json.dumps(cart_data, ensure_ascii=False)
-            self.publisher_.publish(msg)
+        item = get_catalog().lookup(barcode)
+        if item is not None:
+            # 合計金額は差分で更新し、送るのも変化した分だけ
+            event = self.cart.add(barcode, item['name'], item['price'])
+            self.publish_cart_event(event)
             
-            self.get_logger().info(f'追加: {item["name"]} (合計: {total_price}円)')
+            self.get_logger().info(f'追加: {item["name"]} (合計: {event["total_price"]}円)')
         else:
             self.get_logger().warn(f'未登録の商品です: {barcode}')
 
-    def publish_image(self, frame):
+    def command_callback(self, msg):
+        try:
+            command = json.loads(msg.data)
+        except Exception as e:
+            self.get_logger().error(f'JSON Error: {e}')
+            return
+        action = command.get('action')
+        if action == 'remove':
+            event = self.cart.remove(command.get('sku'), int(command.get('qty', 1)))
+        elif action == 'undo':
+            event = self.cart.undo()
+        elif action == 'clear':
+            event = self.cart.clear()
+        elif action == 'snapshot':
+            event = self.cart.snapshot()
+        else:
+            self.get_logger().warn(f'不明なコマンドです: {command}')
+            return
+        if event is not None:
+            self.publish_cart_event(event)
+
+    def publish_snapshot(self):
+        self.publish_cart_event(self.cart.snapshot())
+
+    def publish_cart_event(self, event):
+        # JSON送信
+        msg = String()
+        msg.data = json.dumps(event, ensure_ascii=False)
+        self.publisher_.publish(msg)
+
+    def is_tracking(self):
+        last_seen = self.last_seen
+        return last_seen is not None and time.time() - last_seen[4] <= self.get_parameter('tracking_hold').value
+
+    def should_publish(self):
+        """購読者がいて、かつ配信レートの間隔が空いていれば True"""
+        if self.image_publisher_.get_subscription_count() == 0:
+            return False
+        if self.is_tracking():
+            fps = self.get_parameter('tracking_fps').value
+        else:
+            fps = self.get_parameter('publish_fps').value
+        now = time.time()
+        if fps > 0 and now - self.last_publish_time < 1.0 / fps:
+            return False
+        self.last_publish_time = now
+        return True
+
+    def tracking_roi(self, shape):
+        """追跡中のバーコードの周辺 (x0, y0, x1, y1)。追跡していなければ None"""
+        if not self.is_tracking():
+            return None
+        left, top, width, height, _ = self.last_seen
+        pad = max(width, height) // 2 + 20
+        x0, y0 = max(0, left - pad), max(0, top - pad)
+        x1, y1 = min(shape[1], left + width + pad), min(shape[0], top + height + pad)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return x0, y0, x1, y1
+
+    def publish_image(self, frame, roi=None):
         """OpenCVの画像をROSのCompressedImageメッセージとして送信"""
         msg = CompressedImage()
         msg.header.stamp = self.get_clock().now().to_msg()
         msg.format = "jpeg"
+
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            frame = frame[y0:y1, x0:x1]
+        scale = self.get_parameter('publish_scale').value
+        if 0 < scale < 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
         
         # JPEGに圧縮
-        ret, buffer = cv2.imencode('.jpg', frame)
+        quality = int(self.get_parameter('jpeg_quality').value)
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
         if ret:
             msg.data = np.array(buffer).tobytes()
             self.image_publisher_.publish(msg)
@@ -0,0 +1,134 @@
+"""
+カートの中身と、/cart_update で送る差分メッセージ。
+
+送る側(cart_scanner.py)は add / remove / undo / clear のたびに小さな差分イベントを出し、
+ときどき全体のスナップショットを出す。受ける側(app.py など)は apply() で同じ状態を再現する。
+イベントには通し番号(seq)があり、抜けが分かったらスナップショットを要求して追いつく。
+送る側が再起動したときは session が変わるので、同じくスナップショットで追いつく。
+"""
+import threading
+import uuid
+
+
+class CartState:
+    def __init__(self):
+        # 受ける側として使う場合は、最初のスナップショットで session と seq が上書きされる
+        self._lock = threading.Lock()
+        self.lines = {}        # sku -> {'sku', 'name', 'price', 'qty'}
+        self.total_price = 0
+        self.item_count = 0
+        self.seq = 0
+        self.session = uuid.uuid4().hex[:8]
+        self._history = []     # 取り消し用: (sku, 名前, 値段, 増減した個数)
+
+    # ---------- 送る側 ----------
+
+    def _change(self, sku, name, price, qty, action):
+        """sku の個数を qty 増減させ、差分イベントを返す（ロックを取った状態で呼ぶ）"""
+        line = self.lines.get(sku)
+        if line is None:
+            line = self.lines[sku] = {'sku': sku, 'name': name, 'price': price, 'qty': 0}
+        line['qty'] += qty
+        self.total_price += line['price'] * qty
+        self.item_count += qty
+        if line['qty'] <= 0:
+            del self.lines[sku]
+        self.seq += 1
+        return {
+            'type': action,
+            'session': self.session,
+            'seq': self.seq,
+            'sku': sku,
+            'name': line['name'],
+            'price': line['price'],
+            'qty': qty,
+            'line_qty': max(line['qty'], 0),
+            'total_price': self.total_price,
+            'item_count': self.item_count,
+        }
+
+    def add(self, sku, name, price, qty=1):
+        with self._lock:
+            self._history.append((sku, name, price, qty))
+            event = self._change(sku, name, price, qty, 'add')
+            event['latest_item'] = name
+            return event
+
+    def remove(self, sku, qty=1):
+        """1個取り出す。カートに無ければ None"""
+        with self._lock:
+            line = self.lines.get(sku)
+            if line is None:
+                return None
+            qty = min(qty, line['qty'])
+            self._history.append((sku, line['name'], line['price'], -qty))
+            return self._change(sku, line['name'], line['price'], -qty, 'remove')
+
+    def undo(self):
+        """直前の追加・取り出しを取り消す。取り消すものが無ければ None"""
+        with self._lock:
+            while self._history:
+                sku, name, price, qty = self._history.pop()
+                if qty > 0:
+                    line = self.lines.get(sku)
+                    if line is None:
+                        continue  # 既に取り出し済み
+                    qty = min(qty, line['qty'])
+                return self._change(sku, name, price, -qty, 'undo')
+            return None
+
+    def clear(self):
+        with self._lock:
+            self.lines.clear()
+            self.total_price = 0
+            self.item_count = 0
+            self._history.clear()
+            self.seq += 1
+            return {'type': 'clear', 'session': self.session, 'seq': self.seq, 'total_price': 0, 'item_count': 0}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'type': 'snapshot',
+                'session': self.session,
+                'seq': self.seq,
+                'total_price': self.total_price,
+                'item_count': self.item_count,
+                'items': [dict(line) for line in self.lines.values()],
+            }
+
+    # ---------- 受ける側 ----------
+
+    def apply(self, event):
+        """
+        受け取ったイベントを反映する。
+        抜け(seqの飛び)があって反映できなければ False を返すので、スナップショットを要求する。
+        """
+        with self._lock:
+            kind = event.get('type')
+            if kind == 'snapshot':
+                self.lines = {line['sku']: dict(line) for line in event['items']}
+                self.total_price = event['total_price']
+                self.item_count = event['item_count']
+                self.seq = event['seq']
+                self.session = event['session']
+                return True
+            if event.get('session') != self.session:
+                return False
+            if event.get('seq', 0) <= self.seq:
+                return True  # 古いイベント（スナップショットに含まれている）
+            if event['seq'] != self.seq + 1:
+                return False
+            if kind == 'clear':
+                self.lines.clear()
+            else:
+                sku = event['sku']
+                if event['line_qty'] > 0:
+                    self.lines[sku] = {'sku': sku, 'name': event['name'],
+                                       'price': event['price'], 'qty': event['line_qty']}
+                else:
+                    self.lines.pop(sku, None)
+            self.total_price = event['total_price']
+            self.item_count = event['item_count']
+            self.seq = event['seq']
+            return True
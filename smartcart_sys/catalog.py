@@ -0,0 +1,324 @@
+"""
+商品カタログ（JANコード → 商品名・値段・売り場・棚）。
+
+元データは data/catalog.csv（列: jan, name, price, category, shelf）。
+shelf は store_layout.ITEM_LOCATIONS の棚の名前で、棚が決まっていない商品は空欄。
+category が空欄の商品（バーコードでだけ買える商品）は売り場一覧に出さない。
+
+実際に読むのは CSV から作るバイナリ(data/cache/catalog.bin)で、
+  - JANコードを整数にして昇順に並べた配列（二分探索で引く）
+  - 同じ並びの 値段 / 名前番号 / 売り場番号 / 棚番号 の配列
+  - CSV の行の順に並べた商品の番号（売り場一覧を CSV の順に出すため）
+  - 名前・売り場・棚の文字列を重複なしでまとめた表
+から成る。ファイルを mmap して配列をそのまま参照するので、商品が何万件あっても
+1件ずつの Python オブジェクトは作らず、app.py と cart_scanner.py など複数のプロセスで同じページを共有する。
+
+CSV を書き換えると、最初に気づいたプロセスがバイナリを作り直し(os.replace で差し替え)、
+他のプロセスはバイナリの更新でそれに気づいて開き直す。再起動は要らない。
+
+オフラインでの作成:
+    python3 -m smartcart_sys.catalog
+"""
+import array
+import bisect
+import csv
+import functools
+import mmap
+import os
+import struct
+import threading
+import time
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+DEFAULT_CSV = os.path.join(DATA_DIR, 'catalog.csv')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+DEFAULT_BINARY = os.path.join(CACHE_DIR, 'catalog.bin')
+
+# CSV・バイナリの更新を確かめる間隔[秒]
+CHECK_INTERVAL = 2.0
+
+MAGIC = b'SCAT'
+VERSION = 2
+# magic, version, 商品数, 文字列数, 文字列の合計バイト数, 予備（配列を8バイト境界に置くため）
+# バイナリはその場で作るキャッシュなので、バイト順はこのPCのもの(native)
+_HEADER = struct.Struct('=4sIIIII')
+NO_STRING = -1
+
+
+def parse_jan(code):
+    """'4902102000186' / 4902102000186 -> 整数。数字でなければ None"""
+    if isinstance(code, int):
+        return code
+    code = str(code).strip()
+    if not code.isdigit():
+        return None
+    return int(code)
+
+
+def format_jan(jan):
+    """整数 -> JANコードの文字列（先頭の0を補って8桁か13桁にする）"""
+    text = str(jan)
+    return text.zfill(8) if len(text) <= 8 else text.zfill(13)
+
+
+def read_csv(path=DEFAULT_CSV):
+    """CSV を読み、(jan, name, price, category, shelf) のリストを CSV の順に返す"""
+    products = {}
+    with open(path, encoding='utf-8', newline='') as f:
+        for line_no, row in enumerate(csv.DictReader(f), start=2):
+            jan = parse_jan(row.get('jan') or '')
+            if jan is None:
+                raise ValueError(f'{path}:{line_no}: invalid JAN code {row.get("jan")!r}')
+            try:
+                price = int(row.get('price') or 0)
+            except ValueError:
+                raise ValueError(f'{path}:{line_no}: invalid price {row.get("price")!r}')
+            # 同じJANが2回出てきたら後のものを使う
+            products[jan] = (jan, row['name'].strip(), price,
+                             (row.get('category') or '').strip(), (row.get('shelf') or '').strip())
+    return list(products.values())
+
+
+def pack_catalog(products):
+    """read_csv() の結果をバイナリにする"""
+    strings = []
+    string_ids = {}
+
+    def intern(text):
+        if not text:
+            return NO_STRING
+        if text not in string_ids:
+            string_ids[text] = len(strings)
+            strings.append(text)
+        return string_ids[text]
+
+    # 売り場は CSV に最初に出てきた順に番号を振る（売り場一覧の並び順になる）
+    for product in products:
+        intern(product[3])
+
+    keys = array.array('q')
+    prices = array.array('i')
+    name_ids = array.array('i')
+    category_ids = array.array('i')
+    shelf_ids = array.array('i')
+    ordered = sorted(products)
+    for jan, name, price, category, shelf in ordered:
+        keys.append(jan)
+        prices.append(price)
+        name_ids.append(intern(name))
+        category_ids.append(intern(category))
+        shelf_ids.append(intern(shelf))
+    position = {product[0]: i for i, product in enumerate(ordered)}
+    rows = array.array('i', [position[product[0]] for product in products])
+
+    encoded = [text.encode('utf-8') for text in strings]
+    offsets = array.array('i', [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    blob = b''.join(encoded)
+
+    header = _HEADER.pack(MAGIC, VERSION, len(keys), len(strings), len(blob), 0)
+    return b''.join([header, keys.tobytes(), prices.tobytes(), name_ids.tobytes(),
+                     category_ids.tobytes(), shelf_ids.tobytes(), rows.tobytes(), offsets.tobytes(), blob])
+
+
+def build_catalog(csv_path=DEFAULT_CSV, binary_path=DEFAULT_BINARY):
+    """CSV からバイナリを作る。途中の状態を他のプロセスに見せないよう、別名で書いてから差し替える"""
+    data = pack_catalog(read_csv(csv_path))
+    os.makedirs(os.path.dirname(binary_path), exist_ok=True)
+    tmp_path = f'{binary_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, binary_path)
+    return binary_path
+
+
+class Catalog:
+    """バイナリ1つ分のカタログ（読み取り専用）"""
+
+    def __init__(self, buffer):
+        view = memoryview(buffer)
+        magic, version, count, string_count, blob_size, _ = _HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a catalog file (or an old version)')
+
+        def take(offset, length, fmt, itemsize):
+            return view[offset:offset + length * itemsize].cast(fmt), offset + length * itemsize
+
+        offset = _HEADER.size
+        self.keys, offset = take(offset, count, 'q', 8)
+        self.prices, offset = take(offset, count, 'i', 4)
+        self.name_ids, offset = take(offset, count, 'i', 4)
+        self.category_ids, offset = take(offset, count, 'i', 4)
+        self.shelf_ids, offset = take(offset, count, 'i', 4)
+        self.rows, offset = take(offset, count, 'i', 4)
+        self.string_offsets, offset = take(offset, string_count + 1, 'i', 4)
+        self.blob = view[offset:offset + blob_size]
+        if len(self.blob) != blob_size:
+            raise ValueError('catalog file is truncated')
+
+        self._buffer = buffer
+        self._lock = threading.Lock()
+        self._decoded = {}       # 文字列番号 -> str（使ったものだけ）
+        self._categories = None
+        self._shelves = None
+
+    @classmethod
+    def open(cls, path=DEFAULT_BINARY):
+        with open(path, 'rb') as f:
+            # ファイルを閉じても mmap は有効。差し替えられても古い中身を見続ける
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def from_csv(cls, path=DEFAULT_CSV):
+        """ファイルを作らずにメモリ上で読む（確認用）"""
+        return cls(pack_catalog(read_csv(path)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, code):
+        return self._index(code) is not None
+
+    def _index(self, code):
+        jan = parse_jan(code)
+        if jan is None:
+            return None
+        i = bisect.bisect_left(self.keys, jan)
+        if i < len(self.keys) and self.keys[i] == jan:
+            return i
+        return None
+
+    def string(self, string_id):
+        if string_id == NO_STRING:
+            return ''
+        text = self._decoded.get(string_id)
+        if text is None:
+            start, end = self.string_offsets[string_id], self.string_offsets[string_id + 1]
+            text = self._decoded.setdefault(string_id, bytes(self.blob[start:end]).decode('utf-8'))
+        return text
+
+    def product(self, i):
+        return {
+            'jan': format_jan(self.keys[i]),
+            'name': self.string(self.name_ids[i]),
+            'price': self.prices[i],
+            'category': self.string(self.category_ids[i]),
+            'shelf': self.string(self.shelf_ids[i]),
+        }
+
+    def lookup(self, code):
+        """JANコードから商品を引く。登録されていなければ None"""
+        i = self._index(code)
+        if i is None:
+            return None
+        return self.product(i)
+
+    def _group(self, ids):
+        """{文字列: [商品の番号, ...]}。文字列は番号順（売り場は CSV に出てきた順）、商品は CSV の行の順"""
+        groups = {}
+        for i in self.rows:
+            string_id = ids[i]
+            if string_id != NO_STRING:
+                groups.setdefault(string_id, []).append(i)
+        return {self.string(string_id): rows for string_id, rows in sorted(groups.items())}
+
+    def categories(self):
+        """{売り場: [商品名, ...]}（売り場一覧の画面用。初めて呼んだときに作る）"""
+        with self._lock:
+            if self._categories is None:
+                self._categories = {
+                    category: [self.string(self.name_ids[i]) for i in rows]
+                    for category, rows in self._group(self.category_ids).items()}
+            return self._categories
+
+    def shelves(self):
+        """{棚の名前: [商品名, ...]}（商品名から棚を探すときの別名に使う）"""
+        with self._lock:
+            if self._shelves is None:
+                self._shelves = {
+                    shelf: [self.string(self.name_ids[i]) for i in rows]
+                    for shelf, rows in self._group(self.shelf_ids).items()}
+            return self._shelves
+
+    def shelf_of(self, code):
+        """JANコード -> 棚の名前（棚が決まっていない・未登録なら None）"""
+        i = self._index(code)
+        if i is None or self.shelf_ids[i] == NO_STRING:
+            return None
+        return self.string(self.shelf_ids[i])
+
+
+class CatalogService:
+    """
+    いま有効な Catalog を返す。CHECK_INTERVAL ごとに CSV とバイナリの更新時刻を確かめ、
+    CSV が新しければバイナリを作り直し、バイナリが差し替えられていれば開き直す。
+    """
+
+    def __init__(self, csv_path=DEFAULT_CSV, binary_path=DEFAULT_BINARY,
+                 check_interval=CHECK_INTERVAL, clock=time.monotonic):
+        self.csv_path = csv_path
+        self.binary_path = binary_path
+        self.check_interval = check_interval
+        self.clock = clock
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._catalog = None
+        self._signature = None
+        self._checked_at = None
+
+    def get(self):
+        with self._lock:
+            now = self.clock()
+            if self._catalog is None or now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                self._refresh()
+            return self._catalog
+
+    def _refresh(self):
+        try:
+            csv_mtime = os.stat(self.csv_path).st_mtime_ns
+        except FileNotFoundError:
+            csv_mtime = None   # バイナリだけ配布されている場合
+        try:
+            binary_mtime = os.stat(self.binary_path).st_mtime_ns
+        except FileNotFoundError:
+            binary_mtime = None
+
+        if csv_mtime is not None and (binary_mtime is None or csv_mtime > binary_mtime):
+            build_catalog(self.csv_path, self.binary_path)
+
+        stat = os.stat(self.binary_path)
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature != self._signature:
+            self._catalog = Catalog.open(self.binary_path)
+            self._signature = signature
+            self.reloads += 1
+
+
+@functools.lru_cache(maxsize=1)
+def default_service():
+    return CatalogService()
+
+
+def get_catalog():
+    """data/catalog.csv のカタログ（更新されていれば読み直したもの）"""
+    return default_service().get()
+
+
+def main():
+    start = time.perf_counter()
+    path = build_catalog()
+    build_ms = (time.perf_counter() - start) * 1000.0
+
+    start = time.perf_counter()
+    catalog = Catalog.open(path)
+    open_ms = (time.perf_counter() - start) * 1000.0
+
+    print(f'{len(catalog)} products, {len(catalog.categories())} categories, '
+          f'{len(catalog.shelves())} shelves -> {path} ({os.path.getsize(path)} bytes)')
+    print(f'build {build_ms:.1f}ms, open {open_ms:.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
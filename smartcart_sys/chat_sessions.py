@@ -0,0 +1,177 @@
+"""
+AIシェフのチャットを、Streamlit のセッションごとに使い回す。
+
+以前は1回の発言ごとに GenerativeModel を作り直し、st.session_state.messages の全履歴から
+start_chat() していたので、会話が長くなるほど1回あたりの処理が重くなっていた。
+ChatSessionManager はセッションIDごとにモデルとチャットを保持し、
+  - 画面の履歴のうち、まだチャットに入っていない分（キャッシュから返した応答など）だけを足す
+  - 履歴の見積もりトークン数が token_budget を超えたら古いやり取りを要点1行にまとめて捨てる
+  - idle_timeout 以上使われていないセッションと、max_sessions を超えた分を古い順に捨てる
+を行う。店頭の端末が何台あってもメモリは max_sessions 分で頭打ちになる。
+"""
+import collections
+import threading
+import time
+
+from smartcart_sys.chat_stream import iter_text
+
+DEFAULT_TOKEN_BUDGET = 6000
+DEFAULT_IDLE_TIMEOUT = 30 * 60.0
+DEFAULT_MAX_SESSIONS = 200
+
+# 要点にまとめるとき、1つの要望から残す文字数
+SUMMARY_CHARS = 40
+
+
+def estimate_tokens(text):
+    """おおよそのトークン数（UTF-8で4バイトあたり1。日本語は1文字およそ1トークンになる）"""
+    return len(str(text).encode('utf-8')) // 4 + 1
+
+
+def _content(role, text):
+    return {'role': role, 'parts': [text]}
+
+
+class ManagedChat:
+    """1つのセッションのモデルとチャット。turns はチャットに入っている (役割, 本文) の写し"""
+
+    def __init__(self, model, system_instruction, token_budget, count_tokens, clock):
+        self.model = model
+        self.system_instruction = system_instruction
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+        self.clock = clock
+        self.chat = model.start_chat(history=[])
+        self.turns = []
+        self.summary = []        # 捨てたやり取りの要望の要点
+        self.synced = 0          # 画面の履歴のうち、何件目までをチャットに入れたか
+        self.trimmed = 0         # 捨てた要望の数
+        self.last_used = clock()
+        self._streaming = False  # stream=True の応答を最後まで受け取っていない
+
+    def _contents(self):
+        contents = []
+        if self.summary:
+            contents.append(_content('user', '（これまでの要望: ' + ' / '.join(self.summary) + '）'))
+            contents.append(_content('model', '承知しました。その流れで続けます。'))
+        return contents + [_content(role, text) for role, text in self.turns]
+
+    def _rebuild(self):
+        self.chat = self.model.start_chat(history=self._contents())
+        self._streaming = False
+
+    def _append(self, turns):
+        if not turns:
+            return
+        self.turns.extend(turns)
+        if not self._trim():
+            self.chat.history = list(self.chat.history) + [_content(role, text) for role, text in turns]
+
+    def tokens(self):
+        return sum(self.count_tokens(text) for text in self.summary) + \
+            sum(self.count_tokens(text) for _, text in self.turns)
+
+    def _trim(self):
+        """予算を超えていたら古いやり取りを要望の要点だけ残して捨て、チャットを作り直す。作り直したら True"""
+        if self.tokens() <= self.token_budget:
+            return False
+        # 直近の1往復は残す。残りの先頭が user の発言になるよう、model の発言も続けて捨てる
+        while len(self.turns) > 2 and (self.tokens() > self.token_budget or self.turns[0][0] != 'user'):
+            role, text = self.turns.pop(0)
+            if role == 'user':
+                self.summary.append(' '.join(text.split())[:SUMMARY_CHARS])
+                self.trimmed += 1
+        self._rebuild()
+        return True
+
+    def sync(self, history):
+        """
+        画面の履歴（今回の発言より前の (役割, 本文) の並び）に合わせる。
+        足りない分だけ足し、履歴が短くなっていたら（会話をやり直した）作り直す。
+        """
+        self.last_used = self.clock()
+        if len(history) < self.synced:
+            self.turns = []
+            self.summary = []
+            self.synced = 0
+            self._rebuild()
+        elif self._streaming:
+            # 前回の応答を最後まで受け取れなかった（画面の再実行など）
+            self._rebuild()
+        new_turns = list(history[self.synced:])
+        self.synced = len(history)
+        self._append(new_turns)
+
+    def send(self, history, prompt):
+        """今回の発言を送り、応答を文字列の断片で返すジェネレーター"""
+        self.sync(history)
+        self._streaming = True
+        parts = []
+        for part in iter_text(self.chat.send_message(prompt, stream=True)):
+            parts.append(part)
+            yield part
+        self._streaming = False
+        # チャット自身が履歴に足した分を写しにも入れる
+        self.turns.extend([('user', prompt), ('model', ''.join(parts))])
+        self.synced = len(history) + 2
+        self._trim()
+        self.last_used = self.clock()
+
+    def add_turn(self, history, prompt, reply):
+        """モデルを通さずに返した応答（キャッシュなど）をチャットに入れる"""
+        self.sync(history)
+        self._append([('user', prompt), ('model', reply)])
+        self.synced = len(history) + 2
+
+
+class ChatSessionManager:
+    def __init__(self, make_model, token_budget=DEFAULT_TOKEN_BUDGET, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 max_sessions=DEFAULT_MAX_SESSIONS, count_tokens=estimate_tokens, clock=time.monotonic):
+        self.make_model = make_model
+        self.token_budget = token_budget
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.count_tokens = count_tokens
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.sessions = collections.OrderedDict()   # セッションID -> ManagedChat（古い順）
+        self.stats = {'created': 0, 'reused': 0, 'evicted': 0}
+
+    def get(self, session_id, system_instruction):
+        """セッションのチャットを返す（無い・システム指示が変わった場合は作る）"""
+        with self._lock:
+            self._evict()
+            managed = self.sessions.get(session_id)
+            if managed is not None and managed.system_instruction == system_instruction:
+                self.sessions.move_to_end(session_id)
+                self.stats['reused'] += 1
+                managed.last_used = self.clock()
+                return managed
+        # モデルの生成はロックの外で行う
+        managed = ManagedChat(self.make_model(system_instruction), system_instruction,
+                              self.token_budget, self.count_tokens, self.clock)
+        with self._lock:
+            self.sessions[session_id] = managed
+            self.sessions.move_to_end(session_id)
+            self.stats['created'] += 1
+            self._evict()
+        return managed
+
+    def drop(self, session_id):
+        with self._lock:
+            self.sessions.pop(session_id, None)
+
+    def _evict(self):
+        now = self.clock()
+        for session_id in [sid for sid, managed in self.sessions.items()
+                           if now - managed.last_used > self.idle_timeout]:
+            del self.sessions[session_id]
+            self.stats['evicted'] += 1
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    def summary(self):
+        with self._lock:
+            self._evict()
+            return dict(self.stats, active=len(self.sessions))
@@ -0,0 +1,207 @@
+"""
+AIシェフの応答をストリーミングで受け取るための部品。
+
+ShoppingListParser : 届いた断片を順に読み、```json の買い物リストが閉じた時点でリストを返す
+                     （応答の最後まで待たずに「買い物に行く」ボタンを出せる）
+StreamingReply     : 断片を受け取りながら全文・買い物リスト・最初の断片までの時間(TTFT)を記録する
+StreamMetrics      : TTFT などを全セッション分まとめる
+
+動作確認（偽モデルで、断片の到着とリストが揃った時点を表示する）:
+    python3 -m smartcart_sys.chat_stream
+"""
+import collections
+import json
+import threading
+import time
+
+from smartcart_sys.gemini_stub import StubModel
+
+
+def iter_text(response):
+    """Gemini の stream=True の応答から文字列の断片だけを取り出す"""
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # 安全フィルタなどで本文が無い断片
+            continue
+        if text:
+            yield text
+
+
+def is_shopping_list(value):
+    """[{"en": "Carrot", "ja": "人参"}, ...] の形（空でない）なら True"""
+    return (isinstance(value, list) and bool(value)
+            and all(isinstance(item, dict) and 'en' in item and 'ja' in item for item in value))
+
+
+class ShoppingListParser:
+    """
+    断片を feed() するたびに、新しく届いた文字だけを走査する。
+    '[' から対応する ']' までを json.loads して、{"en": ..., "ja": ...} の辞書が並んだリストなら買い物リストとする。
+    文章中の「[注意]」「例: [1]」などで買い物リストにならなかった場合は、その次の '[' から探し直す。
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.json_text = None   # 見つかったリストのJSON文字列
+        self.items = None       # 見つかったリスト
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk):
+        """リストが揃っていればそれを返す（まだなら None）"""
+        if self.items is not None:
+            return self.items
+        self.buffer += chunk
+        while self._pos < len(self.buffer):
+            ch = self.buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '`':
+                if len(self.buffer) - self._pos < 3:
+                    break  # 「```」が断片の境目で切れているかもしれないので続きを待つ
+                if self.buffer.startswith('```', self._pos):
+                    # コードブロックの始まり・終わりで探し直す（閉じていない '[' を引きずらない）
+                    self._start = None
+                    self._pos += 3
+                    continue
+            elif ch == '[':
+                if self._start is None:
+                    self._start = self._pos
+                    self._depth = 0
+                self._depth += 1
+            elif self._start is None:
+                pass
+            elif ch == '"':
+                self._in_string = True
+            elif ch == ']':
+                self._depth -= 1
+                if self._depth == 0:
+                    if self._close(self.buffer[self._start:self._pos + 1]):
+                        self._pos += 1
+                        return self.items
+                    # リストではなかった: この '[' の次から探し直す
+                    self._pos = self._start
+                    self._start = None
+            self._pos += 1
+        return None
+
+    def _close(self, candidate):
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            return False
+        if not is_shopping_list(value):
+            return False
+        self.json_text = candidate
+        self.items = value
+        return True
+
+
+class StreamMetrics:
+    """全セッションの TTFT と応答全体の時間（直近 window 件）"""
+
+    def __init__(self, window=200):
+        self._lock = threading.Lock()
+        self.ttft = collections.deque(maxlen=window)
+        self.total = collections.deque(maxlen=window)
+        self.replies = 0
+        self.cached = 0
+
+    def record(self, ttft, total, cached=False):
+        with self._lock:
+            self.replies += 1
+            if cached:
+                self.cached += 1
+                return
+            self.ttft.append(ttft)
+            self.total.append(total)
+
+    @staticmethod
+    def _percentile(values, q):
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self):
+        with self._lock:
+            ttft, total = list(self.ttft), list(self.total)
+            replies, cached = self.replies, self.cached
+        return {
+            'replies': replies,
+            'cached': cached,
+            'ttft_p50_s': round(self._percentile(ttft, 0.5), 2),
+            'ttft_p90_s': round(self._percentile(ttft, 0.9), 2),
+            'total_p50_s': round(self._percentile(total, 0.5), 2),
+        }
+
+
+class StreamingReply:
+    """
+    文字列の断片のイテレーターを包む。for で回すと断片をそのまま返しつつ、
+      .text          : ここまでの全文
+      .shopping_list : 揃った買い物リスト（まだなら None）
+      .list_json     : そのJSON文字列
+      .ttft          : 最初の断片までの時間[秒]
+    を更新する。最後まで回ると metrics に記録する。
+    """
+
+    def __init__(self, chunks, metrics=None, cached=False, clock=time.perf_counter):
+        self.chunks = chunks
+        self.metrics = metrics
+        self.cached = cached
+        self.clock = clock
+        self.parser = ShoppingListParser()
+        self.text = ''
+        self.ttft = None
+        self.list_ready_after = None
+        self.elapsed = None
+
+    @property
+    def shopping_list(self):
+        return self.parser.items
+
+    @property
+    def list_json(self):
+        return self.parser.json_text
+
+    def __iter__(self):
+        start = self.clock()
+        for chunk in self.chunks:
+            if self.ttft is None:
+                self.ttft = self.clock() - start
+            self.text += chunk
+            if self.parser.items is None and self.parser.feed(chunk) is not None:
+                self.list_ready_after = self.clock() - start
+            yield chunk
+        self.elapsed = self.clock() - start
+        if self.metrics is not None:
+            self.metrics.record(self.ttft or 0.0, self.elapsed, self.cached)
+
+
+def main():
+    model = StubModel(delay=0.8, chunk_delay=0.05, chunk_size=6)
+    metrics = StreamMetrics()
+    reply = StreamingReply(iter_text(model.generate_content('カレーが食べたい', stream=True)), metrics)
+    shown = False
+    for _ in reply:
+        if reply.shopping_list is not None and not shown:
+            shown = True
+            print(f'list ready after {reply.list_ready_after:.2f}s: '
+                  f'{[item["ja"] for item in reply.shopping_list]}')
+    print(f'ttft {reply.ttft:.2f}s, total {reply.elapsed:.2f}s, {len(reply.text)} chars')
+    print(metrics.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+セルフレジ(app.py)のバーコード読み取りを、Streamlit の画面の実行とは別のスレッドで行う。
+
+画像は submit_image()（st.camera_input の1枚）か submit_frame()（WebRTC の連続映像）で渡すと
+共有のスレッドプールで読み取られ、見つかったコードは drain() で取り出せる。
+画面側は st.fragment で定期的に drain() するだけなので、読み取りの重さが画面の再実行を待たせない。
+  - 処理待ちが max_pending 件あるときに来た映像のフレームは捨てる（常に新しい映像を読む）
+  - 同じコードは dedupe_seconds 以内なら1回だけ返す（かざしている間に何度も読まれるため）
+"""
+import collections
+import hashlib
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from smartcart_sys.barcode_decoder import GatedDecoder
+
+
+class CheckoutScanner:
+    """1つの画面（Streamlit のセッション）分の読み取り状態。スレッドプールと DecodeCascade は共有する"""
+
+    def __init__(self, executor, cascade, dedupe_seconds=3.0, max_pending=2, clock=time.monotonic):
+        self.executor = executor
+        self.cascade = cascade
+        # 連続映像は動きの無いフレームを飛ばす。静止画は1枚ずつ別の写真なので必ず全体を読む
+        self.gated = GatedDecoder(cascade=cascade, clock=clock)
+        self.dedupe_seconds = dedupe_seconds
+        self.max_pending = max_pending
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._results = collections.deque()
+        self._recent = {}          # コード -> 最後に返した時刻
+        self._pending = 0
+        self._last_image = None    # 直前に受け取った静止画のハッシュ
+        self.stats = {'frames': 0, 'dropped': 0, 'decoded': 0, 'found': 0, 'decode_ms': 0.0}
+
+    def _submit(self, data, live):
+        with self._lock:
+            self.stats['frames'] += 1
+            if self._pending >= self.max_pending:
+                self.stats['dropped'] += 1
+                return False
+            self._pending += 1
+        self.executor.submit(self._work, data, live)
+        return True
+
+    def submit_frame(self, frame):
+        """連続映像の1フレーム(BGR)。処理が追いついていなければ捨てて False"""
+        return self._submit(frame, live=True)
+
+    def submit_image(self, data):
+        """カメラで撮った1枚（JPEG/PNG のバイト列）。同じ画像は1回しか読まない"""
+        digest = hashlib.sha1(data).digest()
+        with self._lock:
+            if digest == self._last_image:
+                return False
+        if not self._submit(data, live=False):
+            return False  # 処理待ちがいっぱいで捨てた。同じ写真がまた来たら読む
+        with self._lock:
+            self._last_image = digest
+        return True
+
+    def _work(self, data, live):
+        start = time.perf_counter()
+        try:
+            if live:
+                results = self.gated.decode(data) or []
+            else:
+                frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+                results = self.cascade.decode(frame) if frame is not None else []
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self.stats['decoded'] += 1
+                self.stats['decode_ms'] += (time.perf_counter() - start) * 1000.0
+
+        now = self.clock()
+        with self._lock:
+            for obj in results:
+                code = obj.data.decode('utf-8', 'replace')
+                if now - self._recent.get(code, -self.dedupe_seconds) < self.dedupe_seconds:
+                    continue
+                self._recent[code] = now
+                self._results.append(code)
+                self.stats['found'] += 1
+
+    def drain(self):
+        """前回から新しく読めたコードを、読めた順に返す"""
+        with self._lock:
+            codes = list(self._results)
+            self._results.clear()
+            return codes
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+        decoded = stats['decoded']
+        return (f"{stats['found']} found / {decoded} decoded / {stats['dropped']} dropped, "
+                f"{stats['decode_ms'] / decoded if decoded else 0.0:.1f}ms per frame")
@@ -0,0 +1,326 @@
+"""
+複数台のカートに注文を割り振るロジックと、ROS無しで動かせる簡易シミュレーション。
+
+ベンチマーク（1台・2台・4台で1時間あたりの処理注文数を比較）:
+    python3 -m smartcart_sys.fleet --carts 1 2 4
+"""
+import argparse
+import random
+import types
+
+from smartcart_sys.item_resolver import find_location
+from smartcart_sys.map_distance import load_distance_matrix
+from smartcart_sys.route_planner import plan_shopping_route, euclidean_distance
+from smartcart_sys.store_layout import ITEM_LOCATIONS, CASHIER_LOCATION
+from smartcart_sys.trip_executor import TripExecutor, TaskResult, Stop
+
+# 見積もりに使う平均速度[m/s]（nav2_params.yaml の max_vel_x は 0.65。加減速・旋回ぶん控えめに）
+CRUISE_SPEED = 0.5
+# 棚1か所あたりの積み込み時間[秒]
+PICKUP_TIME = 2.0
+
+
+class CartInfo:
+    """ディスパッチャーから見た1台のカートの状態"""
+
+    def __init__(self, name, pose):
+        self.name = name
+        self.pose = pose
+        # 今受けている注文を全て終えてレジに戻る見込み時刻
+        self.available_at = 0.0
+
+
+class FleetDispatcher:
+    """
+    注文を「一番早く終わらせられるカート」に割り振る。
+    split_orders=True の場合は、手の空いているカートがあれば棚ごとに分割した配分も作り、他のカートが
+    抱えている注文も含めた全体の完了時刻(makespan)が早くなる場合だけ分割する（同じなら走行時間の合計が短い方）。
+    分割すると行程が増えて走行距離も増えるので、走行中のカートに分けると混んでいるときの処理数が落ちる。
+    そのため分割先は、今空いているカートと注文全体を受けるはずだったカートに限る。
+    """
+
+    def __init__(self, cart_names, home=CASHIER_LOCATION, distance=euclidean_distance,
+                 resolve=find_location, speed=CRUISE_SPEED, pickup_time=PICKUP_TIME, split_orders=False):
+        self.carts = {name: CartInfo(name, home) for name in cart_names}
+        self.home = home
+        self.distance = distance
+        self.resolve = resolve
+        self.speed = speed
+        self.pickup_time = pickup_time
+        self.split_orders = split_orders
+
+    def update_pose(self, name, pose):
+        self.carts[name].pose = pose
+
+    def mark_idle(self, name, now):
+        """カートから「手が空いた」と報告があったら見込み時刻を実際の値で上書きする"""
+        self.carts[name].available_at = now
+
+    def estimate(self, cart, items, now):
+        """cart が items を回ってレジに戻り終わる見込み時刻"""
+        if cart.available_at > now:
+            # 走行中のカートは、今の行程を終えてレジから出発する
+            start_time, start_pose = cart.available_at, self.home
+        else:
+            start_time, start_pose = now, cart.pose
+        plan, _, _ = plan_shopping_route(
+            items, ('start', start_pose), ('cashier', self.home),
+            resolve=self.resolve, distance=self.distance)
+        return start_time + plan.planned_distance / self.speed + len(plan.stops) * self.pickup_time
+
+    def assign(self, items, now):
+        """注文を割り振り、{カート名: [商品名, ...]} を返す"""
+        carts = list(self.carts.values())
+        best_cart = min(carts, key=lambda cart: self.estimate(cart, items, now))
+        whole = {best_cart.name: list(items)}
+        whole_finish = self.estimate(best_cart, items, now)
+
+        assignment, finish = whole, {best_cart.name: whole_finish}
+        # 空いているカートの手を借りる場合だけ分割を考える
+        helpers = [cart for cart in carts if cart is best_cart or cart.available_at <= now]
+        if self.split_orders and len(helpers) > 1:
+            split, split_finish = self._split(items, now, helpers)
+            if self._cost(split_finish, now) < self._cost(finish, now):
+                assignment, finish = split, split_finish
+
+        for name, finish_time in finish.items():
+            self.carts[name].available_at = finish_time
+        return assignment
+
+    def _makespan(self, finish):
+        """finish {カート名: 見込み時刻} を割り振ったときの、全てのカートの仕事が終わる時刻"""
+        return max(finish.get(name, cart.available_at) for name, cart in self.carts.items())
+
+    def _cost(self, finish, now):
+        """(全体の完了時刻, 新たに増える走行時間の合計)"""
+        busy = sum(t - max(self.carts[name].available_at, now) for name, t in finish.items())
+        return self._makespan(finish), busy
+
+    def _split(self, items, now, carts):
+        """遠い棚から順に、carts のうち追加したときの makespan が一番小さいカートへ配る"""
+        by_key = {}
+        for item_name in items:
+            key, coords = self.resolve(item_name)
+            by_key.setdefault(key, []).append(item_name)
+
+        def far_first(key):
+            if key is None:
+                return 0.0
+            return -self.distance(('cashier', self.home), (key, self.resolve(by_key[key][0])[1]))
+
+        split = {}
+        finish = {}
+        for key in sorted(by_key, key=far_first):
+            best = None
+            for cart in carts:
+                trial = split.get(cart.name, []) + by_key[key]
+                cart_finish = self.estimate(cart, trial, now)
+                makespan = self._makespan(dict(finish, **{cart.name: cart_finish}))
+                if best is None or (makespan, cart_finish) < best[:2]:
+                    best = (makespan, cart_finish, cart.name, trial)
+            _, cart_finish, name, trial = best
+            split[name] = trial
+            finish[name] = cart_finish
+        return split, finish
+
+
+# ==========================================
+# ROS無しで動かすための簡易シミュレーション
+# ==========================================
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StubNavigator:
+    """
+    BasicNavigator の代用品。地図上の経路長と一定速度から到着時刻を計算するだけで、
+    goToPose / followWaypoints / isTaskComplete / getFeedback / getResult / cancelTask に答える。
+    ゴールには make_pose を通さず座標 [x, y, yaw] をそのまま渡す。
+    """
+
+    def __init__(self, clock, pose=CASHIER_LOCATION, distance=euclidean_distance,
+                 speed=CRUISE_SPEED, waypoint_pause=0.2):
+        self.clock = clock
+        self.pose = list(pose)
+        self.distance = distance
+        self.speed = speed
+        self.waypoint_pause = waypoint_pause
+        self.travelled = 0.0
+        self._legs = []
+        self._leg_index = 0
+        self._result = TaskResult.UNKNOWN
+
+    def _start(self, goals):
+        # 各区間の (到着時刻, ゴール, 区間の距離) を前もって計算する
+        self._legs = []
+        t = self.clock()
+        pose = self.pose
+        for i, goal in enumerate(goals):
+            d = self.distance(('', pose), ('', goal))
+            t += d / self.speed + (self.waypoint_pause if i < len(goals) - 1 else 0.0)
+            self._legs.append((t, list(goal), d))
+            pose = goal
+        self._leg_index = 0
+        self._result = TaskResult.UNKNOWN
+
+    def goToPose(self, pose):
+        self._start([pose])
+        return True
+
+    def followWaypoints(self, poses):
+        self._start(list(poses))
+        return True
+
+    def _advance(self):
+        now = self.clock()
+        while self._leg_index < len(self._legs) and self._legs[self._leg_index][0] <= now:
+            _, goal, d = self._legs[self._leg_index]
+            self.pose = goal
+            self.travelled += d
+            self._leg_index += 1
+
+    def isTaskComplete(self):
+        self._advance()
+        if self._leg_index >= len(self._legs):
+            if self._result == TaskResult.UNKNOWN:
+                self._result = TaskResult.SUCCEEDED
+            return True
+        return self._result != TaskResult.UNKNOWN
+
+    def getFeedback(self):
+        if self._leg_index >= len(self._legs):
+            return None
+        arrive_at = self._legs[self._leg_index][0]
+        return types.SimpleNamespace(
+            distance_remaining=max(0.0, arrive_at - self.clock()) * self.speed,
+            current_waypoint=self._leg_index)
+
+    def getResult(self):
+        return self._result
+
+    def busy_until(self):
+        """今のタスクが終わる時刻（タスクが無ければ None）"""
+        if self._result != TaskResult.UNKNOWN or self._leg_index >= len(self._legs):
+            return None
+        return self._legs[-1][0]
+
+    def cancelTask(self):
+        self._legs = self._legs[:self._leg_index]
+        self._result = TaskResult.CANCELED
+
+
+def make_stub_planner(navigator, distance, home=CASHIER_LOCATION):
+    """TripExecutor 用の planner（出発地点はシミュレーション上の現在位置）"""
+    def planner(items, start):
+        plan, items_by_key, _ = plan_shopping_route(
+            items, ('start', start or navigator.pose), ('cashier', home),
+            resolve=find_location, distance=distance)
+        return [Stop(key, coords, items_by_key[key]) for key, coords in plan.stops]
+    return planner
+
+
+def random_orders(count, mean_interval, min_items=2, max_items=6, seed=0):
+    """(到着時刻, 商品リスト) をポアソン到着で作る"""
+    rng = random.Random(seed)
+    names = list(ITEM_LOCATIONS)
+    t = 0.0
+    orders = []
+    for _ in range(count):
+        t += rng.expovariate(1.0 / mean_interval)
+        size = rng.randint(min_items, min(max_items, len(names)))
+        orders.append((t, rng.sample(names, size)))
+    return orders
+
+
+def simulate_fleet(orders, cart_count, distance=euclidean_distance, split_orders=False,
+                   speed=CRUISE_SPEED, pickup_time=PICKUP_TIME, dt=0.1):
+    """
+    StubNavigator + TripExecutor を cart_count 台動かして orders を処理し、結果の集計を返す。
+    """
+    clock = VirtualClock()
+    names = [f'cart{i + 1}' for i in range(cart_count)]
+    dispatcher = FleetDispatcher(names, distance=distance, speed=speed,
+                                 pickup_time=pickup_time, split_orders=split_orders)
+
+    pending = {}   # 注文番号 -> まだ終わっていない (カート名, 行程番号) の集合
+    done_at = {}
+    part_owner = {}
+
+    executors = {}
+    navigators = {}
+    for name in names:
+        navigator = StubNavigator(clock, distance=distance, speed=speed)
+
+        def on_event(event, trip, stop, info, name=name):
+            if event == 'trip_finished':
+                for order_id in part_owner.pop((name, trip.order_id), []):
+                    pending[order_id].discard((name, trip.order_id))
+                    if not pending[order_id]:
+                        done_at[order_id] = clock()
+                if not executors[name].queue:
+                    dispatcher.mark_idle(name, clock())
+
+        navigators[name] = navigator
+        executors[name] = TripExecutor(
+            navigator, make_stub_planner(navigator, distance), make_pose=lambda coords: coords,
+            home=CASHIER_LOCATION, on_event=on_event, pickup_time=pickup_time,
+            merge_orders=False, clock=clock)
+
+    arrivals = {}
+    queue = sorted(orders, key=lambda order: order[0])
+    next_order = 0
+    while next_order < len(queue) or len(done_at) < len(queue):
+        while next_order < len(queue) and queue[next_order][0] <= clock.now:
+            arrival, items = queue[next_order]
+            arrivals[next_order] = arrival
+            pending[next_order] = set()
+            for name, part in dispatcher.assign(items, clock.now).items():
+                dispatcher.update_pose(name, navigators[name].pose)
+                trip_id = executors[name].submit(part)
+                pending[next_order].add((name, trip_id))
+                part_owner.setdefault((name, trip_id), []).append(next_order)
+            if not pending[next_order]:
+                done_at[next_order] = clock.now
+            next_order += 1
+        for executor in executors.values():
+            executor.tick()
+        clock.now += dt
+
+    latencies = sorted(done_at[i] - arrivals[i] for i in arrivals)
+    span = max(done_at.values()) - min(arrivals.values()) if arrivals else 0.0
+    return {
+        'carts': cart_count,
+        'orders': len(orders),
+        'makespan_s': round(span, 1),
+        'orders_per_hour': round(len(orders) / span * 3600.0, 1) if span > 0 else 0.0,
+        'mean_latency_s': round(sum(latencies) / len(latencies), 1) if latencies else 0.0,
+        'max_latency_s': round(latencies[-1], 1) if latencies else 0.0,
+        'distance_m': round(sum(nav.travelled for nav in navigators.values()), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fleet dispatch benchmark (no ROS required)')
+    parser.add_argument('--carts', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--orders', type=int, default=40)
+    parser.add_argument('--interval', type=float, default=30.0, help='mean seconds between orders')
+    parser.add_argument('--split', action='store_true', help='allow splitting one order across carts')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    distance = load_distance_matrix()
+    orders = random_orders(args.orders, args.interval, seed=args.seed)
+    for count in args.carts:
+        result = simulate_fleet(orders, count, distance=distance, split_orders=args.split)
+        print(f"{count} cart(s): {result['orders_per_hour']:6.1f} orders/h, "
+              f"mean latency {result['mean_latency_s']:6.1f}s, max {result['max_latency_s']:6.1f}s, "
+              f"distance {result['distance_m']:7.1f}m")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import rclpy
+from rclpy.node import Node
+from std_msgs.msg import String
+from geometry_msgs.msg import PoseWithCovarianceStamped
+import collections
+import json
+import math
+import time
+
+from smartcart_sys.fleet import FleetDispatcher
+from smartcart_sys.map_distance import load_distance_matrix
+from smartcart_sys.order_topics import ORDER_TOPIC, ACK_TOPIC, EVENT_TOPIC, ORDER_QOS, unwrap_order
+from smartcart_sys.route_planner import euclidean_distance
+
+# 各カートは名前空間付きで simple_navigator.py を起動しておく
+#   python3 simple_navigator.py --ros-args -r __ns:=/cart1
+#   python3 simple_navigator.py --ros-args -r __ns:=/cart2
+# app.py が /shopping_list に出した注文を、このノードが /cartN/shopping_list に振り分ける
+# 各カートの受付の返事・行程の節目(/cartN/order_ack, /cartN/order_event)は /order_ack, /order_event にまとめて返す
+# 1つの注文を複数台に分けた場合、各カートには "<注文番号>/<カート名>" の番号で送り、
+# 返事と節目には元の注文番号(parent_order_id)と分けた数(parts)を付けて返す
+# 各カートの走行状況(/cartN/trip_status)もカート名(cart)を付けて /trip_status にまとめて返す
+
+# 覚えておく分割した注文の数（古いものから忘れる）
+MAX_PARTS = 1000
+
+
+class FleetDispatcherNode(Node):
+    def __init__(self):
+        super().__init__('fleet_dispatcher')
+
+        self.declare_parameter('carts', ['cart1', 'cart2'])
+        # True なら1つの注文を棚ごとに複数台へ分割してもよい
+        self.declare_parameter('split_orders', False)
+        carts = list(self.get_parameter('carts').value)
+
+        try:
+            distance = load_distance_matrix()
+        except (OSError, ValueError) as e:
+            self.get_logger().warn(f'Distance matrix unavailable, using straight lines: {e}')
+            distance = euclidean_distance
+
+        self.dispatcher = FleetDispatcher(
+            carts, distance=distance, split_orders=self.get_parameter('split_orders').value)
+        # 分割した注文の番号 -> (元の注文番号, 分けた数)
+        self.parts = collections.OrderedDict()
+
+        self.subscription = self.create_subscription(
+            String, f'/{ORDER_TOPIC}', self.order_callback, ORDER_QOS)
+        self.ack_publisher = self.create_publisher(String, f'/{ACK_TOPIC}', ORDER_QOS)
+        self.event_publisher = self.create_publisher(String, f'/{EVENT_TOPIC}', ORDER_QOS)
+        self.status_publisher = self.create_publisher(String, '/trip_status', 10)
+
+        self.order_publishers = {}
+        self.status_request_publishers = {}
+        for name in carts:
+            self.order_publishers[name] = self.create_publisher(String, f'/{name}/{ORDER_TOPIC}', ORDER_QOS)
+            self.create_subscription(
+                String, f'/{name}/{ACK_TOPIC}',
+                lambda msg, name=name: self.relay(self.ack_publisher, name, msg), ORDER_QOS)
+            self.create_subscription(
+                String, f'/{name}/{EVENT_TOPIC}',
+                lambda msg, name=name: self.relay(self.event_publisher, name, msg), ORDER_QOS)
+            self.status_request_publishers[name] = self.create_publisher(
+                String, f'/{name}/trip_status_request', 10)
+            self.create_subscription(
+                PoseWithCovarianceStamped, f'/{name}/amcl_pose',
+                lambda msg, name=name: self.pose_callback(name, msg), 10)
+            self.create_subscription(
+                String, f'/{name}/trip_status',
+                lambda msg, name=name: self.status_callback(name, msg), 10)
+
+        # 見込み時刻のずれを直すため、定期的に各カートの状態を問い合わせる
+        self.status_timer = self.create_timer(2.0, self.request_status)
+
+        self.get_logger().info(f'Fleet dispatcher ready: {carts}')
+
+    def order_callback(self, msg):
+        try:
+            message = json.loads(msg.data)
+        except Exception as e:
+            self.get_logger().error(f'JSON Error: {e}')
+            return
+        envelope, shopping_list = unwrap_order(message)
+        if not shopping_list:
+            return
+
+        assignment = self.dispatcher.assign(shopping_list, time.monotonic())
+        for name, items in assignment.items():
+            out = String()
+            if envelope is None:
+                out.data = json.dumps(items, ensure_ascii=False)
+            elif len(assignment) > 1:
+                # 分割した場合は、返事と節目を分けた部分ごとに区別できるよう別の番号にする
+                part_id = f"{envelope.get('order_id')}/{name}"
+                self.parts[part_id] = (envelope.get('order_id'), len(assignment))
+                while len(self.parts) > MAX_PARTS:
+                    self.parts.popitem(last=False)
+                out.data = json.dumps(dict(envelope, order_id=part_id, items=items), ensure_ascii=False)
+            else:
+                out.data = json.dumps(dict(envelope, items=items), ensure_ascii=False)
+            self.order_publishers[name].publish(out)
+            self.get_logger().info(f'Order -> {name}: {items}')
+
+    def relay(self, publisher, name, msg):
+        try:
+            data = json.loads(msg.data)
+        except Exception:
+            return
+        data = dict(data, cart=name)
+        part = self.parts.get(data.get('order_id'))
+        if part is not None:
+            data['parent_order_id'], data['parts'] = part
+        merged = self.parts.get(data.get('merged_order_id'))
+        if merged is not None:
+            data['merged_parent_order_id'], data['merged_parts'] = merged
+        out = String()
+        out.data = json.dumps(data, ensure_ascii=False)
+        publisher.publish(out)
+
+    def pose_callback(self, name, msg):
+        pose = msg.pose.pose
+        yaw = 2.0 * math.atan2(pose.orientation.z, pose.orientation.w)
+        self.dispatcher.update_pose(name, [pose.position.x, pose.position.y, yaw])
+
+    def status_callback(self, name, msg):
+        try:
+            status = json.loads(msg.data)
+        except Exception:
+            return
+        if status.get('state') == 'idle' and not status.get('queued'):
+            self.dispatcher.mark_idle(name, time.monotonic())
+        self.relay(self.status_publisher, name, msg)
+
+    def request_status(self):
+        for publisher in self.status_request_publishers.values():
+            publisher.publish(String())
+
+
+def main():
+    rclpy.init()
+    node = FleetDispatcherNode()
+    try:
+        rclpy.spin(node)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        node.destroy_node()
+        rclpy.shutdown()
+
+
+if __name__ == '__main__':
+    main()
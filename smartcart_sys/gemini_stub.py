@@ -0,0 +1,110 @@
+"""
+Gemini API の代わりに使う、ネットワーク不要の偽モデル（動作確認・テスト用）。
+
+環境変数 SMARTCART_GEMINI_STUB=1 を付けて起動すると app.py はこちらを使う:
+    SMARTCART_GEMINI_STUB=1 streamlit run app.py
+
+google.generativeai.GenerativeModel のうち、app.py が使う
+generate_content() / start_chat() / ChatSession.send_message() だけを真似る。
+stream=True なら応答を少しずつ返す（1つ目までの待ち時間と、以降の間隔を指定できる）。
+"""
+import json
+import os
+import time
+
+STUB_ENV = 'SMARTCART_GEMINI_STUB'
+
+# 要望に含まれる言葉 -> (料理名, 買い物リスト)
+_RECIPES = [
+    ('カレー', 'チキンカレー', [('Chicken', '鶏もも肉'), ('Onion', '玉ねぎ'), ('Carrot', '人参'),
+                         ('Curry Roux', 'カレールー'), ('Rice', 'お米')]),
+    ('curry', 'チキンカレー', [('Chicken', '鶏もも肉'), ('Onion', '玉ねぎ'), ('Carrot', '人参'),
+                          ('Curry Roux', 'カレールー'), ('Rice', 'お米')]),
+    ('肉じゃが', '肉じゃが', [('Pork', '豚バラ肉'), ('Onion', '玉ねぎ'), ('Carrot', '人参'),
+                        ('Soy Sauce', '醤油')]),
+    ('オムレツ', 'オムレツ', [('Egg', '卵'), ('Milk', '牛乳'), ('Onion', '玉ねぎ')]),
+]
+_DEFAULT_RECIPE = ('野菜炒め', [('Pork', '豚バラ肉'), ('Carrot', '人参'), ('Onion', '玉ねぎ'),
+                            ('Soy Sauce', '醤油')])
+
+
+def stub_enabled():
+    return os.getenv(STUB_ENV) == '1'
+
+
+def stub_reply(prompt):
+    """要望の言葉からそれらしい献立と ```json``` の買い物リストを作る"""
+    text = str(prompt)
+    dish, items = _DEFAULT_RECIPE
+    for word, recipe_dish, recipe_items in _RECIPES:
+        if word in text.lower():
+            dish, items = recipe_dish, recipe_items
+            break
+    shopping_list = [{'en': en, 'ja': ja} for en, ja in items]
+    return (f'今日は{dish}はいかがでしょう？手軽に作れて、家族みんなで楽しめます。\n\n'
+            f'```json\n{json.dumps(shopping_list, ensure_ascii=False, indent=2)}\n```')
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubStream:
+    """stream=True の応答。for で回すと .text を持つ断片が順に出てくる"""
+
+    def __init__(self, text, first_delay, chunk_delay, chunk_size):
+        self.text = text
+        self.first_delay = first_delay
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        for i in range(0, len(self.text), self.chunk_size):
+            delay = self.first_delay if i == 0 else self.chunk_delay
+            if delay:
+                time.sleep(delay)
+            yield StubResponse(self.text[i:i + self.chunk_size])
+
+
+class StubModel:
+    """
+    delay       : 1回の応答にかける時間[秒]（APIの待ち時間の代わり。stream=True では最初の断片までの時間）
+    chunk_delay : stream=True での断片の間隔[秒]
+    chunk_size  : stream=True での1断片の文字数
+    reply       : プロンプト -> 応答文 の関数
+    """
+
+    def __init__(self, model_name='stub', system_instruction=None, delay=0.0,
+                 chunk_delay=0.0, chunk_size=8, reply=stub_reply):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.delay = delay
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.reply = reply
+        self.calls = 0
+
+    def generate_content(self, contents, stream=False):
+        self.calls += 1
+        text = self.reply(contents)
+        if stream:
+            return StubStream(text, self.delay, self.chunk_delay, self.chunk_size)
+        if self.delay:
+            time.sleep(self.delay)
+        return StubResponse(text)
+
+    def start_chat(self, history=None):
+        return StubChat(self, history)
+
+
+class StubChat:
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False):
+        response = self.model.generate_content(content, stream=stream)
+        self.history.append({'role': 'user', 'parts': [content]})
+        self.history.append({'role': 'model', 'parts': [response.text]})
+        return response
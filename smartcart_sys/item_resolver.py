@@ -0,0 +1,243 @@
+"""
+商品名 → 棚 の解決。
+
+Geminiが出す名前（"Chicken thigh", "Curry Roux (medium hot)", 日本語名など）の表記ゆれに対応するため、
+正規化した別名の完全一致 → 別名が商品名の最後の単語になっている一致（"Whole milk" → milk。
+"Milk chocolate" や "Soy milk" は別の商品として扱う）→ 文字bigramの索引で候補を絞った書き間違いの一致、の順で探す。
+索引は起動時に1回だけ作るので、商品数が増えても1件の検索は候補の数にしか比例しない。
+既定の索引には商品カタログ(catalog.py)の商品名も棚の別名として入り、カタログが更新されると作り直す。
+"""
+import collections
+import functools
+import re
+import unicodedata
+
+from smartcart_sys.catalog import get_catalog
+from smartcart_sys.store_layout import ITEM_LOCATIONS, ITEM_SYNONYMS
+
+# 書き間違いのあいまい一致で、これ未満のスコアは「見つからない」扱い
+MIN_SCORE = 0.7
+# 単語単位で一致したときのスコア（別名の完全一致は 1.0）
+WORD_SCORE = 0.9
+# これ以下の文字数の別名（egg, milk, 卵 など）は単語単位でしか一致させない
+SHORT_ALIAS = 4
+# 1つの ItemResolver が覚えておく検索結果の数（超えたら忘れる）
+CACHE_SIZE = 4096
+
+# 商品名の後ろに付いても別の商品にならない言葉（切り方・部位・量・辛さなど。英語は単数形）
+FORM_WORDS = {
+    'slice', 'sliced', 'clove', 'chunk', 'piece', 'strip', 'cube', 'block', 'fillet', 'bulb', 'head',
+    'stick', 'pack', 'bag', 'bottle', 'carton', 'chuck', 'roll', 'shoulder', 'loin', 'belly',
+    'ground', 'minced', 'chopped', 'diced', 'large', 'medium', 'small', 'mild', 'hot', 'fresh',
+    '薄切り', '切り身', 'こま切れ', 'ひき肉', 'ミンチ', 'パック', 'ブロック', '甘口', '中辛', '辛口',
+}
+# 日本語の商品名の語末に続けて書かれる言葉（長いものから試す）
+_JA_FORM_SUFFIXES = sorted((word for word in FORM_WORDS if not word.isascii()), key=len, reverse=True)
+
+_BRACKETS = re.compile(r'[\(（\[【［].*?[\)）\]】］]')
+_SEPARATORS = re.compile(r'[\s\-_/・,、.。:;!?！？"\'&+]+')
+
+
+def normalize(name):
+    """全角半角・大文字小文字をそろえ、括弧書き（"(medium hot)" など）と記号を除く"""
+    text = unicodedata.normalize('NFKC', str(name)).lower()
+    stripped = _BRACKETS.sub(' ', text)
+    # 括弧書きしか無い名前は括弧を外して使う
+    if stripped.strip():
+        text = stripped
+    return ' '.join(_SEPARATORS.sub(' ', text).split())
+
+
+def _singular(token):
+    if len(token) > 3 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 3 and token.endswith(('ches', 'shes', 'oes')):
+        return token[:-2]
+    if len(token) > 2 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def words(text):
+    """単語の並び（英語は単数形。"5kg" など数字を含む単語は除く）"""
+    return [_singular(token) if token.isascii() else token
+            for token in text.split() if not any(ch.isdigit() for ch in token)]
+
+
+def _end_key(word):
+    # 英語は単語そのもの、日本語は語末の1文字で引く（"国産豚バラ肉" の語末の "豚バラ肉" を探すため）
+    return word if word.isascii() else word[-1]
+
+
+def char_grams(text):
+    """空白を除いた文字列の文字bigram（1文字なら1文字そのもの）"""
+    compact = text.replace(' ', '')
+    if len(compact) == 1:
+        return {compact}
+    return {compact[i:i + 2] for i in range(len(compact) - 1)}
+
+
+def item_label(item):
+    """買い物リストの1要素を表示用の文字列にする（{"en", "ja"} の組にも対応）"""
+    if isinstance(item, dict):
+        return str(item.get('en') or item.get('ja') or '')
+    return str(item)
+
+
+class ItemResolver:
+    def __init__(self, locations=ITEM_LOCATIONS, synonyms=ITEM_SYNONYMS):
+        self.locations = locations
+        # 正規化した別名 -> 棚の名前
+        self.aliases = {}
+        for key in locations:
+            self.aliases[normalize(key)] = key
+            for alias in synonyms.get(key, []):
+                self.aliases.setdefault(normalize(alias), key)
+
+        # 別名の単語の並び（数量を除く）と、最後の単語で引く索引（単語単位の一致に使う）
+        self.alias_words = {alias: words(alias) for alias in self.aliases}
+        self.by_end = collections.defaultdict(set)
+        for alias, alias_words in self.alias_words.items():
+            if alias_words:
+                self.by_end[_end_key(alias_words[-1])].add(alias)
+
+        # 文字bigram -> その bigram を持つ別名（書き間違いのあいまい一致に使う）
+        self.alias_grams = {alias: char_grams(alias) for alias in self.aliases}
+        self.index = collections.defaultdict(set)
+        for alias, grams in self.alias_grams.items():
+            for gram in grams:
+                self.index[gram].add(alias)
+        self._cache = {}
+
+    def _match(self, text):
+        """正規化済みの文字列 -> (棚の名前, スコア)"""
+        result = self._cache.get(text)
+        if result is None:
+            if len(self._cache) >= CACHE_SIZE:
+                self._cache.clear()
+            result = self._cache[text] = self._score(text)
+        return result
+
+    def _score(self, text):
+        if not text:
+            return None, 0.0
+        if text in self.aliases:
+            return self.aliases[text], 1.0
+        key = self._word_match(text)
+        if key is not None:
+            return key, WORD_SCORE
+        return self._fuzzy_match(text)
+
+    def _word_match(self, text):
+        """
+        別名が商品名の最後の単語（日本語なら語末）になっていれば、その棚。
+        後ろに付いた切り方・量などの言葉（FORM_WORDS）は除いて見る。"milk chocolate" や "rice vinegar" の
+        ように別名の後ろに別の名詞が続くもの、"soy milk" のように前に別の棚の別名が付くものは一致としない。
+        """
+        query = words(text)
+        while len(query) > 1 and query[-1] in FORM_WORDS:
+            query.pop()
+        if not query:
+            return None
+        if not query[-1].isascii():
+            for form in _JA_FORM_SUFFIXES:
+                if query[-1].endswith(form) and len(query[-1]) > len(form):
+                    query[-1] = query[-1][:-len(form)]
+                    break
+
+        best, best_rank = None, None
+        for alias in self.by_end.get(_end_key(query[-1]), ()):
+            alias_words = self.alias_words[alias]
+            n = len(alias_words)
+            if n > len(query) or query[len(query) - n:-1] != alias_words[:-1]:
+                continue
+            last, alias_last = query[-1], alias_words[-1]
+            if last == alias_last:
+                rest = []
+            elif not alias_last.isascii() and last.endswith(alias_last):
+                rest = [last[:-len(alias_last)]]
+            else:
+                continue
+            key = self.aliases[alias]
+            if any(self.aliases.get(word, key) != key for word in query[:len(query) - n] + rest):
+                continue
+            # 長い（具体的な）別名を優先
+            rank = (n, len(alias))
+            if best_rank is None or rank > best_rank:
+                best, best_rank = key, rank
+        return best
+
+    def _fuzzy_match(self, text):
+        """
+        文字bigramの Dice 係数。別名がそのまま含まれる場合と短い別名は、書き間違いとはみなさない。
+        最後の単語の1文字目が別名と違うもの（"rice cooker" と "cooked rice" など）も候補にしない。
+        """
+        compact = text.replace(' ', '')
+        head = text.split()[-1][0]
+        query = char_grams(text)
+        overlap = collections.Counter()
+        for gram in query:
+            for alias in self.index.get(gram, ()):
+                overlap[alias] += 1
+
+        best = (None, 0.0, 0)
+        for alias, common in overlap.items():
+            alias_compact = alias.replace(' ', '')
+            if len(alias_compact) <= SHORT_ALIAS or alias_compact in compact or alias.split()[-1][0] != head:
+                continue
+            score = 2.0 * common / (len(self.alias_grams[alias]) + len(query))
+            # 同点なら長い（具体的な）別名を優先
+            if (score, len(alias)) > (best[1], best[2]):
+                best = (self.aliases[alias], score, len(alias))
+        if best[1] < MIN_SCORE:
+            return None, best[1]
+        return best[0], best[1]
+
+    def resolve(self, item):
+        """商品名（または {"en", "ja"} の組）-> (棚の名前, 座標)。見つからなければ (None, None)"""
+        names = [item.get('en'), item.get('ja')] if isinstance(item, dict) else [item]
+        best_key, best_score = None, 0.0
+        for name in names:
+            if not name:
+                continue
+            key, score = self._match(normalize(name))
+            if key is not None and score > best_score:
+                best_key, best_score = key, score
+        if best_key is None:
+            return None, None
+        return best_key, self.locations[best_key]
+
+    def resolve_many(self, items):
+        """まとめて解決し、({棚の名前: [商品, ...]}, [見つからなかった商品]) を返す"""
+        resolved = {}
+        unresolved = []
+        for item in items:
+            key, _ = self.resolve(item)
+            if key is None:
+                unresolved.append(item)
+            else:
+                resolved.setdefault(key, []).append(item)
+        return resolved, unresolved
+
+
+@functools.lru_cache(maxsize=1)
+def _resolver_for(catalog):
+    synonyms = {key: list(aliases) for key, aliases in ITEM_SYNONYMS.items()}
+    if catalog is not None:
+        for shelf, names in catalog.shelves().items():
+            if shelf in ITEM_LOCATIONS:
+                synonyms.setdefault(shelf, []).extend(names)
+    return ItemResolver(ITEM_LOCATIONS, synonyms)
+
+
+def default_resolver():
+    try:
+        catalog = get_catalog()
+    except (OSError, ValueError):
+        catalog = None  # カタログが無くても ITEM_SYNONYMS だけで動く
+    return _resolver_for(catalog)
+
+
+def find_location(item):
+    """商品名から棚を探す。見つからなければ (None, None)"""
+    return default_resolver().resolve(item)
@@ -0,0 +1,191 @@
+"""
+棚・レジ間の「地図上の実際の経路長」を前計算してキャッシュするモジュール。
+
+オフラインでの作成:
+    python3 -m smartcart_sys.map_distance
+地図ファイルか ITEM_LOCATIONS が変わった場合だけ作り直される。
+"""
+import hashlib
+import heapq
+import json
+import math
+import os
+
+from smartcart_sys.route_planner import euclidean_distance
+from smartcart_sys.store_layout import ITEM_LOCATIONS, CASHIER_LOCATION
+from smartcart_sys.map_layers import CACHE_DIR, load_map_layers, map_digest
+from smartcart_sys.supermarket_map import DEFAULT_MAP_YAML
+
+# nav2_params.yaml の global_costmap.robot_radius と合わせる
+ROBOT_RADIUS = 0.1
+
+# 現在位置がこの距離以内なら、その地点にいるものとして行列を引く
+SNAP_DISTANCE = 0.5
+
+_NEIGHBORS = [(1, 0, 1.0), (-1, 0, 1.0), (0, 1, 1.0), (0, -1, 1.0),
+              (1, 1, math.sqrt(2)), (1, -1, math.sqrt(2)),
+              (-1, 1, math.sqrt(2)), (-1, -1, math.sqrt(2))]
+
+
+def store_locations():
+    """距離行列を作る対象（全ての棚 + レジ）"""
+    locations = dict(ITEM_LOCATIONS)
+    locations['cashier'] = CASHIER_LOCATION
+    return locations
+
+
+def cache_key(map_yaml, locations, robot_radius):
+    """地図ファイル・座標表・ロボット半径から作るハッシュ"""
+    h = hashlib.sha256()
+    h.update(map_digest(map_yaml))
+    h.update(json.dumps(sorted((k, list(v)) for k, v in locations.items())).encode())
+    h.update(repr(robot_radius).encode())
+    return h.hexdigest()
+
+
+def nearest_free_cell(blocked, grid, gx, gy):
+    """(gx, gy) が通れない場所なら、一番近い通れるセルを探す"""
+    if grid.in_bounds(gx, gy) and not blocked[gy * grid.width + gx]:
+        return gx, gy
+    max_r = max(grid.width, grid.height)
+    for r in range(1, max_r):
+        candidates = []
+        for dx in range(-r, r + 1):
+            for dy in (-r, r) if abs(dx) != r else range(-r, r + 1):
+                nx, ny = gx + dx, gy + dy
+                if grid.in_bounds(nx, ny) and not blocked[ny * grid.width + nx]:
+                    candidates.append((dx * dx + dy * dy, nx, ny))
+        if candidates:
+            _, nx, ny = min(candidates)
+            return nx, ny
+    return None
+
+
+def dijkstra(blocked, grid, source):
+    """1つの出発セルから全セルへの経路長(セル単位)を求める"""
+    width = grid.width
+    dist = [math.inf] * (width * grid.height)
+    sx, sy = source
+    dist[sy * width + sx] = 0.0
+    queue = [(0.0, sx, sy)]
+    while queue:
+        d, x, y = heapq.heappop(queue)
+        if d > dist[y * width + x]:
+            continue
+        for dx, dy, cost in _NEIGHBORS:
+            nx, ny = x + dx, y + dy
+            if not grid.in_bounds(nx, ny):
+                continue
+            index = ny * width + nx
+            if blocked[index]:
+                continue
+            # 斜め移動で障害物の角をすり抜けないようにする
+            if dx and dy and (blocked[y * width + nx] or blocked[ny * width + x]):
+                continue
+            nd = d + cost
+            if nd < dist[index]:
+                dist[index] = nd
+                heapq.heappush(queue, (nd, nx, ny))
+    return dist
+
+
+class DistanceMatrix:
+    """棚・レジ間の経路長[m]。plan_route() の distance にそのまま渡せる"""
+
+    def __init__(self, names, matrix, locations):
+        self.names = names
+        self.matrix = matrix
+        self.locations = locations
+        self.index = {name: i for i, name in enumerate(names)}
+
+    def _node(self, point):
+        name, coords = point
+        if name in self.index:
+            return self.index[name]
+        # 現在位置など表に無い地点は、近くの登録地点に寄せる
+        best = None
+        for other, loc in self.locations.items():
+            d = math.hypot(loc[0] - coords[0], loc[1] - coords[1])
+            if d <= SNAP_DISTANCE and (best is None or d < best[0]):
+                best = (d, other)
+        return self.index[best[1]] if best else None
+
+    def __call__(self, a, b):
+        i, j = self._node(a), self._node(b)
+        if i is None or j is None or math.isinf(self.matrix[i][j]):
+            return euclidean_distance(a, b)
+        return self.matrix[i][j]
+
+    def to_dict(self, key):
+        return {
+            'key': key,
+            'names': self.names,
+            'matrix': [[None if math.isinf(d) else round(d, 3) for d in row] for row in self.matrix],
+        }
+
+    @classmethod
+    def from_dict(cls, data, locations):
+        matrix = [[math.inf if d is None else d for d in row] for row in data['matrix']]
+        return cls(data['names'], matrix, locations)
+
+
+def build_distance_matrix(locations, map_yaml=DEFAULT_MAP_YAML, robot_radius=ROBOT_RADIUS):
+    """各地点から1回ずつDijkstraを回して全地点間の経路長を作る"""
+    # 通れないセルまでの距離はキャッシュした距離レイヤーから引くだけ
+    grid = load_map_layers(map_yaml).base
+    blocked = grid.blocked(robot_radius)
+
+    names = sorted(locations)
+    cells = []
+    for name in names:
+        x, y = locations[name][0], locations[name][1]
+        cells.append(nearest_free_cell(blocked, grid, *grid.world_to_grid(x, y)))
+
+    matrix = []
+    for source in cells:
+        if source is None:
+            matrix.append([math.inf] * len(names))
+            continue
+        dist = dijkstra(blocked, grid, source)
+        row = []
+        for target in cells:
+            if target is None:
+                row.append(math.inf)
+            else:
+                row.append(dist[target[1] * grid.width + target[0]] * grid.resolution)
+        matrix.append(row)
+    return DistanceMatrix(names, matrix, locations)
+
+
+def load_distance_matrix(locations=None, map_yaml=DEFAULT_MAP_YAML,
+                         robot_radius=ROBOT_RADIUS, cache_dir=CACHE_DIR):
+    """キャッシュが最新ならそれを読み、古ければ作り直して保存する"""
+    if locations is None:
+        locations = store_locations()
+    key = cache_key(map_yaml, locations, robot_radius)
+    cache_path = os.path.join(cache_dir, f'distances_{key[:16]}.json')
+
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            data = json.load(f)
+        if data.get('key') == key:
+            return DistanceMatrix.from_dict(data, locations)
+
+    matrix = build_distance_matrix(locations, map_yaml, robot_radius)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(matrix.to_dict(key), f, separators=(',', ':'))
+    os.replace(tmp_path, cache_path)
+    return matrix
+
+
+def main():
+    matrix = load_distance_matrix()
+    width = max(len(name) for name in matrix.names)
+    for name, row in zip(matrix.names, matrix.matrix):
+        print(f'{name:>{width}}: ' + ' '.join(f'{d:6.1f}' for d in row))
+
+
+if __name__ == '__main__':
+    main()
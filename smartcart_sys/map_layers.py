@@ -0,0 +1,274 @@
+"""
+supermarket_map.py の占有格子から派生レイヤーを作り、バイナリでキャッシュする。
+
+  - 占有レイヤー : map_server と同じ occupied_thresh / free_thresh で FREE / OCCUPIED / UNKNOWN
+  - 距離レイヤー : 一番近い「通れないセル（占有・未知）」までのユークリッド距離[m]
+  - ピラミッド   : 2倍・4倍に粗くした同じ2つのレイヤー（占有は子セルの一番悪い値、距離は最小値を取る）
+
+キャッシュ（maps/cache/layers_*.bin）は地図の YAML と PGM の内容から作るキーで管理し、
+mmap で開いてそのまま配列として引く。経路長の前計算・棚位置の確認・シミュレーターで共通に使う。
+    python3 -m smartcart_sys.map_layers
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+from array import array
+
+from smartcart_sys.supermarket_map import OccupancyMap, DEFAULT_MAP_YAML, MAPS_DIR, FREE, OCCUPIED, UNKNOWN
+
+CACHE_DIR = os.path.join(MAPS_DIR, 'cache')
+# リポジトリ直下の nav2_params.yaml（シミュレーション用の設定。シミュレーターと棚位置の確認が読む）
+DEFAULT_PARAMS = os.path.join(os.path.dirname(MAPS_DIR), 'nav2_params.yaml')
+
+# 作る粗さ（1 が元の地図）
+PYRAMID_FACTORS = (1, 2, 4)
+
+MAGIC = b'SMAP'
+VERSION = 1
+# マジック, 版, レベル数, 地図のキー(sha256)
+_HEADER = struct.Struct('=4sII32s')
+# 幅, 高さ, 倍率, 解像度, 原点x, 原点y, 占有レイヤーの位置, 距離レイヤーの位置
+_LEVEL = struct.Struct('=IIIdddQQ')
+
+# 占有レイヤーを粗くするときの優先度（悪い方を残す）
+_SEVERITY = {FREE: 0, UNKNOWN: 1, OCCUPIED: 2}
+
+
+def map_digest(map_yaml=DEFAULT_MAP_YAML):
+    """地図の YAML と画像の内容から作るキー（どちらかが変われば変わる）"""
+    h = hashlib.sha256()
+    with open(map_yaml, 'rb') as f:
+        h.update(f.read())
+    with open(OccupancyMap.image_path(map_yaml), 'rb') as f:
+        h.update(f.read())
+    h.update(repr(VERSION).encode())
+    return h.digest()
+
+
+# 障害物の無い行・列の初期値（どんな実際の二乗距離よりも大きい有限の値）
+_FAR = 1e20
+
+
+def _edt_1d(f, n):
+    """1次元の二乗距離変換（Felzenszwalb & Huttenlocher の下側包絡線）。f は長さ n のリスト"""
+    d = [0.0] * n
+    v = [0] * n
+    z = [0.0] * (n + 1)
+    k = 0
+    z[0] = -math.inf
+    z[1] = math.inf
+    for q in range(1, n):
+        fq = f[q] + q * q
+        while True:
+            p = v[k]
+            s = (fq - (f[p] + p * p)) / (2.0 * (q - p))
+            if s > z[k]:
+                break
+            k -= 1
+        k += 1
+        v[k] = q
+        z[k] = s
+        z[k + 1] = math.inf
+    k = 0
+    for q in range(n):
+        while z[k + 1] < q:
+            k += 1
+        p = v[k]
+        d[q] = (q - p) * (q - p) + f[p]
+    return d
+
+
+def distance_transform(cells, width, height):
+    """通れないセル(FREE 以外)までのユークリッド距離をセル単位で返す（長さ width*height の float のリスト）"""
+    sq = [0.0 if state != FREE else _FAR for state in cells]
+    # 列方向
+    for gx in range(width):
+        sq[gx::width] = _edt_1d(sq[gx::width], height)
+    # 行方向
+    result = [0.0] * (width * height)
+    for gy in range(height):
+        base = gy * width
+        row = _edt_1d(sq[base:base + width], width)
+        result[base:base + width] = [math.sqrt(value) if value < _FAR / 2 else math.inf for value in row]
+    return result
+
+
+class GridLayer:
+    """
+    1つの粗さの地図。cells[gy * width + gx] が占有状態、distance[...] が通れないセルまでの距離[m]。
+    OccupancyMap と同じ width / height / resolution / origin / world_to_grid / in_bounds を持つ。
+    """
+
+    def __init__(self, width, height, resolution, origin, cells, distance, factor=1):
+        self.width = width
+        self.height = height
+        self.resolution = resolution
+        self.origin = origin
+        self.cells = cells
+        self.distance = distance
+        self.factor = factor
+
+    def world_to_grid(self, x, y):
+        gx = int(math.floor((x - self.origin[0]) / self.resolution))
+        gy = int(math.floor((y - self.origin[1]) / self.resolution))
+        return gx, gy
+
+    def grid_to_world(self, gx, gy):
+        x = self.origin[0] + (gx + 0.5) * self.resolution
+        y = self.origin[1] + (gy + 0.5) * self.resolution
+        return x, y
+
+    def in_bounds(self, gx, gy):
+        return 0 <= gx < self.width and 0 <= gy < self.height
+
+    def state(self, x, y):
+        """座標の占有状態（地図の外は UNKNOWN）"""
+        gx, gy = self.world_to_grid(x, y)
+        if not self.in_bounds(gx, gy):
+            return UNKNOWN
+        return self.cells[gy * self.width + gx]
+
+    def clearance(self, x, y):
+        """座標から一番近い通れないセルまでの距離[m]（地図の外は 0）"""
+        gx, gy = self.world_to_grid(x, y)
+        if not self.in_bounds(gx, gy):
+            return 0.0
+        return self.distance[gy * self.width + gx]
+
+    def blocked(self, radius):
+        """通れないセルから radius[m] 以内を通れないとしたマスク (1=通れない)。OccupancyMap.inflate と同じ結果"""
+        limit = math.ceil(radius / self.resolution) * self.resolution + 1e-6
+        return bytearray(1 if d <= limit else 0 for d in self.distance)
+
+
+def _downsample(layer, factor):
+    """layer を factor 倍に粗くする（端の余りも1セルにまとめる）"""
+    width = (layer.width + factor - 1) // factor
+    height = (layer.height + factor - 1) // factor
+    cells = bytearray(width * height)
+    distance = array('f', [0.0]) * (width * height)
+    for cy in range(height):
+        for cx in range(width):
+            worst = FREE
+            nearest = math.inf
+            for gy in range(cy * factor, min((cy + 1) * factor, layer.height)):
+                base = gy * layer.width
+                for gx in range(cx * factor, min((cx + 1) * factor, layer.width)):
+                    state = layer.cells[base + gx]
+                    if _SEVERITY[state] > _SEVERITY[worst]:
+                        worst = state
+                    nearest = min(nearest, layer.distance[base + gx])
+            cells[cy * width + cx] = worst
+            distance[cy * width + cx] = nearest
+    return GridLayer(width, height, layer.resolution * factor, list(layer.origin), cells, distance,
+                     factor=layer.factor * factor)
+
+
+class MapLayers:
+    """粗さごとの GridLayer の組。levels[0] が元の解像度"""
+
+    def __init__(self, levels, key, buffer=None):
+        self.levels = levels
+        self.key = key
+        self._buffer = buffer   # mmap で開いた場合はファイルを開いたままにする
+
+    @property
+    def base(self):
+        return self.levels[0]
+
+    def level(self, factor):
+        for layer in self.levels:
+            if layer.factor == factor:
+                return layer
+        raise KeyError(f'No pyramid level with factor {factor}')
+
+    @classmethod
+    def build(cls, map_yaml=DEFAULT_MAP_YAML, factors=PYRAMID_FACTORS):
+        grid = OccupancyMap.load(map_yaml)
+        distance = array('f', [d * grid.resolution for d in
+                               distance_transform(grid.cells, grid.width, grid.height)])
+        base = GridLayer(grid.width, grid.height, grid.resolution, list(grid.origin),
+                         bytearray(grid.cells), distance)
+        levels = [base]
+        for factor in factors:
+            if factor > 1:
+                levels.append(_downsample(base, factor))
+        return cls(levels, map_digest(map_yaml))
+
+    def save(self, path):
+        """ヘッダ・各レベルの情報・占有レイヤー(1バイト)・距離レイヤー(float32) の順に書く"""
+        offset = _HEADER.size + _LEVEL.size * len(self.levels)
+        entries = []
+        blobs = []
+        for layer in self.levels:
+            n = layer.width * layer.height
+            cells_at = offset
+            offset += n + (-n % 4)   # float32 の位置を4バイト境界にそろえる
+            distance_at = offset
+            offset += n * 4
+            entries.append(_LEVEL.pack(layer.width, layer.height, layer.factor, layer.resolution,
+                                       layer.origin[0], layer.origin[1], cells_at, distance_at))
+            blobs.append(bytes(layer.cells) + b'\0' * (-n % 4))
+            blobs.append(array('f', layer.distance).tobytes())
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, len(self.levels), self.key))
+            f.writelines(entries)
+            f.writelines(blobs)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open(cls, path):
+        """キャッシュファイルを mmap で開く（配列はファイルの中身をそのまま参照する）"""
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(buffer)
+        magic, version, count, key = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'Not a map layer cache (or old version): {path}')
+        levels = []
+        for i in range(count):
+            width, height, factor, resolution, ox, oy, cells_at, distance_at = \
+                _LEVEL.unpack_from(view, _HEADER.size + _LEVEL.size * i)
+            n = width * height
+            levels.append(GridLayer(width, height, resolution, [ox, oy, 0.0],
+                                    view[cells_at:cells_at + n],
+                                    view[distance_at:distance_at + n * 4].cast('f'), factor=factor))
+        return cls(levels, key, buffer)
+
+
+def cache_path(map_yaml=DEFAULT_MAP_YAML, cache_dir=CACHE_DIR, key=None):
+    key = key or map_digest(map_yaml)
+    return os.path.join(cache_dir, f'layers_{key.hex()[:16]}.bin')
+
+
+def load_map_layers(map_yaml=DEFAULT_MAP_YAML, cache_dir=CACHE_DIR):
+    """キャッシュが最新ならそれを開き、無ければ作って保存してから開く"""
+    key = map_digest(map_yaml)
+    path = cache_path(map_yaml, cache_dir, key)
+    if os.path.exists(path):
+        try:
+            layers = MapLayers.open(path)
+            if layers.key == key:
+                return layers
+        except (OSError, ValueError, struct.error):
+            pass
+    MapLayers.build(map_yaml).save(path)
+    return MapLayers.open(path)
+
+
+def main():
+    layers = load_map_layers()
+    for layer in layers.levels:
+        free = sum(1 for state in layer.cells if state == FREE)
+        widest = max(layer.distance)
+        print(f'x{layer.factor}: {layer.width}x{layer.height} cells @ {layer.resolution:.3f}m, '
+              f'{free} free, max clearance {widest:.2f}m')
+
+
+if __name__ == '__main__':
+    main()
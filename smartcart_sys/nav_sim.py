@@ -0,0 +1,541 @@
+"""
+Gazebo・Nav2 無しで BasicNavigator の代わりに使える、地図上の簡易シミュレーター。
+
+maps/supermarket_map.pgm をロボット半径ぶん膨らませた格子で A* 探索し、見通しの利く点まで経路を間引く。
+その経路を nav2_params.yaml の速度・加速度の上限で「その場で旋回 → 直進」の台形速度で進む。
+時刻は clock から読むだけなので、fleet.VirtualClock を進めれば実時間の何百倍の速さでも回せる。
+
+買い物リストを次々に流して、実時間に対して何倍で回ったかを表示する:
+    python3 -m smartcart_sys.nav_sim --orders 1000
+"""
+import argparse
+import bisect
+import collections
+import heapq
+import math
+import time
+import types
+
+import yaml
+
+from smartcart_sys.fleet import VirtualClock, make_stub_planner, random_orders
+from smartcart_sys.map_distance import load_distance_matrix, nearest_free_cell
+from smartcart_sys.map_layers import DEFAULT_PARAMS, load_map_layers
+from smartcart_sys.route_planner import euclidean_distance
+from smartcart_sys.store_layout import CASHIER_LOCATION
+from smartcart_sys.supermarket_map import DEFAULT_MAP_YAML
+from smartcart_sys.trip_executor import TripExecutor, TaskResult, IDLE, DWELLING
+
+SQRT2 = math.sqrt(2)
+_NEIGHBORS = [(1, 0, 1.0), (-1, 0, 1.0), (0, 1, 1.0), (0, -1, 1.0),
+              (1, 1, SQRT2), (1, -1, SQRT2), (-1, 1, SQRT2), (-1, -1, SQRT2)]
+
+
+class MotionParams:
+    """シミュレーションに使う nav2_params.yaml の値（既定値は同ファイルの値）"""
+
+    def __init__(self, max_vel_x=0.65, max_vel_theta=2.0, acc_lim_x=2.5, acc_lim_theta=3.2,
+                 xy_goal_tolerance=0.25, yaw_goal_tolerance=0.25, robot_radius=0.1,
+                 planner_tolerance=0.5, waypoint_pause=0.2):
+        self.max_vel_x = max_vel_x
+        self.max_vel_theta = max_vel_theta
+        self.acc_lim_x = acc_lim_x
+        self.acc_lim_theta = acc_lim_theta
+        self.xy_goal_tolerance = xy_goal_tolerance
+        self.yaw_goal_tolerance = yaw_goal_tolerance
+        self.robot_radius = robot_radius
+        self.planner_tolerance = planner_tolerance
+        self.waypoint_pause = waypoint_pause
+
+    @classmethod
+    def load(cls, path=DEFAULT_PARAMS):
+        with open(path) as f:
+            params = yaml.safe_load(f)
+
+        def section(*keys):
+            node = params
+            for key in keys:
+                node = (node or {}).get(key) or {}
+            return node
+
+        controller = section('controller_server', 'ros__parameters')
+        follow = controller.get('FollowPath', {})
+        goal_checker = controller.get('goal_checker', {})
+        costmap = section('global_costmap', 'global_costmap', 'ros__parameters')
+        planner = section('planner_server', 'ros__parameters', 'GridBased')
+        waypoints = section('waypoint_follower', 'ros__parameters', 'wait_at_waypoint')
+
+        defaults = cls()
+        return cls(
+            max_vel_x=float(follow.get('max_vel_x', defaults.max_vel_x)),
+            max_vel_theta=float(follow.get('max_vel_theta', defaults.max_vel_theta)),
+            acc_lim_x=float(follow.get('acc_lim_x', defaults.acc_lim_x)),
+            acc_lim_theta=float(follow.get('acc_lim_theta', defaults.acc_lim_theta)),
+            xy_goal_tolerance=float(goal_checker.get('xy_goal_tolerance', defaults.xy_goal_tolerance)),
+            yaw_goal_tolerance=float(goal_checker.get('yaw_goal_tolerance', defaults.yaw_goal_tolerance)),
+            robot_radius=float(costmap.get('robot_radius', defaults.robot_radius)),
+            planner_tolerance=float(planner.get('tolerance', defaults.planner_tolerance)),
+            waypoint_pause=float(waypoints.get('waypoint_pause_duration', 200)) / 1000.0
+            if waypoints.get('enabled', True) else 0.0)
+
+
+class GridPlanner:
+    """膨らませた占有格子の上の A*（8近傍、障害物の角はすり抜けない）。同じ区間の結果は使い回す"""
+
+    def __init__(self, grid, blocked, cache_size=1024):
+        self.grid = grid
+        self.blocked = blocked
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()   # (出発セル, ゴールセル) -> セルの並び または None
+        self.stats = {'plans': 0, 'cache_hits': 0, 'expanded': 0, 'plan_ms': 0.0}
+
+    @classmethod
+    def load(cls, map_yaml=DEFAULT_MAP_YAML, robot_radius=0.1):
+        grid = load_map_layers(map_yaml).base
+        return cls(grid, grid.blocked(robot_radius))
+
+    def _free(self, gx, gy):
+        return self.grid.in_bounds(gx, gy) and not self.blocked[gy * self.grid.width + gx]
+
+    def plan(self, start, goal, tolerance=0.5):
+        """
+        start / goal は [x, y, ...]。通れる点の並び [(x, y), ...] を返す（届かなければ None）。
+        ゴールが通れない場所なら tolerance[m] 以内の一番近い通れるセルに寄せる（NavFn の tolerance と同じ）。
+        """
+        grid = self.grid
+        start_cell = nearest_free_cell(self.blocked, grid, *grid.world_to_grid(start[0], start[1]))
+        goal_raw = grid.world_to_grid(goal[0], goal[1])
+        goal_cell = nearest_free_cell(self.blocked, grid, *goal_raw)
+        if start_cell is None or goal_cell is None:
+            return None
+        snapped = goal_cell != goal_raw
+        if snapped and math.hypot(goal_cell[0] - goal_raw[0], goal_cell[1] - goal_raw[1]) * \
+                grid.resolution > tolerance:
+            return None
+
+        key = (start_cell, goal_cell)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.stats['cache_hits'] += 1
+            cells = self._cache[key]
+        else:
+            begin = time.perf_counter()
+            cells = self._astar(start_cell, goal_cell)
+            if cells is not None:
+                cells = self._shortcut(cells)
+            self.stats['plans'] += 1
+            self.stats['plan_ms'] += (time.perf_counter() - begin) * 1000.0
+            self._cache[key] = cells
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        if cells is None:
+            return None
+
+        points = [(float(start[0]), float(start[1]))]
+        points += [grid.grid_to_world(gx, gy) for gx, gy in cells[1:-1]]
+        points.append(grid.grid_to_world(*goal_cell) if snapped else (float(goal[0]), float(goal[1])))
+        return points
+
+    def _astar(self, start, goal):
+        width = self.grid.width
+        blocked = self.blocked
+        gx, gy = goal
+
+        def heuristic(x, y):
+            dx, dy = abs(x - gx), abs(y - gy)
+            return (dx + dy) + (SQRT2 - 2.0) * min(dx, dy)
+
+        sx, sy = start
+        cost = {sy * width + sx: 0.0}
+        came_from = {}
+        queue = [(heuristic(sx, sy), 0.0, sx, sy)]
+        while queue:
+            _, d, x, y = heapq.heappop(queue)
+            index = y * width + x
+            if d > cost[index]:
+                continue
+            self.stats['expanded'] += 1
+            if (x, y) == goal:
+                cells = [(x, y)]
+                while index in came_from:
+                    index = came_from[index]
+                    cells.append((index % width, index // width))
+                return cells[::-1]
+            for dx, dy, step in _NEIGHBORS:
+                nx, ny = x + dx, y + dy
+                if not self.grid.in_bounds(nx, ny):
+                    continue
+                next_index = ny * width + nx
+                if blocked[next_index]:
+                    continue
+                if dx and dy and (blocked[y * width + nx] or blocked[ny * width + x]):
+                    continue
+                nd = d + step
+                if nd < cost.get(next_index, math.inf):
+                    cost[next_index] = nd
+                    came_from[next_index] = index
+                    heapq.heappush(queue, (nd + heuristic(nx, ny), nd, nx, ny))
+        return None
+
+    def line_of_sight(self, a, b):
+        """セル a から b まで、通れないセルを通らずにまっすぐ行けるか（斜めの角も確認する）"""
+        (x0, y0), (x1, y1) = a, b
+        dx, dy = abs(x1 - x0), abs(y1 - y0)
+        sx, sy = (1 if x1 > x0 else -1), (1 if y1 > y0 else -1)
+        err = dx - dy
+        x, y = x0, y0
+        while (x, y) != (x1, y1):
+            e2 = 2 * err
+            step_x, step_y = e2 > -dy, e2 < dx
+            if step_x and step_y and not (self._free(x + sx, y) and self._free(x, y + sy)):
+                return False
+            if step_x:
+                err -= dy
+                x += sx
+            if step_y:
+                err += dx
+                y += sy
+            if not self._free(x, y):
+                return False
+        return True
+
+    def _shortcut(self, cells):
+        """見通しの利く一番遠いセルまで飛ばして、曲がり角だけの経路にする"""
+        result = [cells[0]]
+        i = 0
+        while i < len(cells) - 1:
+            j = len(cells) - 1
+            while j > i + 1 and not self.line_of_sight(cells[i], cells[j]):
+                j -= 1
+            result.append(cells[j])
+            i = j
+        return result
+
+
+def _angle_diff(a, b):
+    return math.atan2(math.sin(b - a), math.cos(b - a))
+
+
+def profile_time(distance, max_vel, acc):
+    """距離 distance を停止→停止の台形速度(三角形を含む)で進む時間"""
+    if distance <= 0.0:
+        return 0.0
+    if distance >= max_vel * max_vel / acc:
+        return distance / max_vel + max_vel / acc
+    return 2.0 * math.sqrt(distance / acc)
+
+
+def profile_progress(t, distance, max_vel, acc):
+    """台形速度で動き出してから t 秒後に進んだ距離"""
+    total = profile_time(distance, max_vel, acc)
+    if t >= total:
+        return distance
+    if t <= 0.0:
+        return 0.0
+    peak = min(max_vel, math.sqrt(distance * acc))
+    ramp = peak / acc
+    if t < ramp:
+        return 0.5 * acc * t * t
+    if t < total - ramp:
+        return 0.5 * acc * ramp * ramp + peak * (t - ramp)
+    rest = total - t
+    return distance - 0.5 * acc * rest * rest
+
+
+class Motion:
+    """
+    1つのタスク（goToPose / followWaypoints）の動きを、開始時刻付きの区間の並びとして前もって計算したもの。
+    区間は ('turn', 始めの姿勢, 向きの変化量) / ('move', 始めの姿勢, 終わりの点) / ('wait', 姿勢)。
+    """
+
+    def __init__(self, start_time):
+        self.start_time = start_time
+        self.end_time = start_time
+        self.starts = []
+        self.phases = []          # (開始時刻, 長さ[秒], 種類, 始めの姿勢, 目標, 区間の番号, 距離)
+        self.leg_ends = []        # 各ゴールに着く時刻（届かないゴールは None）
+        self.leg_lengths = []
+        self.final_pose = None
+
+    def add(self, duration, kind, pose, target, leg, length=0.0):
+        if duration <= 0.0:
+            return
+        self.starts.append(self.end_time)
+        self.phases.append((self.end_time, duration, kind, pose, target, leg, length))
+        self.end_time += duration
+
+    def pose_at(self, t, params):
+        """時刻 t の [x, y, yaw]"""
+        if not self.phases or t <= self.start_time:
+            return None
+        i = bisect.bisect_right(self.starts, t) - 1
+        start, duration, kind, pose, target, _, length = self.phases[i]
+        elapsed = min(t - start, duration)
+        x, y, yaw = pose
+        if kind == 'turn':
+            turned = profile_progress(elapsed, abs(target), params.max_vel_theta, params.acc_lim_theta)
+            return [x, y, yaw + math.copysign(turned, target)]
+        if kind == 'move':
+            ratio = profile_progress(elapsed, length, params.max_vel_x, params.acc_lim_x) / length
+            return [x + (target[0] - x) * ratio, y + (target[1] - y) * ratio, yaw]
+        return [x, y, yaw]
+
+    def remaining_at(self, t, params):
+        """時刻 t から、今向かっているゴールまでの残りの経路長"""
+        if not self.phases:
+            return 0.0
+        i = max(0, bisect.bisect_right(self.starts, t) - 1)
+        leg = self.phases[i][5]
+        remaining = 0.0
+        for start, duration, kind, _, _, phase_leg, length in self.phases[i:]:
+            if phase_leg != leg:
+                break
+            if kind == 'move':
+                done = profile_progress(t - start, length, params.max_vel_x, params.acc_lim_x)
+                remaining += length - done
+        return remaining
+
+
+class SimNavigator:
+    """
+    BasicNavigator の代用品。goToPose / followWaypoints / getPath / followPath / isTaskComplete /
+    getFeedback / getResult / cancelTask / waitUntilNav2Active / setInitialPose に答える。
+    ゴールは PoseStamped でも [x, y, yaw] でもよい（fleet.StubNavigator と同じく pose・travelled を持つ）。
+    """
+
+    def __init__(self, clock=time.monotonic, pose=CASHIER_LOCATION, planner=None, params=None,
+                 map_yaml=DEFAULT_MAP_YAML, params_path=DEFAULT_PARAMS):
+        self.clock = clock
+        self.params = params or MotionParams.load(params_path)
+        self.planner = planner or GridPlanner.load(map_yaml, self.params.robot_radius)
+        self.pose = list(pose)
+        self.travelled = 0.0
+        self.motion = None
+        self.missed = []
+        self._result = TaskResult.UNKNOWN
+        self._done = True
+        self.stats = {'goals': 0, 'failed': 0, 'canceled': 0}
+
+    # ---------- BasicNavigator と同じ操作 ----------
+
+    def waitUntilNav2Active(self, *args, **kwargs):
+        return None
+
+    def setInitialPose(self, pose):
+        self.pose = self._coords(pose)
+
+    def goToPose(self, pose, *args, **kwargs):
+        self._start([pose])
+        return True
+
+    def followWaypoints(self, poses, *args, **kwargs):
+        self._start(list(poses))
+        return True
+
+    def getPath(self, start, goal, planner_id='', use_start=False):
+        """経路の計画だけを行う。返す経路は poses に (x, y) の並び、goal にゴールの姿勢を持つ（届かなければ None）"""
+        start = self._coords(start) if use_start else self.current_pose()
+        goal = self._coords(goal)
+        points = self.planner.plan(start, goal, self.params.planner_tolerance)
+        if points is None:
+            return None
+        return types.SimpleNamespace(poses=points, goal=goal)
+
+    def followPath(self, path, *args, **kwargs):
+        self._start([path.goal], paths=[path.poses])
+        return True
+
+    def isTaskComplete(self):
+        if self._done:
+            return True
+        if self.clock() < self.motion.end_time:
+            return False
+        self._finish(self.motion.end_time)
+        return True
+
+    def getFeedback(self):
+        if self._done or self.motion is None:
+            return None
+        now = self.clock()
+        motion = self.motion
+        # 届かないゴールは直前のゴールに着いた時点で飛ばしたものとする
+        current = 0
+        for end in motion.leg_ends:
+            if end is not None and end > now:
+                break
+            current += 1
+        return types.SimpleNamespace(
+            distance_remaining=motion.remaining_at(now, self.params),
+            navigation_time=now - motion.start_time,
+            estimated_time_remaining=max(0.0, motion.end_time - now),
+            current_waypoint=min(current, len(motion.leg_ends)),
+            number_of_recoveries=0)
+
+    def getResult(self):
+        return self._result
+
+    def cancelTask(self):
+        if self._done:
+            return
+        now = min(self.clock(), self.motion.end_time)
+        self.pose = self.motion.pose_at(now, self.params) or self.pose
+        self.travelled += self._travelled_until(now)
+        self._result = TaskResult.CANCELED
+        self._done = True
+        self.stats['canceled'] += 1
+
+    # ---------- シミュレーション ----------
+
+    @property
+    def result_future(self):
+        """followWaypoints の missed_waypoints を TripExecutor が読めるようにする"""
+        result = types.SimpleNamespace(result=types.SimpleNamespace(
+            missed_waypoints=[types.SimpleNamespace(index=i) for i in self.missed]))
+        return types.SimpleNamespace(result=lambda: result)
+
+    def busy_until(self):
+        """今のタスクが終わる時刻（タスクが無ければ None）。時計を一気に進めるのに使う"""
+        return None if self._done else self.motion.end_time
+
+    def current_pose(self):
+        if self._done:
+            return list(self.pose)
+        return self.motion.pose_at(self.clock(), self.params) or list(self.pose)
+
+    @staticmethod
+    def _coords(pose):
+        if hasattr(pose, 'pose'):
+            p = pose.pose
+            yaw = 2.0 * math.atan2(p.orientation.z, p.orientation.w)
+            return [p.position.x, p.position.y, yaw]
+        return [float(pose[0]), float(pose[1]), float(pose[2]) if len(pose) > 2 else 0.0]
+
+    def _start(self, goals, paths=None):
+        """goals を順に回る動きを作る。paths があれば計画せずにその経路（(x, y) の並び）をたどる"""
+        if not self._done:
+            self.cancelTask()
+            self.stats['canceled'] -= 1   # 新しいゴールで上書きしただけ
+        params = self.params
+        motion = Motion(self.clock())
+        pose = list(self.pose)
+        self.missed = []
+        for leg, goal in enumerate(goals):
+            goal = self._coords(goal)
+            self.stats['goals'] += 1
+            if paths is None:
+                points = self.planner.plan(pose, goal, params.planner_tolerance)
+            else:
+                points = [(pose[0], pose[1])] + [(point[0], point[1]) for point in paths[leg]]
+            if points is None:
+                self.missed.append(leg)
+                self.stats['failed'] += 1
+                motion.leg_ends.append(None)
+                motion.leg_lengths.append(0.0)
+                continue
+            length = 0.0
+            x, y, yaw = pose
+            for px, py in points[1:]:
+                segment = math.hypot(px - x, py - y)
+                if segment < 1e-6:
+                    continue
+                heading = math.atan2(py - y, px - x)
+                turn = _angle_diff(yaw, heading)
+                motion.add(profile_time(abs(turn), params.max_vel_theta, params.acc_lim_theta),
+                           'turn', (x, y, yaw), turn, leg)
+                yaw = heading
+                motion.add(profile_time(segment, params.max_vel_x, params.acc_lim_x),
+                           'move', (x, y, yaw), (px, py), leg, segment)
+                x, y = px, py
+                length += segment
+            turn = _angle_diff(yaw, goal[2])
+            if abs(turn) > params.yaw_goal_tolerance:
+                motion.add(profile_time(abs(turn), params.max_vel_theta, params.acc_lim_theta),
+                           'turn', (x, y, yaw), turn, leg)
+                yaw = goal[2]
+            motion.leg_ends.append(motion.end_time)
+            motion.leg_lengths.append(length)
+            pose = [x, y, yaw]
+            if leg < len(goals) - 1:
+                motion.add(params.waypoint_pause, 'wait', (x, y, yaw), None, leg)
+        motion.final_pose = pose
+        self.motion = motion
+        self._done = False
+        self._result = TaskResult.UNKNOWN
+
+    def _travelled_until(self, t):
+        travelled = 0.0
+        for start, duration, kind, _, _, _, length in self.motion.phases:
+            if start >= t:
+                break
+            if kind == 'move':
+                travelled += profile_progress(t - start, length, self.params.max_vel_x, self.params.acc_lim_x)
+        return travelled
+
+    def _finish(self, end_time):
+        motion = self.motion
+        self.pose = list(motion.final_pose)
+        self.travelled += sum(motion.leg_lengths)
+        # 1つのゴールだけのタスクは届かなければ失敗。followWaypoints は最後まで回れば成功（stop_on_failure: false）
+        failed = len(motion.leg_ends) == 1 and motion.leg_ends[0] is None
+        self._result = TaskResult.FAILED if failed else TaskResult.SUCCEEDED
+        self._done = True
+
+
+def replay(shopping_lists, navigator=None, clock=None, pickup_time=2.0, mode='serial',
+           distance=euclidean_distance, dt=0.1):
+    """
+    買い物リストを1つずつ TripExecutor で最後まで走らせる。
+    待つだけの時間は次の出来事（到着・積み込み終わり）まで時計を一気に進める。
+    """
+    clock = clock or VirtualClock()
+    navigator = navigator or SimNavigator(clock)
+    durations = []
+    failures = [0]
+
+    def on_event(event, trip, stop, info):
+        if event == 'failed':
+            failures[0] += 1
+        elif event == 'trip_finished':
+            durations.append(info['duration'])
+
+    executor = TripExecutor(navigator, make_stub_planner(navigator, distance), make_pose=lambda coords: coords,
+                            home=CASHIER_LOCATION, on_event=on_event, mode=mode,
+                            pickup_time=pickup_time, merge_orders=False, clock=clock)
+    for items in shopping_lists:
+        executor.submit(items)
+        executor.tick()
+        while executor.state != IDLE:
+            wake = navigator.busy_until() if executor.state != DWELLING else executor.dwell_until
+            clock.now = max(clock.now + dt, wake) if wake is not None else clock.now + dt
+            executor.tick()
+    return {
+        'trips': len(durations),
+        'sim_seconds': round(clock.now, 1),
+        'mean_trip_s': round(sum(durations) / len(durations), 1) if durations else 0.0,
+        'distance_m': round(navigator.travelled, 1),
+        'failed_stops': failures[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay shopping lists on the headless navigation simulator')
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--min-items', type=int, default=2)
+    parser.add_argument('--max-items', type=int, default=6)
+    parser.add_argument('--mode', choices=['serial', 'waypoints'], default='serial')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    shopping_lists = [items for _, items in random_orders(
+        args.orders, 1.0, min_items=args.min_items, max_items=args.max_items, seed=args.seed)]
+    start = time.perf_counter()
+    result = replay(shopping_lists, mode=args.mode, distance=load_distance_matrix())
+    wall = time.perf_counter() - start
+    print(f"{result['trips']} trips, {result['sim_seconds'] / 3600.0:.1f}h simulated in {wall:.1f}s "
+          f"({result['sim_seconds'] / wall:.0f}x real time)")
+    print(f"mean trip {result['mean_trip_s']}s, distance {result['distance_m']}m, "
+          f"failed stops {result['failed_stops']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+app.py の1つの ROS ノードを、たくさんの画面（Streamlit のセッション）で共有するための仕分け役。
+
+注文は次の形（エンベロープ）で shopping_list に送る。ナビゲーターは従来の素のリストも受け付ける。
+    {"type": "order", "order_id": "a1b2c3d4-1", "session_id": "a1b2c3d4...", "items": [...]}
+ナビゲーターは受け付けたら order_ack に、行程の節目(出発・到着・失敗・完了など)は order_event に
+order_id を付けて返す。OrderBridge はそれを order_id から送り主のセッションの受信箱へ入れ、
+ボタンを押してから受付の返事が来るまでの時間を記録する。
+
+複数台運用で1つの注文が分割された場合、返事と節目は部分ごとの番号で届き、元の注文番号
+(parent_order_id)と分けた数(parts)が付いている。画面には元の注文番号で届け、
+全ての部分の行程が終わるまでは trip_finished / trip_canceled を part_finished として届ける。
+
+ROS に依存しないので、ノード無しでも動作を確かめられる。
+"""
+import collections
+import itertools
+import queue
+import threading
+import time
+
+# 1つのセッションが返事を待てる注文の数（これを超えたら送らずに断る）
+MAX_PENDING_PER_SESSION = 3
+# この秒数を過ぎても受付の返事が無い注文は「返事なし」としてセッションに知らせる
+ACK_TIMEOUT = 5.0
+# セッションの受信箱の大きさ（あふれたら古いものから捨てる）
+INBOX_SIZE = 100
+# この秒数使われていないセッションは片付ける
+SESSION_IDLE_TIMEOUT = 30 * 60.0
+
+
+class SessionInbox:
+    def __init__(self, clock):
+        self.queue = queue.Queue(maxsize=INBOX_SIZE)
+        self.pending = {}          # 返事待ちの order_id -> ボタンを押した時刻
+        self.last_used = clock()
+        self.order_numbers = itertools.count(1)
+
+    def put(self, message):
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+
+class OrderBridge:
+    def __init__(self, max_pending=MAX_PENDING_PER_SESSION, ack_timeout=ACK_TIMEOUT,
+                 idle_timeout=SESSION_IDLE_TIMEOUT, clock=time.monotonic):
+        self.max_pending = max_pending
+        self.ack_timeout = ack_timeout
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.sessions = {}         # session_id -> SessionInbox
+        self.owners = {}           # order_id -> session_id
+        self.merged = collections.defaultdict(set)   # 行程の order_id -> 合流した order_id
+        self.part_of = {}          # 分割した部分の order_id -> 元の order_id
+        self.parts = {}            # 元の order_id -> {'count': 分けた数, 'done': 終わった部分の order_id}
+        self.latencies = collections.deque(maxlen=500)
+        self.stats = {'orders': 0, 'acks': 0, 'rejected': 0, 'timeouts': 0, 'events': 0, 'unrouted': 0}
+
+    def _inbox(self, session_id):
+        inbox = self.sessions.get(session_id)
+        if inbox is None:
+            inbox = self.sessions[session_id] = SessionInbox(self.clock)
+        inbox.last_used = self.clock()
+        return inbox
+
+    def new_order(self, session_id, items):
+        """
+        注文のエンベロープを作って返す。返事待ちが多すぎる場合は None（送らない）。
+        """
+        with self._lock:
+            inbox = self._inbox(session_id)
+            if len(inbox.pending) >= self.max_pending:
+                self.stats['rejected'] += 1
+                return None
+            order_id = f'{session_id[:8]}-{next(inbox.order_numbers)}'
+            inbox.pending[order_id] = self.clock()
+            self.owners[order_id] = session_id
+            self.stats['orders'] += 1
+        return {'type': 'order', 'order_id': order_id, 'session_id': session_id, 'items': list(items)}
+
+    def _learn_part(self, order_id, parent, count):
+        if order_id is not None and parent is not None:
+            self.part_of[order_id] = parent
+            self.parts.setdefault(parent, {'count': count or 1, 'done': set()})
+
+    def _finish(self, order_id):
+        """order_id（または分割した部分）が終わった。元の注文の全ての部分が終わったら True"""
+        parent = self.part_of.pop(order_id, None)
+        if parent is None:
+            self.owners.pop(order_id, None)
+            return True
+        state = self.parts.get(parent)
+        if state is not None:
+            state['done'].add(order_id)
+            if len(state['done']) < state['count']:
+                return False
+            del self.parts[parent]
+        self.owners.pop(parent, None)
+        return True
+
+    def on_ack(self, ack):
+        """ナビゲーターからの受付の返事を送り主に届ける"""
+        now = self.clock()
+        with self._lock:
+            order_id = ack.get('order_id')
+            self._learn_part(order_id, ack.get('parent_order_id'), ack.get('parts'))
+            owner_id = self.part_of.get(order_id, order_id)
+            session_id = self.owners.get(owner_id)
+            inbox = self.sessions.get(session_id)
+            if inbox is None:
+                self.stats['unrouted'] += 1
+                return False
+            pressed_at = inbox.pending.pop(owner_id, None)
+            message = dict(ack, kind='ack', order_id=owner_id, trip_order_id=order_id)
+            if pressed_at is not None:
+                message['latency'] = now - pressed_at
+                self.latencies.append(now - pressed_at)
+            self.stats['acks'] += 1
+            if ack.get('status') != 'accepted':
+                self._finish(order_id)
+            inbox.put(message)
+            return True
+
+    def on_event(self, event):
+        """行程の節目を、その行程に含まれる注文の送り主全員に届ける"""
+        with self._lock:
+            order_id = event.get('order_id')
+            self._learn_part(order_id, event.get('parent_order_id'), event.get('parts'))
+            if event.get('event') == 'order_merged':
+                merged_id = event.get('merged_order_id')
+                self._learn_part(merged_id, event.get('merged_parent_order_id'), event.get('merged_parts'))
+                self.merged[order_id].add(merged_id)
+            targets = {order_id} | self.merged.get(order_id, set())
+            finishing = event.get('event') in ('trip_finished', 'trip_canceled')
+            delivered = False
+            for target in targets:
+                owner_id = self.part_of.get(target, target)
+                inbox = self.sessions.get(self.owners.get(owner_id))
+                message = dict(event, kind='event', order_id=owner_id, trip_order_id=order_id)
+                if finishing and not self._finish(target):
+                    # 他のカートがまだ走っている
+                    state = self.parts[owner_id]
+                    message.update(event='part_finished', part_event=event.get('event'),
+                                   parts_done=len(state['done']), parts=state['count'])
+                if inbox is not None:
+                    inbox.put(message)
+                    delivered = True
+            if finishing:
+                self.merged.pop(order_id, None)
+            self.stats['events' if delivered else 'unrouted'] += 1
+            return delivered
+
+    def drain(self, session_id):
+        """セッションに届いたメッセージを全て取り出す（返事の無いまま時間切れの注文も含む）"""
+        now = self.clock()
+        with self._lock:
+            inbox = self._inbox(session_id)
+            for order_id, pressed_at in list(inbox.pending.items()):
+                if now - pressed_at > self.ack_timeout:
+                    del inbox.pending[order_id]
+                    self.stats['timeouts'] += 1
+                    inbox.put({'kind': 'timeout', 'order_id': order_id})
+            self._evict(now)
+        messages = []
+        while True:
+            try:
+                messages.append(inbox.queue.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def _evict(self, now):
+        for session_id in [sid for sid, inbox in self.sessions.items()
+                           if now - inbox.last_used > self.idle_timeout]:
+            del self.sessions[session_id]
+        if len(self.owners) > len(self.sessions) * (self.max_pending + 10):
+            self.owners = {order_id: sid for order_id, sid in self.owners.items() if sid in self.sessions}
+            self.part_of = {part: parent for part, parent in self.part_of.items() if parent in self.owners}
+            self.parts = {parent: state for parent, state in self.parts.items() if parent in self.owners}
+
+    def latency_summary(self):
+        """ボタンを押してからロボットが受け付けるまでの時間[ms]"""
+        with self._lock:
+            values = sorted(self.latencies)
+            stats = dict(self.stats, sessions=len(self.sessions))
+        if not values:
+            return dict(stats, p50_ms=0.0, p90_ms=0.0, max_ms=0.0)
+
+        def percentile(q):
+            return round(values[min(len(values) - 1, int(q * len(values)))] * 1000.0, 1)
+        return dict(stats, p50_ms=percentile(0.5), p90_ms=percentile(0.9), max_ms=percentile(1.0))
@@ -0,0 +1,31 @@
+"""
+注文まわりのトピック名と QoS（app.py・ナビゲーター・fleet_dispatcher.py で共通）。
+
+注文と受付の返事は取りこぼすと画面が待ちっぱなしになるので RELIABLE にし、
+売り場の端末が一斉に送っても溢れないよう履歴を深めに持つ。
+起動が遅れたノードに古い注文が届かないよう、durability は VOLATILE のまま。
+"""
+from rclpy.qos import DurabilityPolicy, HistoryPolicy, QoSProfile, ReliabilityPolicy
+
+ORDER_TOPIC = 'shopping_list'
+ACK_TOPIC = 'order_ack'
+EVENT_TOPIC = 'order_event'
+
+ORDER_QOS = QoSProfile(
+    reliability=ReliabilityPolicy.RELIABLE,
+    history=HistoryPolicy.KEEP_LAST,
+    depth=50,
+    durability=DurabilityPolicy.VOLATILE)
+
+
+def unwrap_order(message):
+    """
+    shopping_list に届いたものを (エンベロープ または None, 商品リスト または None) にする。
+    素のリストは (None, リスト)、お会計完了の通知などリスト以外は (…, None)。
+    """
+    if isinstance(message, list):
+        return None, message
+    if isinstance(message, dict) and message.get('type') == 'order':
+        items = message.get('items')
+        return message, items if isinstance(items, list) else None
+    return None, None
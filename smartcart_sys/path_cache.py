@@ -0,0 +1,368 @@
+"""
+よく通る区間（レジ → 米、カレールー → 牛乳 など）の経路を使い回すキャッシュ。
+
+goToPose は毎回 Nav2 のプランナー(NavFn)に経路を計算させるが、CachedPathNavigator は
+  1. 出発地点を cell_size[m] のマスに丸めたものとゴールを鍵にキャッシュを引き、
+  2. あればコストマップで経路上に障害物が無いかだけ確かめて followPath で送り、
+  3. 無ければ getPath で計算してキャッシュに入れてから followPath で送る。
+キャッシュした経路で失敗したらその経路を捨て、回復動作つきの goToPose でやり直す。
+コストマップが変わった経路は次に使うときに確かめ直し、地図そのものが変わったら全て捨てる。
+
+prefetch() で次の区間（今のゴール → 次の棚やレジ）を知らせておくと、棚に向かう間や積み込みを
+待つ間に run_prefetch() が経路を計算してキャッシュに入れるので、出発時には計画を待たずに走り出せる。
+ゴールの許容誤差の分だけ止まる位置はずれるので、隣のマスから始まる経路も始点がその誤差以内なら使う。
+使い回す経路は始点まで戻らないように、今の位置から経路の一番近い区間の先の点へつないでから送る。
+
+BasicNavigator（または nav_sim.SimNavigator）を包むだけで、TripExecutor からは navigator と同じに見える。
+"""
+import collections
+import copy
+import math
+import threading
+import time
+import types
+import zlib
+
+from smartcart_sys.trip_executor import TaskResult
+
+DEFAULT_CELL_SIZE = 0.5
+DEFAULT_MAX_ENTRIES = 256
+# 隣のマスの経路を使ってよい始点のずれ[m]（nav2_params.yaml の goal_checker の xy_goal_tolerance）
+DEFAULT_MAX_OFFSET = 0.25
+
+# nav2_costmap_2d の INSCRIBED_INFLATED_OBSTACLE。これ以上のコストのセルを通る経路は使わない
+INSCRIBED_COST = 253
+NO_INFORMATION = 255
+
+
+def pose_coords(pose):
+    """PoseStamped または [x, y, yaw] を [x, y, yaw] にする"""
+    if hasattr(pose, 'pose'):
+        p = pose.pose
+        return [p.position.x, p.position.y, 2.0 * math.atan2(p.orientation.z, p.orientation.w)]
+    return [float(pose[0]), float(pose[1]), float(pose[2]) if len(pose) > 2 else 0.0]
+
+
+def path_points(path):
+    """nav_msgs/Path（または SimNavigator の経路）の (x, y) の並び"""
+    points = []
+    for pose in getattr(path, 'poses', None) or []:
+        if hasattr(pose, 'pose'):
+            points.append((pose.pose.position.x, pose.pose.position.y))
+        else:
+            points.append((pose[0], pose[1]))
+    return points
+
+
+def segment_distance(point, a, b):
+    """点 point から線分 a-b までの距離"""
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length2 = dx * dx + dy * dy
+    t = 0.0 if length2 == 0 else max(0.0, min(1.0, ((point[0] - a[0]) * dx + (point[1] - a[1]) * dy) / length2))
+    return math.hypot(a[0] + t * dx - point[0], a[1] + t * dy - point[1])
+
+
+class CostmapView:
+    """
+    コストマップの読み取り用の写し（nav2_msgs/Costmap から作る）。
+    version は地図そのものの識別子（大きさ・解像度・原点）、fingerprint は中身のチェックサム。
+    """
+
+    def __init__(self, width, height, resolution, origin_x, origin_y, data, version=None, allow_unknown=True):
+        self.width = width
+        self.height = height
+        self.resolution = resolution
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+        self.data = bytes(data)
+        self.version = version if version is not None else (width, height, resolution, origin_x, origin_y)
+        self.allow_unknown = allow_unknown
+        self.fingerprint = zlib.crc32(self.data)
+
+    @classmethod
+    def from_msg(cls, msg, allow_unknown=True):
+        # get_costmap は map_load_time に応答した時刻を入れるので、地図の識別には使わない
+        # （大きさ・解像度・原点が同じなら同じ地図とみなし、中身の変化は fingerprint で確かめる）
+        meta = msg.metadata
+        return cls(meta.size_x, meta.size_y, meta.resolution, meta.origin.position.x, meta.origin.position.y,
+                   msg.data, allow_unknown=allow_unknown)
+
+    @classmethod
+    def from_grid(cls, grid, blocked):
+        """map_layers の GridLayer と通れないマスクから作る（シミュレーター用）"""
+        data = bytes(INSCRIBED_COST if cell else 0 for cell in blocked)
+        return cls(grid.width, grid.height, grid.resolution, grid.origin[0], grid.origin[1], data)
+
+    def cost(self, x, y):
+        gx = int(math.floor((x - self.origin_x) / self.resolution))
+        gy = int(math.floor((y - self.origin_y) / self.resolution))
+        if not (0 <= gx < self.width and 0 <= gy < self.height):
+            return NO_INFORMATION
+        return self.data[gy * self.width + gx]
+
+    def path_clear(self, points):
+        """経路の点の間も解像度ごとに調べ、障害物(とその内接半径)にかかっていなければ True"""
+        previous = None
+        for point in points:
+            if previous is None:
+                samples = [point]
+            else:
+                steps = max(1, int(math.hypot(point[0] - previous[0], point[1] - previous[1]) / self.resolution))
+                samples = [(previous[0] + (point[0] - previous[0]) * i / steps,
+                            previous[1] + (point[1] - previous[1]) * i / steps) for i in range(1, steps + 1)]
+            for x, y in samples:
+                cost = self.cost(x, y)
+                if cost == NO_INFORMATION:
+                    if not self.allow_unknown:
+                        return False
+                elif cost >= INSCRIBED_COST:
+                    return False
+            previous = point
+        return True
+
+
+class PathCache:
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE, max_entries=DEFAULT_MAX_ENTRIES, max_offset=DEFAULT_MAX_OFFSET):
+        self.cell_size = cell_size
+        self.max_offset = max_offset
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()   # 鍵 -> [経路, 点の並び, 確かめたときのコストマップの fingerprint]
+        self.map_version = None
+        self.stats = {'hits': 0, 'misses': 0, 'invalidated': 0, 'evicted': 0, 'cleared': 0}
+        self._lock = threading.Lock()
+
+    def key(self, start, goal):
+        """(出発地点のマス, ゴールの座標)"""
+        goal = pose_coords(goal)
+        return (int(math.floor(start[0] / self.cell_size)), int(math.floor(start[1] / self.cell_size)),
+                round(goal[0], 2), round(goal[1], 2), round(goal[2], 2))
+
+    def update_map(self, version):
+        """地図が変わっていたら全て捨てる"""
+        with self._lock:
+            if version != self.map_version:
+                if self.map_version is not None and self.entries:
+                    self.stats['cleared'] += len(self.entries)
+                    self.entries.clear()
+                self.map_version = version
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.entries
+
+    def _usable(self, key, costmap):
+        """コストマップが前に確かめたときから変わっていれば確かめ直し、通れなくなった経路は捨てる"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if costmap is not None and entry[2] != costmap.fingerprint:
+            if not costmap.path_clear(entry[1]):
+                del self.entries[key]
+                self.stats['invalidated'] += 1
+                return None
+            entry[2] = costmap.fingerprint
+        return entry
+
+    def lookup(self, start, goal, costmap=None):
+        """
+        (鍵, 経路) を返す（使える経路が無ければ経路は None、鍵は start のマスのもの）。
+        start のマスに無ければ隣のマスも探し、経路の始点が start から max_offset 以内なら使う。
+        """
+        key = self.key(start, goal)
+        neighbours = sorted(((dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy),
+                            key=lambda d: d[0] * d[0] + d[1] * d[1])
+        with self._lock:
+            for dx, dy in [(0, 0)] + neighbours:
+                candidate = (key[0] + dx, key[1] + dy) + key[2:]
+                entry = self._usable(candidate, costmap)
+                if entry is None:
+                    continue
+                if (dx or dy) and (not entry[1] or math.hypot(entry[1][0][0] - start[0],
+                                                              entry[1][0][1] - start[1]) > self.max_offset):
+                    continue
+                self.entries.move_to_end(candidate)
+                self.stats['hits'] += 1
+                return candidate, entry[0]
+            self.stats['misses'] += 1
+            return key, None
+
+    def put(self, key, path, costmap=None):
+        with self._lock:
+            self.entries[key] = [path, path_points(path), costmap.fingerprint if costmap is not None else None]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def discard(self, key):
+        with self._lock:
+            if self.entries.pop(key, None) is not None:
+                self.stats['invalidated'] += 1
+
+
+class CachedPathNavigator:
+    """
+    navigator   : BasicNavigator など（getPath / followPath を持つもの）
+    make_pose   : [x, y, yaw] -> getPath に渡す出発地点
+    get_start   : 現在位置 [x, y, yaw]（分からなければ None。その場合はキャッシュを使わない）
+    get_costmap : CostmapView を返す関数（None ならコストマップでの確認をしない）
+    planner     : 先読みの経路計算に使うもの（navigator と別の BasicNavigator。走行中の指令の結果を
+                  上書きしないように分ける。None なら navigator を使う＝シミュレーター向け）
+    """
+
+    def __init__(self, navigator, cache, make_pose, get_start, get_costmap=None, costmap_interval=1.0,
+                 planner=None, clock=time.monotonic):
+        self.navigator = navigator
+        self.planner = planner if planner is not None else navigator
+        self.cache = cache
+        self.make_pose = make_pose
+        self.get_start = get_start
+        self.get_costmap = get_costmap
+        self.costmap_interval = costmap_interval
+        self.clock = clock
+        self.costmap = None
+        self._costmap_at = None
+        self._following = None    # キャッシュ・計画した経路をたどっている間の (鍵, ゴール)
+        self.plan_ms = collections.deque(maxlen=200)
+        self.stats = {'direct': 0, 'fallbacks': 0, 'prefetched': 0, 'prefetch_failed': 0}
+        # 先に計算しておく区間 [(出発地点, ゴール), ...]。prefetch() は別スレッドから呼んでもよい
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_queue = collections.deque()
+
+    def __getattr__(self, name):
+        # isTaskComplete などを除く操作はそのまま navigator に渡す
+        return getattr(self.navigator, name)
+
+    def _refresh_costmap(self):
+        if self.get_costmap is None:
+            return
+        now = self.clock()
+        if self._costmap_at is not None and now - self._costmap_at < self.costmap_interval:
+            return
+        self._costmap_at = now
+        try:
+            costmap = self.get_costmap()
+        except Exception:
+            costmap = None
+        if costmap is not None:
+            self.costmap = costmap
+            self.cache.update_map(costmap.version)
+
+    def _go_direct(self, pose):
+        self._following = None
+        self.stats['direct'] += 1
+        return self.navigator.goToPose(pose)
+
+    def _plan(self, navigator, start, goal):
+        """経路を計算し、コストマップで通れることを確かめる（使えなければ None）"""
+        try:
+            path = navigator.getPath(self.make_pose(start), goal, use_start=True)
+        except Exception:
+            return None
+        if path is None or len(path_points(path)) < 2:
+            return None
+        if self.costmap is not None and not self.costmap.path_clear(path_points(path)):
+            return None
+        return path
+
+    def _from_here(self, path, start):
+        """
+        キャッシュした経路を start から始まる経路にする（使えなければ None）。
+        経路の始点は start と同じマスの中（隣のマスなら max_offset 以内）でずれているので、始点まで戻らずに、
+        先頭 2マス分の区間のうち start に一番近い区間の先の点へ直接つなぐ。
+        """
+        points = path_points(path)
+        reach = 2.0 * self.cache.cell_size
+        best, join, travelled = None, 1, 0.0
+        for i in range(len(points) - 1):
+            d = segment_distance(start, points[i], points[i + 1])
+            if best is None or d < best:
+                best, join = d, i + 1
+            travelled += math.hypot(points[i + 1][0] - points[i][0], points[i + 1][1] - points[i][1])
+            if travelled > reach:
+                break
+        if self.costmap is not None and not self.costmap.path_clear([(start[0], start[1]), points[join]]):
+            return None
+        joined = copy.copy(path)
+        joined.poses = [self.make_pose(start)] + list(path.poses[join:])
+        return joined
+
+    def goToPose(self, pose, *args, **kwargs):
+        start = self.get_start()
+        if start is None:
+            return self._go_direct(pose)
+        begin = time.perf_counter()
+        self._refresh_costmap()
+        key, path = self.cache.lookup(start, pose, self.costmap)
+        if path is not None:
+            path = self._from_here(path, start)
+            if path is None:
+                key = self.cache.key(start, pose)
+        if path is None:
+            path = self._plan(self.navigator, start, pose)
+            if path is None:
+                return self._go_direct(pose)
+            self.cache.put(key, path, self.costmap)
+        # 出発時に経路を用意するのにかかった時間（キャッシュを引く時間を含む）
+        self.plan_ms.append((time.perf_counter() - begin) * 1000.0)
+        self._following = (key, pose)
+        return self.navigator.followPath(path)
+
+    def prefetch(self, start, goal):
+        """start[x, y, yaw] から goal[x, y, yaw] への経路を、次の run_prefetch() で計算するよう予約する"""
+        with self._prefetch_lock:
+            if (start, goal) not in self._prefetch_queue:
+                self._prefetch_queue.append((start, goal))
+
+    def run_prefetch(self, limit=1):
+        """
+        予約された区間の経路を limit 件まで計算してキャッシュに入れる。
+        planner が navigator と別なら、走行管理とは別のスレッドから呼んでよい（計画を待つ間も走行が進む）。
+        planner が navigator そのものなら、navigator への指令と同じスレッドから呼ぶ。
+        コストマップは取り直さず goToPose で取った最新のものを使う（古くても、使うときに確かめ直す）。
+        """
+        for _ in range(limit):
+            with self._prefetch_lock:
+                if not self._prefetch_queue:
+                    return
+                start, goal = self._prefetch_queue.popleft()
+            pose = self.make_pose(goal)
+            key = self.cache.key(start, pose)
+            if key in self.cache:
+                continue
+            path = self._plan(self.planner, start, pose)
+            if path is None:
+                self.stats['prefetch_failed'] += 1
+                continue
+            self.cache.put(key, path, self.costmap)
+            self.stats['prefetched'] += 1
+
+    def isTaskComplete(self):
+        done = self.navigator.isTaskComplete()
+        if done and self._following is not None:
+            key, pose = self._following
+            self._following = None
+            result = self.navigator.getResult()
+            if result not in (TaskResult.SUCCEEDED, TaskResult.CANCELED):
+                # 経路が使えなかった。捨てて、計画と回復動作つきの goToPose でやり直す
+                self.cache.discard(key)
+                self.stats['fallbacks'] += 1
+                self.navigator.goToPose(pose)
+                return False
+        return done
+
+    def getFeedback(self):
+        feedback = self.navigator.getFeedback()
+        if self._following is not None and feedback is not None and not hasattr(feedback, 'distance_remaining'):
+            # FollowPath のフィードバックは distance_to_goal
+            return types.SimpleNamespace(distance_remaining=getattr(feedback, 'distance_to_goal', None))
+        return feedback
+
+    def cancelTask(self):
+        self._following = None
+        return self.navigator.cancelTask()
+
+    def summary(self):
+        values = sorted(self.plan_ms)
+        mean = sum(values) / len(values) if values else 0.0
+        return dict(self.cache.stats, **self.stats, entries=len(self.cache.entries), plan_ms_mean=round(mean, 2))
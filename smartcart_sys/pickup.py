@@ -0,0 +1,98 @@
+"""
+棚での積み込みの検出。
+
+カートのスキャナーの /cart_update（cart_state.py の差分イベント）を「どの棚の商品が何個積まれたか」に変える。
+棚はカタログの shelf_of(JANコード) で引き、棚が決まっていない商品は商品名から item_resolver で探す。
+取り出し・取り消しのイベントは個数が負になるので、数え直しにそのまま使える。
+
+TripExecutor（simple_navigator.py）は item_scanned() に渡して棚での待ちを終え、
+ブロックして走る shopping_navigator_real.py は PickupCounter.wait() で待つ。
+"""
+import collections
+import threading
+import time
+
+from smartcart_sys.catalog import get_catalog
+from smartcart_sys.item_resolver import find_location
+
+# 待っても積まれなかったときの扱い
+SKIP = 'skip'      # 次の棚へ進む
+WAIT = 'wait'      # 積まれるまで待ち続ける（timeout を使わない）
+ABORT = 'abort'    # 残りの棚をやめてレジへ戻る
+SKIP_POLICIES = (SKIP, WAIT, ABORT)
+
+# 数えるイベント（スナップショットとお会計のクリアは数えない）
+COUNTED_EVENTS = ('add', 'remove', 'undo')
+
+
+def scanned_shelf(event, resolve=find_location):
+    """
+    /cart_update のイベント(dict) -> (棚の名前, 個数)。数えないイベントなら None。
+    棚が分からない商品は棚の名前が None になる（今いる棚の商品とみなすかは受け取る側が決める）。
+    """
+    if event.get('type') not in COUNTED_EVENTS or not event.get('qty'):
+        return None
+    shelf = None
+    try:
+        shelf = get_catalog().shelf_of(event.get('sku', ''))
+    except (OSError, ValueError):
+        pass  # カタログが無くても商品名から探す
+    if shelf is None and event.get('name'):
+        shelf, _ = resolve(event['name'])
+    return shelf, int(event['qty'])
+
+
+class PickupCounter:
+    """
+    この行程で棚ごとに積まれた個数。add() はスキャナーのコールバック、wait() は走行側のスレッドから呼ぶ。
+    棚の分からない商品は、watch() で指定した今待っている棚の分として数える（待っていなければ数えない）。
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._counts = collections.Counter()
+        self._watching = None
+
+    def reset(self):
+        with self._condition:
+            self._counts.clear()
+            self._watching = None
+
+    def watch(self, shelf):
+        with self._condition:
+            self._watching = shelf
+
+    def add(self, shelf, qty=1):
+        with self._condition:
+            if shelf is None:
+                shelf = self._watching
+                if shelf is None:
+                    return
+            self._counts[shelf] += qty
+            self._condition.notify_all()
+
+    def count(self, shelf):
+        with self._condition:
+            return self._counts[shelf]
+
+    def take(self, shelf, qty):
+        """棚を出るときに、その棚の分として使ったスキャンを qty 個まで差し引く（同じ棚にまた寄る場合のため）"""
+        with self._condition:
+            taken = max(0, min(qty, self._counts[shelf]))
+            self._counts[shelf] -= taken
+            return taken
+
+    def wait(self, shelf, expected, timeout=None):
+        """shelf の商品が expected 個積まれるまで待ち、積まれたら True（timeout 秒で諦めたら False）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._watching = shelf
+            try:
+                while self._counts[shelf] < expected:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                return True
+            finally:
+                self._watching = None
@@ -0,0 +1,176 @@
+"""
+Gemini の応答キャッシュ。
+
+「カレーが食べたい」のように同じ（ほぼ同じ）相談が多いので、
+モデル名・システム指示・（チャットならそれまでの会話と）要望 を正規化したものをキーにして、
+応答文を SQLite に保存する。Streamlit を再起動しても残り、全セッションで共有する。
+  - ttl         : 保存してからこの秒数を過ぎた応答は使わない（献立の提案が古くならないように）
+  - max_entries : これを超えたら、最後に使われたのが古いものから消す(LRU)
+
+動作確認（APIを使わず偽モデルで2回目がキャッシュから返ることを見る）:
+    python3 -m smartcart_sys.response_cache
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+
+from smartcart_sys.catalog import CACHE_DIR
+from smartcart_sys.gemini_stub import StubModel
+
+DEFAULT_PATH = os.path.join(CACHE_DIR, 'gemini_responses.sqlite3')
+DEFAULT_TTL = 24 * 3600.0
+DEFAULT_MAX_ENTRIES = 2000
+
+# 文末の「。」「！」などの有無や空白の違いは同じ要望として扱う
+_SPACES = re.compile(r'\s+')
+_TRAILING = re.compile(r'[。．.、,!！?？~〜ー]+$')
+
+
+def normalize_prompt(text):
+    text = unicodedata.normalize('NFKC', str(text or '')).lower()
+    return _TRAILING.sub('', _SPACES.sub('', text))
+
+
+def cache_key(model_name, system_instruction, prompt, history=()):
+    """history は (役割, 本文) の並び（チャットの場合のそれまでの会話）"""
+    data = json.dumps([
+        model_name,
+        normalize_prompt(system_instruction),
+        [(role, normalize_prompt(content)) for role, content in history],
+        normalize_prompt(prompt),
+    ], ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Streamlit は各セッションを別スレッドで動かすので、1つの接続をロックで守って共有する
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # ヒットのたびに last_used を書くので、書き込みを軽くしておく
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            ' key TEXT PRIMARY KEY, model TEXT, prompt TEXT, response TEXT,'
+            ' created_at REAL, last_used REAL, hits INTEGER DEFAULT 0)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+        self._db.commit()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'stored': 0}
+
+    def get(self, key):
+        now = self.clock()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT response, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._db.commit()
+                self.stats['expired'] += 1
+                row = None
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            self._db.execute(
+                'UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?', (now, key))
+            self._db.commit()
+            self.stats['hits'] += 1
+            return row[0]
+
+    def put(self, key, response, model_name='', prompt=''):
+        now = self.clock()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses (key, model, prompt, response, created_at, last_used, hits)'
+                ' VALUES (?, ?, ?, ?, ?, ?, 0)', (key, model_name, str(prompt), response, now, now))
+            count = self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            if count > self.max_entries:
+                excess = count - self.max_entries
+                self._db.execute(
+                    'DELETE FROM responses WHERE key IN'
+                    ' (SELECT key FROM responses ORDER BY last_used LIMIT ?)', (excess,))
+                self.stats['evicted'] += excess
+            self._db.commit()
+            self.stats['stored'] += 1
+
+    def get_or_generate(self, model_name, system_instruction, prompt, generate, history=()):
+        """
+        キャッシュにあればそれを、無ければ generate() で作って保存したものを返す。
+        (応答文, キャッシュから返したか) を返す。空の応答と例外は保存しない。
+        """
+        key = cache_key(model_name, system_instruction, prompt, history)
+        text = self.get(key)
+        if text is not None:
+            return text, True
+        text = generate()
+        if text:
+            self.put(key, text, model_name, prompt)
+        return text, False
+
+    def lookup(self, model_name, system_instruction, prompt, history=()):
+        """(キー, キャッシュの応答文 または None) を返す。ストリーミングで受ける場合に使う"""
+        key = cache_key(model_name, system_instruction, prompt, history)
+        return key, self.get(key)
+
+    def record_stream(self, key, chunks, model_name='', prompt=''):
+        """
+        文字列の断片をそのまま流しながら集め、最後まで受け取れたときだけ保存するジェネレーター
+        （途中で止まった応答は保存しない）。
+        """
+        parts = []
+        for part in chunks:
+            parts.append(part)
+            yield part
+        text = ''.join(parts)
+        if text:
+            self.put(key, text, model_name, prompt)
+
+    def entries(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def metrics(self):
+        stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        stats['entries'] = self.entries()
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM responses')
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def main():
+    model = StubModel(delay=0.5)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResponseCache(os.path.join(tmp, 'responses.sqlite3'))
+        for prompt in ['カレーが食べたい', 'カレーが食べたい！', ' カレーが 食べたい。', '肉じゃがを作りたい']:
+            start = time.perf_counter()
+            text, cached = cache.get_or_generate(
+                model.model_name, 'system', prompt, lambda: model.generate_content(prompt).text)
+            elapsed = (time.perf_counter() - start) * 1000.0
+            print(f'{prompt!r:24} {"hit " if cached else "miss"} {elapsed:7.1f}ms')
+        print(cache.metrics(), f'model calls: {model.calls}')
+        cache.close()
+
+
+if __name__ == '__main__':
+    main()
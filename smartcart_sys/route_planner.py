@@ -0,0 +1,149 @@
+import itertools
+import math
+
+# 厳密解(Held-Karp)を使う最大の立ち寄り数。これを超えたら近似解(最近傍法 + 2-opt)
+EXACT_SOLVER_LIMIT = 10
+
+
+def euclidean_distance(a, b):
+    """(名前, [x, y, ...]) の2地点間の直線距離"""
+    return math.hypot(b[1][0] - a[1][0], b[1][1] - a[1][1])
+
+
+class RoutePlan:
+    """巡回計画の結果（並べ替えた立ち寄り先と、素直に回った場合との距離比較）"""
+
+    def __init__(self, stops, planned_distance, naive_distance, method):
+        self.stops = stops
+        self.planned_distance = planned_distance
+        self.naive_distance = naive_distance
+        self.method = method
+
+    @property
+    def saving(self):
+        return self.naive_distance - self.planned_distance
+
+    def __repr__(self):
+        names = [name for name, _ in self.stops]
+        return (f'RoutePlan({names}, planned={self.planned_distance:.2f}m, '
+                f'naive={self.naive_distance:.2f}m, method={self.method})')
+
+
+def _path_length(matrix, order):
+    return sum(matrix[a][b] for a, b in zip(order, order[1:]))
+
+
+def _solve_exact(matrix, n):
+    """Held-Karp法。ノード0=出発地点, 1..n=立ち寄り先, n+1=レジ"""
+    end = n + 1
+    # best[(mask, j)] = (距離, 直前のノード)
+    best = {}
+    for j in range(1, n + 1):
+        best[(1 << (j - 1), j)] = (matrix[0][j], 0)
+
+    for size in range(2, n + 1):
+        for subset in itertools.combinations(range(1, n + 1), size):
+            mask = 0
+            for j in subset:
+                mask |= 1 << (j - 1)
+            for j in subset:
+                prev_mask = mask & ~(1 << (j - 1))
+                best[(mask, j)] = min(
+                    (best[(prev_mask, k)][0] + matrix[k][j], k)
+                    for k in subset if k != j)
+
+    full = (1 << n) - 1
+    _, last = min((best[(full, j)][0] + matrix[j][end], j) for j in range(1, n + 1))
+
+    # 経路の復元
+    order = []
+    mask = full
+    node = last
+    while node != 0:
+        order.append(node)
+        _, prev = best[(mask, node)]
+        mask &= ~(1 << (node - 1))
+        node = prev
+    order.reverse()
+    return [0] + order + [end]
+
+
+def _solve_heuristic(matrix, n):
+    """最近傍法で初期解を作り、2-optで交差を解消する"""
+    end = n + 1
+    unvisited = set(range(1, n + 1))
+    order = [0]
+    while unvisited:
+        current = order[-1]
+        nearest = min(unvisited, key=lambda j: matrix[current][j])
+        order.append(nearest)
+        unvisited.remove(nearest)
+    order.append(end)
+
+    improved = True
+    while improved:
+        improved = False
+        # 出発地点とレジは固定して、間の区間だけを反転させる
+        for i in range(1, len(order) - 2):
+            for k in range(i + 1, len(order) - 1):
+                a, b = order[i - 1], order[i]
+                c, d = order[k], order[k + 1]
+                delta = (matrix[a][c] + matrix[b][d]) - (matrix[a][b] + matrix[c][d])
+                if delta < -1e-9:
+                    order[i:k + 1] = reversed(order[i:k + 1])
+                    improved = True
+    return order
+
+
+def plan_route(start, stops, end, distance=euclidean_distance):
+    """
+    出発地点 → 全ての棚 → レジ の巡回順を決める。
+    start, end, stops の各要素は (名前, [x, y, yaw]) の形。
+    distance(a, b) を差し替えれば地図上の経路長などでも計画できる。
+    """
+    stops = list(stops)
+    n = len(stops)
+    nodes = [start] + stops + [end]
+    matrix = [[distance(a, b) for b in nodes] for a in nodes]
+
+    naive_order = list(range(n + 2))
+    naive_distance = _path_length(matrix, naive_order)
+
+    if n <= 1:
+        return RoutePlan(stops, naive_distance, naive_distance, 'trivial')
+
+    if n <= EXACT_SOLVER_LIMIT:
+        order, method = _solve_exact(matrix, n), 'exact'
+    else:
+        order, method = _solve_heuristic(matrix, n), 'nn+2opt'
+
+    planned_distance = _path_length(matrix, order)
+    # 念のため、元の順番より悪くなる場合は元の順番を使う
+    if planned_distance > naive_distance:
+        return RoutePlan(stops, naive_distance, naive_distance, method)
+
+    ordered_stops = [nodes[i] for i in order[1:-1]]
+    return RoutePlan(ordered_stops, planned_distance, naive_distance, method)
+
+
+def plan_shopping_route(shopping_list, start, end, resolve, distance=euclidean_distance):
+    """
+    買い物リストを棚ごとにまとめてから plan_route() する。
+    resolve(item_name) -> (棚の名前, 座標) / 見つからなければ (None, None)
+    戻り値: (RoutePlan, {棚の名前: [商品名, ...]}, [見つからなかった商品名])
+    """
+    locations = {}
+    items_by_key = {}
+    unknown = []
+    for item_name in shopping_list:
+        key, coords = resolve(item_name)
+        if key is None:
+            unknown.append(item_name)
+            continue
+        if key not in locations:
+            locations[key] = coords
+            items_by_key[key] = []
+        items_by_key[key].append(item_name)
+
+    plan = plan_route(start, list(locations.items()), end, distance=distance)
+    return plan, items_by_key, unknown
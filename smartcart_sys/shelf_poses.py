@@ -0,0 +1,175 @@
+"""
+棚の座標（store_layout.py の手で測った値）を地図で確かめ、障害物に近すぎる座標を安全な位置に寄せる。
+
+障害物までの距離が min_clearance（nav2_params.yaml の inflation_radius）未満の座標や、
+レジから行けない座標は、max_shift 以内で一番近い「十分に離れていて、レジから行ける」位置に動かし、
+向きは一番近い障害物（＝棚）の方へ向け直す。Nav2 がゴール付近で探索や回復動作に時間を使わずに済む。
+
+結果は地図・座標表・設定から作るキーで maps/cache/ にキャッシュする。
+確認だけしたい場合:
+    python3 -m smartcart_sys.shelf_poses
+"""
+import collections
+import hashlib
+import json
+import math
+import os
+
+import yaml
+
+from smartcart_sys.map_distance import ROBOT_RADIUS, nearest_free_cell, store_locations
+from smartcart_sys.map_layers import CACHE_DIR, DEFAULT_PARAMS, load_map_layers, map_digest
+from smartcart_sys.store_layout import CASHIER_LOCATION
+from smartcart_sys.supermarket_map import DEFAULT_MAP_YAML
+
+# 座標を動かしてよい最大の距離[m]（これより遠くに安全な位置しか無ければ、直さずに「行けない」と報告する）
+DEFAULT_MAX_SHIFT = 1.0
+
+OK = 'ok'
+SNAPPED = 'snapped'
+UNREACHABLE = 'unreachable'
+
+
+def load_min_clearance(path=DEFAULT_PARAMS, default=0.35):
+    """global_costmap の inflation_radius（ゴールに必要な障害物までの距離）"""
+    try:
+        with open(path) as f:
+            params = yaml.safe_load(f)
+        inflation = params['global_costmap']['global_costmap']['ros__parameters']['inflation_layer']
+        return float(inflation.get('inflation_radius', default))
+    except (OSError, KeyError, TypeError):
+        return default
+
+
+class ShelfPoseSnapper:
+    def __init__(self, grid, min_clearance, robot_radius=ROBOT_RADIUS, max_shift=DEFAULT_MAX_SHIFT,
+                 home=CASHIER_LOCATION):
+        self.grid = grid
+        self.min_clearance = min_clearance
+        self.max_shift = max_shift
+        self.blocked = grid.blocked(robot_radius)
+        self.reachable = self._flood(home)
+
+    def _flood(self, home):
+        """レジから通れるセルをたどった範囲 (1=行ける)"""
+        grid = self.grid
+        width = grid.width
+        reachable = bytearray(width * grid.height)
+        start = nearest_free_cell(self.blocked, grid, *grid.world_to_grid(home[0], home[1]))
+        if start is None:
+            return reachable
+        reachable[start[1] * width + start[0]] = 1
+        queue = collections.deque([start])
+        while queue:
+            x, y = queue.popleft()
+            for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                if grid.in_bounds(nx, ny):
+                    index = ny * width + nx
+                    if not reachable[index] and not self.blocked[index]:
+                        reachable[index] = 1
+                        queue.append((nx, ny))
+        return reachable
+
+    def _usable(self, gx, gy):
+        index = gy * self.grid.width + gx
+        return self.reachable[index] and self.grid.distance[index] >= self.min_clearance
+
+    def _facing(self, gx, gy, fallback):
+        """セル (gx, gy) から一番近い障害物の方向[rad]"""
+        grid = self.grid
+        r = int(math.ceil(grid.distance[gy * grid.width + gx] / grid.resolution)) + 1
+        best = None
+        for dy in range(-r, r + 1):
+            for dx in range(-r, r + 1):
+                nx, ny = gx + dx, gy + dy
+                if grid.in_bounds(nx, ny) and grid.distance[ny * grid.width + nx] == 0.0:
+                    d = dx * dx + dy * dy
+                    if best is None or d < best[0]:
+                        best = (d, dx, dy)
+        if best is None:
+            return fallback
+        return round(math.atan2(best[2], best[1]), 3)
+
+    def snap(self, coords):
+        """(座標, 状態, 動かした距離[m], 障害物までの距離[m]) を返す。問題の無い座標はそのまま"""
+        grid = self.grid
+        x, y = coords[0], coords[1]
+        yaw = coords[2] if len(coords) > 2 else 0.0
+        gx, gy = grid.world_to_grid(x, y)
+        if grid.in_bounds(gx, gy) and self._usable(gx, gy):
+            return list(coords), OK, 0.0, grid.clearance(x, y)
+
+        # 近い順に候補のセルを調べる
+        r = int(math.ceil(self.max_shift / grid.resolution))
+        candidates = sorted((dx * dx + dy * dy, dx, dy) for dy in range(-r, r + 1) for dx in range(-r, r + 1)
+                            if dx * dx + dy * dy <= r * r)
+        for _, dx, dy in candidates:
+            nx, ny = gx + dx, gy + dy
+            if grid.in_bounds(nx, ny) and self._usable(nx, ny):
+                wx, wy = grid.grid_to_world(nx, ny)
+                pose = [round(wx, 3), round(wy, 3), self._facing(nx, ny, yaw)]
+                return pose, SNAPPED, math.hypot(wx - x, wy - y), grid.clearance(wx, wy)
+        return list(coords), UNREACHABLE, 0.0, grid.clearance(x, y)
+
+
+def validate(locations, snapper):
+    """{名前: {'pose', 'original', 'status', 'shift', 'clearance'}}"""
+    report = {}
+    for name, coords in sorted(locations.items()):
+        pose, status, shift, clearance = snapper.snap(coords)
+        report[name] = {'pose': pose, 'original': list(coords), 'status': status,
+                        'shift': round(shift, 3), 'clearance': round(clearance, 3)}
+    return report
+
+
+def cache_key(map_yaml, locations, min_clearance, robot_radius, max_shift):
+    h = hashlib.sha256()
+    h.update(map_digest(map_yaml))
+    h.update(json.dumps(sorted((k, list(v)) for k, v in locations.items())).encode())
+    h.update(repr((min_clearance, robot_radius, max_shift)).encode())
+    return h.hexdigest()
+
+
+def load_shelf_report(locations=None, map_yaml=DEFAULT_MAP_YAML, min_clearance=None,
+                      robot_radius=ROBOT_RADIUS, max_shift=DEFAULT_MAX_SHIFT, cache_dir=CACHE_DIR):
+    """確認結果をキャッシュから読む（地図・座標表・設定が変わっていれば確かめ直して保存する）"""
+    if locations is None:
+        locations = store_locations()
+    if min_clearance is None:
+        min_clearance = load_min_clearance()
+    key = cache_key(map_yaml, locations, min_clearance, robot_radius, max_shift)
+    path = os.path.join(cache_dir, f'shelf_poses_{key[:16]}.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('key') == key:
+            return data['shelves']
+
+    grid = load_map_layers(map_yaml).base
+    home = locations.get('cashier', CASHIER_LOCATION)
+    snapper = ShelfPoseSnapper(grid, min_clearance, robot_radius, max_shift, home=home)
+    report = validate(locations, snapper)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'key': key, 'shelves': report}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+    return report
+
+
+def load_shelf_poses(**kwargs):
+    """{名前: 直した座標}（行けない棚は元の座標のまま）"""
+    return {name: entry['pose'] for name, entry in load_shelf_report(**kwargs).items()}
+
+
+def main():
+    report = load_shelf_report()
+    width = max(len(name) for name in report)
+    for name, entry in report.items():
+        pose = ', '.join(f'{v:.3f}' for v in entry['pose'])
+        note = f" (moved {entry['shift']:.2f}m from {entry['original']})" if entry['status'] == SNAPPED else ''
+        print(f"{name:>{width}}: {entry['status']:<11} clearance {entry['clearance']:.2f}m  [{pose}]{note}")
+
+
+if __name__ == '__main__':
+    main()
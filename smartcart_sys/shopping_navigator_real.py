@@ -1,11 +1,16 @@
 import rclpy
 from rclpy.node import Node
+from rclpy.callback_groups import MutuallyExclusiveCallbackGroup
+from rclpy.executors import MultiThreadedExecutor
 from std_msgs.msg import String
 from geometry_msgs.msg import PoseStamped
 from nav2_simple_commander.robot_navigator import BasicNavigator, TaskResult
 import json
 import time
 
+from smartcart_sys.item_resolver import ItemResolver
+from smartcart_sys.pickup import PickupCounter, scanned_shelf, SKIP_POLICIES, WAIT, ABORT
+
 # --- REAL ROBOT CONFIGURATION (i-Cart Mini) ---
 # 1. Do NOT set initial pose in code. Use RViz "2D Pose Estimate" 
 #    or ensure AMCL is localized before running this node.
@@ -35,6 +40,24 @@ class ShoppingNavigator(Node):
             self.listener_callback,
             10)
         
+        self.resolver = ItemResolver(ITEM_LOCATIONS)
+
+        # The trip blocks inside listener_callback, so scanner updates get their own
+        # callback group and are handled by another executor thread meanwhile.
+        self.pickups = PickupCounter()
+        self.cart_subscription = self.create_subscription(
+            String,
+            'cart_update',
+            self.cart_update_callback,
+            10,
+            callback_group=MutuallyExclusiveCallbackGroup())
+
+        # Max seconds to wait at a shelf for its item to be scanned (0 = fixed pickup_time pause)
+        self.declare_parameter('load_timeout', 20.0)
+        self.declare_parameter('pickup_time', 3.0)
+        # When the item is not scanned in time: 'skip' / 'wait' (forever) / 'abort' (return to cashier)
+        self.declare_parameter('pickup_skip', 'skip')
+
         self.navigator = BasicNavigator()
         
         # CRITICAL CHANGE FOR REAL ROBOT:
@@ -54,34 +77,70 @@ class ShoppingNavigator(Node):
         except Exception as e:
             self.get_logger().error(f'JSON Error: {e}')
 
+    def cart_update_callback(self, msg):
+        try:
+            event = json.loads(msg.data)
+        except ValueError:
+            return
+        scanned = scanned_shelf(event, resolve=self.resolver.resolve)
+        if scanned is not None:
+            self.pickups.add(*scanned)
+
+    def wait_for_pickup(self, shelf):
+        """Block until an item from `shelf` is scanned. Returns (loaded, seconds waited)."""
+        start = time.monotonic()
+        load_timeout = self.get_parameter('load_timeout').value
+        if load_timeout <= 0:
+            time.sleep(self.get_parameter('pickup_time').value)
+            return True, time.monotonic() - start
+        timeout = None if self.get_parameter('pickup_skip').value == WAIT else load_timeout
+        loaded = self.pickups.wait(shelf, 1, timeout)
+        self.pickups.take(shelf, 1)
+        return loaded, time.monotonic() - start
+
     def execute_shopping_trip(self, shopping_list):
+        skip_policy = self.get_parameter('pickup_skip').value
+        if skip_policy not in SKIP_POLICIES:
+            self.get_logger().warn(f'Unknown pickup_skip "{skip_policy}", using "skip"')
+        self.pickups.reset()
+        dwell_times = []
+
         for item_name in shopping_list:
-            target_coords = self.find_coordinates(item_name)
+            shelf, target_coords = self.resolver.resolve(item_name)
             
             if target_coords:
+                if self.get_parameter('load_timeout').value > 0 and self.pickups.take(shelf, 1):
+                    self.get_logger().info(f'{item_name} is already in the cart. Skipping.')
+                    continue
+
                 x, y = target_coords
                 self.get_logger().info(f'Navigating to {item_name} ({x}, {y})')
                 
                 success = self.go_to_spot(target_coords)
                 
                 if success:
-                    self.get_logger().info(f'Arrived at {item_name}. Loading item...')
-                    time.sleep(3.0) # Simulate loading time
+                    self.get_logger().info(f'Arrived at {item_name}. Waiting for the item to be scanned...')
+                    loaded, dwell = self.wait_for_pickup(shelf)
+                    dwell_times.append((item_name, dwell))
+                    if loaded:
+                        self.get_logger().info(f'Loaded {item_name} after {dwell:.1f}s')
+                    else:
+                        self.get_logger().warn(f'{item_name} was not scanned within {dwell:.1f}s')
+                        if skip_policy == ABORT:
+                            self.get_logger().warn('Giving up the remaining items.')
+                            break
                 else:
                     self.get_logger().error(f'Failed to reach {item_name}')
             else:
                 self.get_logger().warn(f'Item "{item_name}" not found in database.')
 
+        if dwell_times:
+            total = sum(dwell for _, dwell in dwell_times)
+            summary = ', '.join(f'{name} {dwell:.1f}s' for name, dwell in dwell_times)
+            self.get_logger().info(f'Time at shelves: {total:.1f}s ({summary})')
         self.get_logger().info('Returning to Cashier...')
         self.go_to_spot(CASHIER_LOCATION)
 
-    def find_coordinates(self, item_name):
-        search_key = item_name.lower()
-        for key, coords in ITEM_LOCATIONS.items():
-            if key in search_key or search_key in key:
-                return coords
-        return None
-
     def go_to_spot(self, coords):
         goal_pose = PoseStamped()
         goal_pose.header.frame_id = 'map'
@@ -116,7 +175,9 @@ class ShoppingNavigator(Node):
 def main():
     rclpy.init()
     node = ShoppingNavigator()
-    rclpy.spin(node)
+    executor = MultiThreadedExecutor()
+    executor.add_node(node)
+    executor.spin()
     rclpy.shutdown()
 
 if __name__ == '__main__':
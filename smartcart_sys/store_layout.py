@@ -0,0 +1,35 @@
+# ==========================================
+# ★ここをあなたの計測した座標に書き換えてください★
+# 形式: [x(m), y(m), 向き(ラジアン)]
+# 向き: 0.0=東, 1.57=北, 3.14=西, -1.57=南
+# ==========================================
+ITEM_LOCATIONS = {
+    "curry roux":    [6.563,  7.9155,  1.57],  
+    "beef":         [12.267, 10.7331,  3.14],   
+    "pork":         [8.56, 11.03,  3.14],   
+    "onion":        [8.413, -1.271, 1.57], 
+    "carrot":        [10.81, -1.382, 1.57],
+    "garlic":        [12.507,  -1.453,  1.57],
+    "milk":        [12.288,  8.156,  1.57],
+    "soy sauce":        [8.794,  8.1634,  1.57],
+    "egg":        [12.742,  8.3377,  1.57],
+    "rice":        [3.876,  9.521,  1.57],
+}
+
+# レジ（帰還場所）
+CASHIER_LOCATION = [4.303, -1.636, -1.57]
+
+
+# 棚の別名（Geminiの出力ゆれ・日本語名）。キーは ITEM_LOCATIONS の名前
+ITEM_SYNONYMS = {
+    "curry roux": ["curry", "roux", "curry sauce", "カレー", "カレールー", "カレールウ"],
+    "beef":       ["ground beef", "minced beef", "beef steak", "牛肉", "牛ミンチ", "牛こま", "牛"],
+    "pork":       ["pork belly", "minced pork", "豚肉", "豚バラ肉", "豚こま", "豚"],
+    "onion":      ["onions", "玉ねぎ", "玉葱", "たまねぎ", "タマネギ"],
+    "carrot":     ["carrots", "人参", "にんじん", "ニンジン"],
+    "garlic":     ["にんにく", "ニンニク", "大蒜"],
+    "milk":       ["牛乳", "ミルク"],
+    "soy sauce":  ["soy", "shoyu", "醤油", "しょうゆ", "しょう油"],
+    "egg":        ["eggs", "卵", "たまご", "玉子", "卵(10個入)"],
+    "rice":       ["cooked rice", "米", "お米", "ご飯", "ごはん", "お米 5kg"],
+}
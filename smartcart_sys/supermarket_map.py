@@ -0,0 +1,121 @@
+import math
+import mmap
+import os
+
+import yaml
+
+# リポジトリ直下の maps/ フォルダ
+MAPS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'maps')
+DEFAULT_MAP_YAML = os.path.join(MAPS_DIR, 'supermarket_map.yaml')
+
+# セルの状態
+FREE = 0
+OCCUPIED = 1
+UNKNOWN = 2
+
+
+def read_pgm(path):
+    """バイナリPGM(P5)を読み込んで (幅, 高さ, 最大値, 画素) を返す。画素はファイルを mmap した memoryview"""
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # ヘッダ: マジックナンバー, 幅, 高さ, 最大値（#から行末まではコメント）
+    tokens = []
+    pos = 0
+    while len(tokens) < 4:
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b'#':
+            pos = data.find(b'\n', pos) + 1
+            continue
+        start = pos
+        while not data[pos:pos + 1].isspace():
+            pos += 1
+        tokens.append(data[start:pos])
+    pos += 1  # ヘッダ末尾の空白1文字
+
+    if tokens[0] != b'P5':
+        raise ValueError(f'Unsupported PGM format: {tokens[0]!r} ({path})')
+    width, height, max_value = int(tokens[1]), int(tokens[2]), int(tokens[3])
+    if max_value > 255:
+        raise ValueError(f'16-bit PGM is not supported ({path})')
+    return width, height, max_value, memoryview(data)[pos:pos + width * height]
+
+
+class OccupancyMap:
+    """map_server と同じ規則で読み込んだ占有格子地図"""
+
+    def __init__(self, width, height, resolution, origin, cells):
+        self.width = width
+        self.height = height
+        self.resolution = resolution
+        self.origin = origin
+        # cells[gy * width + gx] に FREE / OCCUPIED / UNKNOWN（gy=0 が地図の下端）
+        self.cells = cells
+
+    @staticmethod
+    def image_path(yaml_path):
+        """YAMLに書かれた画像ファイルのパス（相対パスはYAMLの場所が基準）"""
+        with open(yaml_path) as f:
+            info = yaml.safe_load(f)
+        return os.path.join(os.path.dirname(os.path.abspath(yaml_path)), info['image'])
+
+    @classmethod
+    def load(cls, yaml_path=DEFAULT_MAP_YAML):
+        with open(yaml_path) as f:
+            info = yaml.safe_load(f)
+
+        image_path = cls.image_path(yaml_path)
+        width, height, max_value, pixels = read_pgm(image_path)
+
+        negate = int(info.get('negate', 0))
+        occupied_thresh = float(info.get('occupied_thresh', 0.65))
+        free_thresh = float(info.get('free_thresh', 0.196))
+
+        cells = bytearray(width * height)
+        # 画像は上の行から並んでいるので、上下を反転して格納する
+        for row in range(height):
+            gy = height - 1 - row
+            line = pixels[row * width:(row + 1) * width]
+            base = gy * width
+            for gx, value in enumerate(line):
+                p = value / max_value if negate else (max_value - value) / max_value
+                if p > occupied_thresh:
+                    cells[base + gx] = OCCUPIED
+                elif p < free_thresh:
+                    cells[base + gx] = FREE
+                else:
+                    cells[base + gx] = UNKNOWN
+
+        origin = [float(v) for v in info['origin']]
+        return cls(width, height, float(info['resolution']), origin, cells)
+
+    def world_to_grid(self, x, y):
+        gx = int(math.floor((x - self.origin[0]) / self.resolution))
+        gy = int(math.floor((y - self.origin[1]) / self.resolution))
+        return gx, gy
+
+    def grid_to_world(self, gx, gy):
+        x = self.origin[0] + (gx + 0.5) * self.resolution
+        y = self.origin[1] + (gy + 0.5) * self.resolution
+        return x, y
+
+    def in_bounds(self, gx, gy):
+        return 0 <= gx < self.width and 0 <= gy < self.height
+
+    def inflate(self, radius):
+        """障害物(と未知領域)をロボット半径ぶん膨らませた通行不可マスクを返す (1=通れない)"""
+        r = int(math.ceil(radius / self.resolution))
+        offsets = [(dx, dy) for dx in range(-r, r + 1) for dy in range(-r, r + 1)
+                   if dx * dx + dy * dy <= r * r]
+
+        blocked = bytearray(self.width * self.height)
+        for index, state in enumerate(self.cells):
+            if state == FREE:
+                continue
+            gx, gy = index % self.width, index // self.width
+            for dx, dy in offsets:
+                nx, ny = gx + dx, gy + dy
+                if 0 <= nx < self.width and 0 <= ny < self.height:
+                    blocked[ny * self.width + nx] = 1
+        return blocked
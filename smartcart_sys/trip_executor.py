@@ -0,0 +1,357 @@
+"""
+買い物の行程をブロックせずに進める状態機械。
+
+ROSのタイマーなどから tick() を定期的に呼ぶと、Nav2への指令・到着判定・
+棚での待ち時間・レジへの帰還を1ステップずつ進める。time.sleep() は使わない。
+棚での待ち時間は、その棚の商品がカートのスキャナーで読まれた(item_scanned)時点で終わる。
+navigator には BasicNavigator（または同じメソッドを持つ代用品）を渡す。
+"""
+import collections
+import enum
+import itertools
+import threading
+import time
+
+from smartcart_sys.item_resolver import item_label
+from smartcart_sys.pickup import PickupCounter, SKIP, WAIT, ABORT
+
+try:
+    from nav2_simple_commander.robot_navigator import TaskResult
+except ImportError:  # ROS無しで動かす場合（シミュレータやベンチマーク）。値は nav2 と同じ
+    class TaskResult(enum.Enum):
+        UNKNOWN = 0
+        SUCCEEDED = 1
+        CANCELED = 2
+        FAILED = 3
+
+# 状態
+IDLE = 'idle'
+NAVIGATING = 'navigating'
+DWELLING = 'dwelling'
+RETURNING = 'returning'
+
+
+class Stop:
+    """1つの立ち寄り先（棚、またはレジ）"""
+
+    def __init__(self, key, coords, items):
+        self.key = key
+        self.coords = coords
+        self.items = items
+        self.status = 'pending'  # pending / heading / arrived / failed / skipped
+        self.dwell = None        # 棚で待った秒数（出発したときに決まる）
+
+    @property
+    def name(self):
+        return ', '.join(item_label(item) for item in self.items) if self.items else self.key
+
+    def to_dict(self):
+        data = {'key': self.key, 'items': self.items, 'status': self.status}
+        if self.dwell is not None:
+            data['dwell'] = round(self.dwell, 1)
+        return data
+
+
+class Trip:
+    def __init__(self, order_id, items):
+        self.order_id = order_id
+        self.items = items
+        self.stops = []
+        self.index = 0
+        self.started_at = None
+
+
+class TripExecutor:
+    """
+    planner(items, start) -> [Stop, ...]  : 買い物リストから巡回順の棚リストを作る
+    make_pose(coords)                     : 座標をNav2のゴール(PoseStamped)に変換する
+    on_event(event, trip, stop, info)     : 'trip_started' / 'heading' / 'progress' / 'arrived' /
+                                            'failed' / 'returning' / 'trip_finished' / 'trip_canceled' /
+                                            'order_merged' / 'departed'（棚を出る。待った秒数と理由付き）/
+                                            'skipped'（先に積まれていた棚・諦めた棚）を通知
+    mode                                  : 'serial'（棚ごとに goToPose）/ 'waypoints'（followWaypoints で一括）
+                                            'waypoints' では棚で止まる時間は Nav2 の wait_at_waypoint
+                                            (waypoint_pause_duration) で決まり、pickup_time / load_timeout /
+                                            skip_policy は使われない（load_timeout を指定すると ValueError）
+    prefetch(start, goal)                 : 次に走る区間を知らせる（経路を先に計算しておくため。None なら何もしない）
+    load_timeout                          : None なら棚で pickup_time だけ待つ。数値ならその棚の商品が
+                                            スキャンされるのを最大その秒数まで待ち、揃ったらすぐ出発する
+    skip_policy                           : load_timeout までに揃わなかったとき 'skip'（次の棚へ）/
+                                            'wait'（揃うまで待つ）/ 'abort'（残りの棚をやめてレジへ）
+    """
+
+    def __init__(self, navigator, planner, make_pose, home, on_event=None,
+                 mode='serial', pickup_time=2.0, merge_orders=True, prefetch=None, load_timeout=None,
+                 skip_policy=SKIP, clock=time.monotonic):
+        if mode == 'waypoints' and load_timeout is not None:
+            raise ValueError("load_timeout is not supported in 'waypoints' mode (Nav2 does not wait for scans)")
+        self.navigator = navigator
+        self.planner = planner
+        self.make_pose = make_pose
+        self.home = home
+        self.on_event = on_event or (lambda event, trip, stop, info: None)
+        self.mode = mode
+        self.pickup_time = pickup_time
+        self.merge_orders = merge_orders
+        self.prefetch = prefetch or (lambda start, goal: None)
+        self.load_timeout = load_timeout
+        self.skip_policy = skip_policy
+        self.clock = clock
+
+        self.state = IDLE
+        self.trip = None
+        self.queue = collections.deque()
+        self.dwell_started = None
+        self.dwell_until = None
+        self.waypoint_index = 0
+
+        # submit() / cancel() は別スレッドのコールバックから呼ばれるので、要求は一旦ここに積む
+        self._lock = threading.Lock()
+        self._cancel_requested = False
+        self._cancel_queue = False
+        self.pickups = PickupCounter()   # この行程で棚ごとにスキャンされた商品の数
+        self._order_ids = itertools.count(1)
+
+    # ---------- 別スレッドから呼ばれる操作 ----------
+
+    def submit(self, items, order_id=None):
+        """注文を受け付ける。走行中なら残りの行程に合流させるか、次の注文として待たせる"""
+        if order_id is None:
+            order_id = next(self._order_ids)
+        with self._lock:
+            self.queue.append(Trip(order_id, list(items)))
+        return order_id
+
+    def cancel(self, clear_queue=False):
+        """走行中の行程を中止する（clear_queue=True なら待ち中の注文も破棄）"""
+        with self._lock:
+            self._cancel_requested = True
+            self._cancel_queue = self._cancel_queue or clear_queue
+
+    def item_scanned(self, shelf, qty=1):
+        """shelf の商品がカートに入った（取り出し・取り消しなら qty は負。棚が分からなければ shelf=None）"""
+        self.pickups.add(shelf, qty)
+
+    def status(self):
+        with self._lock:
+            trip = self.trip
+            return {
+                'state': self.state,
+                'order_id': trip.order_id if trip else None,
+                'stops': [stop.to_dict() for stop in trip.stops] if trip else [],
+                'current': trip.stops[trip.index].key if trip and trip.index < len(trip.stops) else None,
+                'queued': [queued.order_id for queued in self.queue],
+            }
+
+    # ---------- タイマーから呼ぶ ----------
+
+    def tick(self):
+        """状態機械を1ステップ進める（navigatorへの指令は必ずここから出す）"""
+        with self._lock:
+            cancel, clear_queue = self._cancel_requested, self._cancel_queue
+            self._cancel_requested = self._cancel_queue = False
+            if clear_queue:
+                self.queue.clear()
+            merging = self.queue.popleft() if self.trip is not None and self.queue and self._can_merge() else None
+
+        if merging is not None:
+            self._merge(merging)
+
+        if cancel and self.state != IDLE:
+            self._cancel_trip()
+            return
+
+        if self.state == IDLE:
+            with self._lock:
+                trip = self.queue.popleft() if self.queue else None
+            if trip is not None:
+                self._start_trip(trip)
+        elif self.state in (NAVIGATING, RETURNING):
+            self._check_navigation()
+        elif self.state == DWELLING:
+            self._check_pickup()
+
+    # ---------- 内部処理 ----------
+
+    def _emit(self, event, stop=None, **info):
+        self.on_event(event, self.trip, stop, info)
+
+    def _can_merge(self):
+        # 一括送信モードでは走行中の行程を書き換えられないので、次の注文として待たせる
+        return self.merge_orders and self.mode == 'serial' and self.state in (NAVIGATING, DWELLING)
+
+    def _merge(self, new_trip):
+        """まだ向かっていない棚と新しい注文をまとめて、今のゴールから巡回順を組み直す"""
+        trip = self.trip
+        current = trip.stops[trip.index]
+        remaining = trip.stops[trip.index + 1:]
+        items = [item for stop in remaining for item in stop.items] + new_trip.items
+        trip.stops = trip.stops[:trip.index + 1] + self.planner(items, current.coords)
+        trip.items = trip.items + new_trip.items
+        self._emit('order_merged', merged_order_id=new_trip.order_id)
+        self._prefetch_next()
+
+    def _start_trip(self, trip):
+        self.trip = trip
+        trip.started_at = self.clock()
+        self.pickups.reset()
+        trip.stops = self.planner(trip.items, None)
+        self._emit('trip_started')
+        if self.mode == 'waypoints':
+            self._send_waypoints()
+        else:
+            self._go_to_current()
+
+    def _go_to_current(self):
+        trip = self.trip
+        # 向かう前にもう商品が全てスキャンされている棚（通りがかりに取った等）は飛ばす
+        while self.load_timeout is not None and trip.index < len(trip.stops) and self._loaded(trip.stops[trip.index]):
+            stop = trip.stops[trip.index]
+            stop.status = 'skipped'
+            self.pickups.take(stop.key, len(stop.items))
+            self._emit('skipped', stop, reason='prescanned')
+            trip.index += 1
+        if trip.index >= len(trip.stops):
+            self._return_home()
+            return
+        stop = trip.stops[trip.index]
+        stop.status = 'heading'
+        self.state = NAVIGATING
+        self._emit('heading', stop)
+        self.navigator.goToPose(self.make_pose(stop.coords))
+        self._prefetch_next()
+
+    def _prefetch_next(self):
+        """今のゴールから次の立ち寄り先（最後の棚ならレジ）への区間を知らせる"""
+        trip = self.trip
+        if trip.index >= len(trip.stops):
+            return
+        following = trip.stops[trip.index + 1] if trip.index + 1 < len(trip.stops) else None
+        self.prefetch(trip.stops[trip.index].coords, following.coords if following else self.home)
+
+    def _send_waypoints(self):
+        trip = self.trip
+        trip.stops.append(Stop('cashier', self.home, []))
+        self.state = NAVIGATING
+        self.waypoint_index = 0
+        if trip.stops:
+            trip.stops[0].status = 'heading'
+            self._emit('heading', trip.stops[0])
+        self.navigator.followWaypoints([self.make_pose(stop.coords) for stop in trip.stops])
+
+    def _return_home(self):
+        self.state = RETURNING
+        self._emit('returning')
+        self.navigator.goToPose(self.make_pose(self.home))
+
+    def _next_stop(self):
+        self.trip.index += 1
+        self._go_to_current()
+
+    def _check_navigation(self):
+        if not self.navigator.isTaskComplete():
+            feedback = self.navigator.getFeedback()
+            if feedback is None:
+                return
+            if self.mode == 'waypoints':
+                self._advance_waypoints(feedback.current_waypoint)
+            else:
+                stop = self.trip.stops[self.trip.index] if self.state == NAVIGATING else None
+                self._emit('progress', stop, distance_remaining=getattr(feedback, 'distance_remaining', None))
+            return
+
+        succeeded = self.navigator.getResult() == TaskResult.SUCCEEDED
+        if self.mode == 'waypoints':
+            self._finish_waypoints(succeeded)
+        elif self.state == RETURNING:
+            self._finish_trip(returned=succeeded)
+        else:
+            stop = self.trip.stops[self.trip.index]
+            if succeeded:
+                stop.status = 'arrived'
+                self._emit('arrived', stop)
+                self.state = DWELLING
+                self.pickups.watch(stop.key)
+                self.dwell_started = self.clock()
+                wait = self.load_timeout if self.load_timeout is not None else self.pickup_time
+                self.dwell_until = self.dwell_started + wait
+            else:
+                stop.status = 'failed'
+                self._emit('failed', stop)
+                self._next_stop()
+
+    def _loaded(self, stop):
+        return bool(stop.items) and self.pickups.count(stop.key) >= len(stop.items)
+
+    def _check_pickup(self):
+        """棚で待っている間。商品が揃うか、待ち時間が過ぎたら出発する"""
+        stop = self.trip.stops[self.trip.index]
+        now = self.clock()
+        if self.load_timeout is None:
+            if now >= self.dwell_until:
+                self._depart(stop, 'timer')
+        elif self._loaded(stop):
+            self._depart(stop, 'scanned')
+        elif now >= self.dwell_until and self.skip_policy != WAIT:
+            self._depart(stop, 'timeout')
+
+    def _depart(self, stop, reason):
+        stop.dwell = self.clock() - self.dwell_started
+        self.pickups.watch(None)
+        self._emit('departed', stop, dwell=stop.dwell, reason=reason,
+                   scanned=self.pickups.take(stop.key, len(stop.items)))
+        if reason == 'timeout' and self.skip_policy == ABORT:
+            # 残りの棚をやめてレジへ戻る
+            trip = self.trip
+            for skipped in trip.stops[trip.index + 1:]:
+                skipped.status = 'skipped'
+                self._emit('skipped', skipped, reason='aborted')
+            trip.index = len(trip.stops)
+            self._return_home()
+        else:
+            self._next_stop()
+
+    def _advance_waypoints(self, current):
+        stops = self.trip.stops
+        while self.waypoint_index < min(current, len(stops)):
+            stops[self.waypoint_index].status = 'arrived'
+            self._emit('arrived', stops[self.waypoint_index])
+            self.waypoint_index += 1
+            if self.waypoint_index < len(stops):
+                stops[self.waypoint_index].status = 'heading'
+                self._emit('heading', stops[self.waypoint_index])
+        self.trip.index = self.waypoint_index
+
+    def _finish_waypoints(self, succeeded):
+        missed = set()
+        try:
+            # Jazzy は MissedWaypoint(index, goal, error_code)、Humble 以前は番号の配列
+            for waypoint in self.navigator.result_future.result().result.missed_waypoints:
+                missed.add(int(getattr(waypoint, 'index', waypoint)))
+        except AttributeError:
+            pass
+
+        # stop_on_failure: false なので、途中で到着扱いにした地点が後から失敗と分かることもある
+        for index, stop in enumerate(self.trip.stops):
+            if index in missed or (index >= self.waypoint_index and not succeeded):
+                stop.status = 'failed'
+                self._emit('failed', stop)
+            elif index >= self.waypoint_index:
+                stop.status = 'arrived'
+                self._emit('arrived', stop)
+        last = self.trip.stops[-1]
+        self._finish_trip(returned=last.status == 'arrived')
+
+    def _finish_trip(self, returned):
+        dwell = sum(stop.dwell for stop in self.trip.stops if stop.dwell is not None)
+        self._emit('trip_finished', returned=returned, duration=self.clock() - self.trip.started_at, dwell=dwell)
+        with self._lock:
+            self.trip = None
+            self.state = IDLE
+
+    def _cancel_trip(self):
+        self.navigator.cancelTask()
+        self._emit('trip_canceled')
+        with self._lock:
+            self.trip = None
+            self.state = IDLE
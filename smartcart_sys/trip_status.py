@@ -0,0 +1,161 @@
+"""
+ナビゲーターの走行状況を trip_status トピック用にまとめる。
+
+TripExecutor のイベントを受けて 今の立ち寄り先・残り距離・到着見込み(ETA)・到着済みの棚・行けなかった棚
+を記録し、tick() のたびに「変化があれば min_interval 以上あけて」送る。
+到着・失敗などの節目は次の tick() ですぐ送り、走行中の残り距離の更新は間引く。
+変化が無くても走行中は heartbeat 秒ごとに送るので、受ける側は最後の受信からの時間で通信断に気づける。
+"""
+import time
+
+from smartcart_sys.fleet import CRUISE_SPEED
+from smartcart_sys.item_resolver import item_label
+from smartcart_sys.route_planner import euclidean_distance
+from smartcart_sys.trip_executor import IDLE, NAVIGATING, DWELLING, RETURNING
+
+
+class TripStatusReporter:
+    """
+    executor : TripExecutor（tick() と同じスレッドから読むこと）
+    publish  : 状態の辞書を受け取って送る関数
+    distance : ((名前, 座標), (名前, 座標)) -> 距離[m]（ETAの見積もりに使う）
+    """
+
+    def __init__(self, executor, publish, distance=euclidean_distance, speed=CRUISE_SPEED,
+                 min_interval=0.5, heartbeat=2.0, clock=time.monotonic):
+        self.executor = executor
+        self.publish = publish
+        self.distance = distance
+        self.speed = speed
+        self.min_interval = min_interval
+        self.heartbeat = heartbeat
+        self.clock = clock
+
+        self.seq = 0
+        self.distance_remaining = None
+        self.picked = []       # [{'stop', 'items', 'dwell'}]（dwell は棚を出たときに入る）
+        self.failed = []
+        self.merged = []       # この行程に合流した注文の order_id
+        self.last_event = None
+        self._changed = False
+        self._requested = False
+        self._last_sent = None
+
+    def on_event(self, event, trip, stop, info):
+        """TripExecutor の on_event から呼ぶ"""
+        if event == 'trip_started':
+            self.picked = []
+            self.failed = []
+            self.merged = []
+        elif event == 'order_merged':
+            self.merged.append(info.get('merged_order_id'))
+        if event == 'progress':
+            self.distance_remaining = info.get('distance_remaining')
+        else:
+            # 残り距離は次のフィードバックまで分からない
+            self.distance_remaining = None
+            self.last_event = event
+        if stop is not None and stop.items:
+            entry = {'stop': stop.key, 'items': [item_label(item) for item in stop.items]}
+            if event == 'arrived' or (event == 'skipped' and info.get('reason') == 'prescanned'):
+                self.picked.append(entry)
+            elif event == 'failed' or event == 'skipped':
+                self.failed.append(entry)
+            elif event == 'departed' and self.picked and self.picked[-1]['stop'] == stop.key:
+                self.picked[-1]['dwell'] = round(info['dwell'], 1)
+                if info.get('reason') == 'timeout':
+                    self.picked[-1]['scanned'] = info.get('scanned', 0)
+        self._changed = True
+
+    def request(self):
+        """問い合わせがあったとき（別スレッドから）。次の tick() で間隔に関係なく送る"""
+        self._requested = True
+
+    def _leg(self, a, b):
+        return self.distance(a, b) / self.speed
+
+    def estimate(self):
+        """(今の立ち寄り先までの秒数, レジに戻り終わるまでの秒数)。走行していなければ (None, None)"""
+        executor = self.executor
+        trip = executor.trip
+        if trip is None or executor.state == IDLE:
+            return None, None
+        now = self.clock()
+        stops = trip.stops
+        index = min(trip.index, len(stops))
+        pickup = executor.pickup_time
+        home = ('cashier', executor.home)
+        points = [(stop.key, stop.coords) for stop in stops]
+
+        if executor.state == RETURNING:
+            if self.distance_remaining is not None:
+                to_home = self.distance_remaining / self.speed
+            else:
+                to_home = self._leg(points[-1], home) if points else 0.0
+            return to_home, to_home
+
+        previous = points[index - 1] if index > 0 else home
+        if executor.state == DWELLING:
+            to_current = 0.0
+            # 積み込みの知らせを待つ場合も、いつもの待ち時間で出発するものとして見積もる
+            total = max(0.0, min(executor.dwell_until, executor.dwell_started + pickup) - now)
+            previous = points[index]
+        else:
+            if self.distance_remaining is not None:
+                to_current = self.distance_remaining / self.speed
+            elif index < len(points):
+                to_current = self._leg(previous, points[index])
+            else:
+                to_current = 0.0
+            total = to_current
+            if index < len(points):
+                total += pickup if stops[index].key != 'cashier' else 0.0
+                previous = points[index]
+        index += 1
+
+        # 残りの棚を計画どおりの順に回り、最後にレジへ戻る
+        for point in points[index:]:
+            total += self._leg(previous, point)
+            if point[0] != 'cashier':
+                total += pickup
+            previous = point
+        if not points or points[-1][0] != 'cashier':
+            total += self._leg(previous, home)
+        return to_current, total
+
+    def build(self):
+        status = self.executor.status()
+        trip = self.executor.trip
+        current_stop = None
+        if trip is not None and self.executor.state in (NAVIGATING, DWELLING) and trip.index < len(trip.stops):
+            current_stop = trip.stops[trip.index]
+        next_eta, eta = self.estimate()
+        status.update({
+            'seq': self.seq,
+            'current_items': [item_label(item) for item in current_stop.items] if current_stop else [],
+            'distance_remaining': round(self.distance_remaining, 2) if self.distance_remaining is not None else None,
+            'next_eta_s': round(next_eta, 1) if next_eta is not None else None,
+            'eta_s': round(eta, 1) if eta is not None else None,
+            'picked': list(self.picked),
+            'failed': list(self.failed),
+            'merged_order_ids': list(self.merged),
+            'last_event': self.last_event,
+        })
+        return status
+
+    def tick(self, force=False):
+        """変化があれば（または heartbeat ごとに）送る。送ったら True"""
+        now = self.clock()
+        since = now - self._last_sent if self._last_sent is not None else None
+        active = self.executor.state != IDLE
+        due = (force or self._requested or since is None
+               or (self._changed and since >= self.min_interval)
+               or (active and since >= self.heartbeat))
+        if not due:
+            return False
+        self.seq += 1
+        self._changed = False
+        self._requested = False
+        self._last_sent = now
+        self.publish(self.build())
+        return True
@@ -0,0 +1,75 @@
+from smartcart_sys.cart_state import CartState
+
+
+def receiver_for(sender):
+    receiver = CartState()
+    assert receiver.apply(sender.snapshot())
+    return receiver
+
+
+def same(a, b):
+    return a.snapshot() == b.snapshot()
+
+
+def test_events_reproduce_the_cart():
+    sender = CartState()
+    receiver = receiver_for(sender)
+    events = [
+        sender.add('4901', 'Egg', 250),
+        sender.add('4902', 'Milk', 200, qty=2),
+        sender.remove('4902'),
+        sender.undo(),
+        sender.add('4903', 'Onion', 80),
+        sender.remove('4903'),
+    ]
+    for event in events:
+        assert receiver.apply(event)
+    assert same(sender, receiver)
+    assert receiver.total_price == 250 + 400 and receiver.item_count == 3
+
+
+def test_gap_needs_a_snapshot():
+    sender = CartState()
+    receiver = receiver_for(sender)
+    assert receiver.apply(sender.add('4901', 'Egg', 250))
+    sender.add('4902', 'Milk', 200)               # 届かなかった
+    before = receiver.snapshot()
+    assert not receiver.apply(sender.add('4901', 'Egg', 250))
+    assert receiver.snapshot() == before          # 抜けのあとのイベントは反映しない
+    assert receiver.apply(sender.snapshot())
+    assert same(sender, receiver)
+    assert receiver.apply(sender.add('4903', 'Onion', 80))
+    assert same(sender, receiver)
+
+
+def test_old_events_are_ignored():
+    sender = CartState()
+    receiver = receiver_for(sender)
+    event = sender.add('4901', 'Egg', 250)
+    assert receiver.apply(event)
+    # スナップショットに含まれているイベントが後から届いても二重に数えない
+    assert receiver.apply(event)
+    assert receiver.item_count == 1
+
+
+def test_restarted_sender_needs_a_snapshot():
+    sender = CartState()
+    receiver = receiver_for(sender)
+    receiver.apply(sender.add('4901', 'Egg', 250))
+    restarted = CartState()
+    assert not receiver.apply(restarted.add('4902', 'Milk', 200))
+    assert receiver.apply(restarted.snapshot())
+    assert same(restarted, receiver)
+
+
+def test_clear():
+    sender = CartState()
+    receiver = receiver_for(sender)
+    for event in [sender.add('4901', 'Egg', 250), sender.clear()]:
+        assert receiver.apply(event)
+    assert receiver.lines == {} and receiver.total_price == 0 and receiver.item_count == 0
+    assert sender.undo() is None
+
+
+def test_remove_missing_item():
+    assert CartState().remove('4901') is None
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from smartcart_sys.catalog import Catalog, CatalogService, build_catalog, pack_catalog, read_csv
+
+CSV = """jan,name,price,category,shelf
+4901234567894,Whole milk,198,Dairy,milk
+04912345,Fresh eggs,248,Dairy,egg
+4909876543210,Gift card,1000,,
+4905555555555,Onion,58,Vegetables,onion
+4901234567894,Whole milk 1L,208,Dairy,milk
+"""
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / 'catalog.csv'
+    path.write_text(CSV, encoding='utf-8')
+    return str(path)
+
+
+@pytest.fixture
+def catalog(csv_path, tmp_path):
+    return Catalog.open(build_catalog(csv_path, str(tmp_path / 'cache' / 'catalog.bin')))
+
+
+def test_read_csv_keeps_the_last_duplicate(csv_path):
+    products = read_csv(csv_path)
+    assert len(products) == 4
+    assert products[0] == (4901234567894, 'Whole milk 1L', 208, 'Dairy', 'milk')
+
+
+def test_read_csv_rejects_bad_jan(tmp_path):
+    path = tmp_path / 'bad.csv'
+    path.write_text('jan,name,price,category,shelf\nabc,Milk,100,Dairy,milk\n', encoding='utf-8')
+    with pytest.raises(ValueError, match='bad.csv:2'):
+        read_csv(str(path))
+
+
+def test_lookup(catalog):
+    assert len(catalog) == 4
+    assert catalog.lookup('4901234567894') == {
+        'jan': '4901234567894', 'name': 'Whole milk 1L', 'price': 208, 'category': 'Dairy', 'shelf': 'milk'}
+    # 8桁のJANは先頭の0を補って返す
+    assert catalog.lookup(4912345)['jan'] == '04912345'
+    assert catalog.lookup('4900000000000') is None
+    assert 'not a code' not in catalog
+
+
+def test_shelves_and_categories_follow_csv_order(catalog):
+    assert catalog.categories() == {'Dairy': ['Whole milk 1L', 'Fresh eggs'], 'Vegetables': ['Onion']}
+    assert catalog.shelves() == {'milk': ['Whole milk 1L'], 'egg': ['Fresh eggs'], 'onion': ['Onion']}
+    assert catalog.shelf_of('4909876543210') is None
+    assert catalog.shelf_of('4905555555555') == 'onion'
+
+
+def test_broken_files_are_rejected(csv_path):
+    data = pack_catalog(read_csv(csv_path))
+    with pytest.raises(ValueError):
+        Catalog(b'XXXX' + data[4:])
+    with pytest.raises(ValueError):
+        Catalog(data[:-3])
+
+
+def test_service_rebuilds_when_csv_changes(csv_path, tmp_path):
+    class Clock:
+        now = 0.0
+
+        def __call__(self):
+            return self.now
+
+    clock = Clock()
+    service = CatalogService(csv_path, str(tmp_path / 'cache' / 'catalog.bin'), check_interval=2.0, clock=clock)
+    assert len(service.get()) == 4
+    with open(csv_path, 'a', encoding='utf-8') as f:
+        f.write('4906666666666,Carrot,98,Vegetables,carrot\n')
+    stat = os.stat(csv_path)
+    os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert len(service.get()) == 4    # 次に確かめるまでは今のカタログ
+    clock.now = 2.0
+    assert len(service.get()) == 5
+    assert service.reloads == 2
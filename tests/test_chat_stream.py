@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from smartcart_sys.chat_stream import ShoppingListParser, StreamingReply, StreamMetrics, iter_text
+from smartcart_sys.gemini_stub import StubModel, stub_reply
+
+SHOPPING_LIST = [{'en': 'Egg', 'ja': '卵'}, {'en': 'Milk', 'ja': '牛乳'}]
+
+
+def stream(text, chunk_size):
+    model = StubModel(chunk_size=chunk_size, reply=lambda prompt: text)
+    return StreamingReply(iter_text(model.generate_content('', stream=True)), StreamMetrics())
+
+
+def fenced(value):
+    return f'```json\n{json.dumps(value, ensure_ascii=False, indent=2)}\n```'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 1000])
+def test_list_found_in_json_fence(chunk_size):
+    reply = stream(stub_reply('オムレツ'), chunk_size)
+    for _ in reply:
+        pass
+    assert [item['en'] for item in reply.shopping_list] == ['Egg', 'Milk', 'Onion']
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7])
+def test_bracketed_text_before_the_list_is_not_taken(chunk_size):
+    text = f'例: [1] の手順です。[注意] 卵は冷蔵で。材料 ["a", "b"] も。\n\n{fenced(SHOPPING_LIST)}\n以上です。'
+    reply = stream(text, chunk_size)
+    seen = []
+    for _ in reply:
+        if reply.shopping_list is not None and not seen:
+            seen.append(reply.list_json)
+    assert reply.shopping_list == SHOPPING_LIST
+    assert json.loads(seen[0]) == SHOPPING_LIST
+
+
+def test_list_is_ready_before_the_reply_ends():
+    text = f'{fenced(SHOPPING_LIST)}\n' + 'ごゆっくりどうぞ。' * 20
+    reply = stream(text, 5)
+    ready_at = None
+    for _ in reply:
+        if reply.shopping_list is not None and ready_at is None:
+            ready_at = len(reply.text)
+    assert ready_at is not None and ready_at < len(text)
+
+
+def test_no_shopping_list():
+    parser = ShoppingListParser()
+    for chunk in ['番号 [1, 2', ', 3] と ', '[{"name": "x"}]', ' だけ']:
+        assert parser.feed(chunk) is None
+    assert parser.items is None
+
+
+def test_bracket_inside_string_does_not_close_list():
+    parser = ShoppingListParser()
+    value = [{'en': 'Curry Roux', 'ja': 'カレールー]辛口['}]
+    text = json.dumps(value, ensure_ascii=False)
+    for ch in text:
+        parser.feed(ch)
+    assert parser.items == value
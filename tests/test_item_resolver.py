@@ -0,0 +1,65 @@
+import gc
+import weakref
+
+import pytest
+
+from smartcart_sys.item_resolver import ItemResolver, normalize
+from smartcart_sys.store_layout import ITEM_LOCATIONS, ITEM_SYNONYMS
+
+
+@pytest.fixture(scope='module')
+def resolver():
+    return ItemResolver(ITEM_LOCATIONS, ITEM_SYNONYMS)
+
+
+@pytest.mark.parametrize('name, shelf', [
+    ('Curry Roux (medium hot)', 'curry roux'),
+    ('Golden curry roux', 'curry roux'),
+    ('Whole milk', 'milk'),
+    ('Large eggs', 'egg'),
+    ('Pork belly slices', 'pork'),
+    ('Beef chuck roll', 'beef'),
+    ('Garlic cloves', 'garlic'),
+    ('2 onions', 'onion'),
+    ('Short grain rice', 'rice'),
+    ('Kikkoman soy sauce', 'soy sauce'),
+    ('Garlik', 'garlic'),
+    ('Carot', 'carrot'),
+    ('国産豚バラ肉', 'pork'),
+    ('豚バラ肉 薄切り', 'pork'),
+    ('牛乳 1L', 'milk'),
+    ('カレールー甘口', 'curry roux'),
+])
+def test_resolves(resolver, name, shelf):
+    assert resolver.resolve(name)[0] == shelf
+
+
+@pytest.mark.parametrize('name', [
+    'Eggplant', 'Soy milk', 'Milk chocolate', 'Rice vinegar', 'Rice cooker', 'Beef stock',
+    'Egg noodles', 'Garlic powder', 'Chicken thigh', 'Fork', '牛乳パン', '豆乳',
+])
+def test_other_products_are_not_resolved(resolver, name):
+    assert resolver.resolve(name) == (None, None)
+
+
+def test_pair_falls_back_to_japanese(resolver):
+    assert resolver.resolve({'en': 'Negi-ish thing', 'ja': '玉ねぎ'})[0] == 'onion'
+
+
+def test_resolve_many(resolver):
+    resolved, unresolved = resolver.resolve_many(['Milk', 'Whole milk', 'Soy milk'])
+    assert resolved == {'milk': ['Milk', 'Whole milk']}
+    assert unresolved == ['Soy milk']
+
+
+def test_normalize():
+    assert normalize('Ｃｕｒｒｙ　Roux（中辛）') == 'curry roux'
+
+
+def test_cache_does_not_keep_resolver_alive():
+    resolver = ItemResolver(ITEM_LOCATIONS, ITEM_SYNONYMS)
+    resolver.resolve('Whole milk')
+    ref = weakref.ref(resolver)
+    del resolver
+    gc.collect()
+    assert ref() is None
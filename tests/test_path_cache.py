@@ -0,0 +1,93 @@
+import types
+
+from smartcart_sys.fleet import VirtualClock
+from smartcart_sys.nav_sim import SimNavigator
+from smartcart_sys.path_cache import CachedPathNavigator, CostmapView, INSCRIBED_COST, PathCache
+from smartcart_sys.store_layout import CASHIER_LOCATION, ITEM_LOCATIONS
+
+GOAL = [5.0, 5.0, 0.0]
+
+
+def path(*points):
+    return types.SimpleNamespace(poses=list(points))
+
+
+def open_costmap(blocked=()):
+    # 原点 (0, 0)、0.1m 四方のマスが 100 x 100
+    data = bytearray(100 * 100)
+    for x, y in blocked:
+        data[int(y / 0.1) * 100 + int(x / 0.1)] = INSCRIBED_COST
+    return CostmapView(100, 100, 0.1, 0.0, 0.0, data)
+
+
+def test_same_cell_hits():
+    cache = PathCache(cell_size=0.5)
+    key, found = cache.lookup([1.1, 1.1], GOAL)
+    assert found is None
+    cache.put(key, path((1.1, 1.1), (5.0, 5.0)))
+    assert cache.lookup([1.4, 1.2], GOAL) == (key, cache.entries[key][0])
+    assert cache.stats['hits'] == 1 and cache.stats['misses'] == 1
+
+
+def test_neighbour_cell_only_within_max_offset():
+    cache = PathCache(cell_size=0.5, max_offset=0.25)
+    key = cache.key([1.45, 1.2], GOAL)
+    cache.put(key, path((1.45, 1.2), (5.0, 5.0)))
+    # 隣のマスでも始点から 0.1m なら使う
+    assert cache.lookup([1.55, 1.2], GOAL)[0] == key
+    # 隣のマスで 0.5m 離れていれば使わない
+    assert cache.lookup([1.95, 1.2], GOAL)[1] is None
+
+
+def test_lru_eviction():
+    cache = PathCache(cell_size=0.5, max_entries=2)
+    for x in (1.0, 2.0, 3.0):
+        cache.put(cache.key([x, 1.0], GOAL), path((x, 1.0), (5.0, 5.0)))
+    assert cache.lookup([1.0, 1.0], GOAL)[1] is None
+    assert cache.stats['evicted'] == 1
+
+
+def test_blocked_path_is_invalidated():
+    cache = PathCache(cell_size=0.5)
+    key = cache.key([1.0, 1.0], GOAL)
+    cache.put(key, path((1.0, 1.0), (5.0, 5.0)), open_costmap())
+    assert cache.lookup([1.0, 1.0], GOAL, open_costmap([(8.0, 8.0)]))[1] is not None
+    assert cache.lookup([1.0, 1.0], GOAL, open_costmap([(3.0, 3.0)]))[1] is None
+    assert cache.stats['invalidated'] == 1 and key not in cache
+
+
+def test_map_change_clears_everything():
+    cache = PathCache()
+    cache.update_map('map-a')
+    cache.put(cache.key([1.0, 1.0], GOAL), path((1.0, 1.0), (5.0, 5.0)))
+    cache.update_map('map-a')
+    assert len(cache.entries) == 1
+    cache.update_map('map-b')
+    assert len(cache.entries) == 0 and cache.stats['cleared'] == 1
+
+
+def test_cached_navigator_reuses_prefetched_path():
+    clock = VirtualClock()
+    sim = SimNavigator(clock)
+    navigator = CachedPathNavigator(sim, PathCache(), make_pose=lambda coords: coords,
+                                    get_start=sim.current_pose, clock=clock)
+    goal = ITEM_LOCATIONS['milk']
+    navigator.prefetch(list(CASHIER_LOCATION), goal)
+    navigator.run_prefetch()
+    assert navigator.stats['prefetched'] == 1
+    navigator.goToPose(goal)
+    assert navigator.cache.stats['hits'] == 1
+    while not navigator.isTaskComplete():
+        clock.now += 0.5
+    assert abs(sim.pose[0] - goal[0]) < 0.5 and abs(sim.pose[1] - goal[1]) < 0.5
+
+
+def test_from_here_does_not_go_back_to_the_start():
+    clock = VirtualClock()
+    sim = SimNavigator(clock)
+    navigator = CachedPathNavigator(sim, PathCache(cell_size=0.5), make_pose=lambda coords: list(coords),
+                                    get_start=sim.current_pose, clock=clock)
+    cached = path((1.0, 1.0), (1.2, 1.0), (3.0, 1.0))
+    joined = navigator._from_here(cached, [1.15, 1.0, 0.0])
+    assert joined.poses == [[1.15, 1.0, 0.0], (1.2, 1.0), (3.0, 1.0)]
+    assert cached.poses[0] == (1.0, 1.0)
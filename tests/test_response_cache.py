@@ -0,0 +1,120 @@
+import pytest
+
+from smartcart_sys.chat_stream import iter_text
+from smartcart_sys.gemini_stub import StubModel
+from smartcart_sys.response_cache import ResponseCache, cache_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(clock):
+    cache = ResponseCache(':memory:', ttl=60.0, max_entries=3, clock=clock)
+    yield cache
+    cache.close()
+
+
+def ask(cache, model, prompt, history=()):
+    return cache.get_or_generate(model.model_name, 'system', prompt,
+                                 lambda: model.generate_content(prompt).text, history=history)
+
+
+def test_hit_and_miss_counting(cache):
+    model = StubModel()
+    text, cached = ask(cache, model, 'カレーが食べたい')
+    assert not cached and 'チキンカレー' in text
+    # 文末の記号や空白の違いは同じ相談
+    assert ask(cache, model, ' カレーが 食べたい！') == (text, True)
+    assert model.calls == 1
+    metrics = cache.metrics()
+    assert (metrics['hits'], metrics['misses'], metrics['stored'], metrics['entries']) == (1, 1, 1, 1)
+    assert metrics['hit_rate'] == 0.5
+
+
+def test_history_is_part_of_the_key(cache):
+    model = StubModel()
+    ask(cache, model, 'カレーが食べたい')
+    _, cached = ask(cache, model, 'カレーが食べたい', history=[('user', '肉じゃがを作りたい')])
+    assert not cached
+    assert model.calls == 2
+
+
+def test_ttl_expiry(cache, clock):
+    model = StubModel()
+    ask(cache, model, 'オムレツ')
+    clock.now += 59.0
+    assert ask(cache, model, 'オムレツ')[1]
+    clock.now += 2.0   # 保存してから 61 秒（使っても延びない）
+    assert not ask(cache, model, 'オムレツ')[1]
+    assert cache.stats['expired'] == 1
+    assert model.calls == 2
+
+
+def test_lru_eviction(cache, clock):
+    model = StubModel()
+    for prompt in ['a', 'b', 'c']:
+        ask(cache, model, prompt)
+        clock.now += 1.0
+    ask(cache, model, 'a')           # a を最近使ったことにする
+    clock.now += 1.0
+    ask(cache, model, 'd')           # 4件目で、最後に使ったのが一番古い b が消える
+    assert cache.entries() == 3
+    assert cache.stats['evicted'] == 1
+    calls = model.calls
+    assert ask(cache, model, 'a')[1]
+    assert ask(cache, model, 'c')[1]
+    assert not ask(cache, model, 'b')[1]
+    assert model.calls == calls + 1
+
+
+def test_empty_reply_is_not_stored(cache):
+    model = StubModel(reply=lambda prompt: '')
+    assert ask(cache, model, 'x') == ('', False)
+    assert cache.entries() == 0
+
+
+def stream(cache, model, prompt):
+    key, text = cache.lookup(model.model_name, 'system', prompt)
+    assert text is None
+    return key, cache.record_stream(key, iter_text(model.generate_content(prompt, stream=True)),
+                                    model.model_name, prompt)
+
+
+def test_record_stream_stores_complete_reply(cache):
+    model = StubModel(chunk_size=5)
+    key, chunks = stream(cache, model, 'カレーが食べたい')
+    text = ''.join(chunks)
+    assert cache.get(key) == text
+
+
+def test_record_stream_does_not_store_partial_reply(cache):
+    model = StubModel(chunk_size=5)
+    key, chunks = stream(cache, model, 'カレーが食べたい')
+    next(chunks)
+    next(chunks)
+    chunks.close()   # 画面が再実行されるなどして途中で受け取るのをやめた
+    assert cache.entries() == 0
+    assert cache.get(key) is None
+
+
+def test_record_stream_does_not_store_failed_reply(cache):
+    def broken():
+        yield 'カレーは'
+        raise ConnectionError('stream dropped')
+
+    key = cache_key('stub', 'system', 'カレー')
+    with pytest.raises(ConnectionError):
+        for _ in cache.record_stream(key, broken()):
+            pass
+    assert cache.entries() == 0
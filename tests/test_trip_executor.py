@@ -0,0 +1,171 @@
+import pytest
+
+from smartcart_sys.fleet import StubNavigator, VirtualClock, make_stub_planner
+from smartcart_sys.pickup import SKIP, WAIT, ABORT
+from smartcart_sys.route_planner import euclidean_distance
+from smartcart_sys.store_layout import CASHIER_LOCATION
+from smartcart_sys.trip_executor import TripExecutor, IDLE, NAVIGATING, DWELLING
+
+
+class Harness:
+    """StubNavigator と仮想時計で TripExecutor を動かし、イベントを記録する"""
+
+    def __init__(self, **kwargs):
+        self.clock = VirtualClock()
+        self.navigator = StubNavigator(self.clock)
+        self.events = []
+        self.executor = TripExecutor(self.navigator, make_stub_planner(self.navigator, euclidean_distance),
+                                     make_pose=lambda coords: coords, home=CASHIER_LOCATION,
+                                     on_event=self.on_event, clock=self.clock, **kwargs)
+
+    def on_event(self, event, trip, stop, info):
+        self.events.append((event, stop.key if stop else None, info))
+
+    def run_until(self, condition, limit=600.0, dt=0.1):
+        while not condition():
+            assert self.clock.now < limit, 'did not finish'
+            self.executor.tick()
+            self.clock.now += dt
+
+    def finish(self):
+        self.run_until(lambda: self.executor.state == IDLE and not self.executor.queue)
+
+    def keys(self, event):
+        return [key for name, key, _ in self.events if name == event]
+
+    def info(self, event):
+        return [info for name, _, info in self.events if name == event]
+
+
+def test_serial_trip_visits_every_shelf_and_returns():
+    h = Harness()
+    h.executor.submit(['Egg', 'Milk', 'Onion'])
+    h.finish()
+    assert sorted(h.keys('arrived')) == ['egg', 'milk', 'onion']
+    assert [info['reason'] for info in h.info('departed')] == ['timer'] * 3
+    assert h.info('trip_finished')[0]['returned']
+
+
+def test_order_is_merged_into_running_trip():
+    h = Harness()
+    h.executor.submit(['Egg'])
+    h.executor.tick()
+    assert h.executor.state == NAVIGATING
+    second = h.executor.submit(['Onion'])
+    h.finish()
+    assert len(h.info('trip_started')) == 1
+    assert h.info('order_merged') == [{'merged_order_id': second}]
+    assert sorted(h.keys('arrived')) == ['egg', 'onion']
+
+
+def test_order_waits_when_merging_is_disabled():
+    h = Harness(merge_orders=False)
+    h.executor.submit(['Egg'])
+    h.executor.tick()
+    h.executor.submit(['Onion'])
+    assert h.executor.status()['queued'] == [2]
+    h.finish()
+    assert len(h.info('trip_started')) == 2
+    assert h.keys('order_merged') == []
+
+
+def test_cancel_keeps_queued_orders():
+    h = Harness(merge_orders=False)
+    h.executor.submit(['Egg'])
+    h.executor.tick()
+    h.executor.submit(['Onion'])
+    h.executor.cancel()
+    h.executor.tick()
+    assert h.keys('trip_canceled') == [None]
+    assert h.executor.state == IDLE
+    h.finish()
+    assert h.keys('arrived') == ['onion']
+
+
+def test_cancel_with_clear_queue_drops_queued_orders():
+    h = Harness(merge_orders=False)
+    h.executor.submit(['Egg'])
+    h.executor.tick()
+    h.executor.submit(['Onion'])
+    h.executor.cancel(clear_queue=True)
+    h.executor.tick()
+    assert h.executor.state == IDLE and not h.executor.queue
+    assert h.keys('arrived') == []
+
+
+def test_cancel_while_idle_does_nothing():
+    h = Harness()
+    h.executor.cancel()
+    h.executor.tick()
+    assert h.events == []
+
+
+def test_scan_ends_dwell_early():
+    h = Harness(load_timeout=30.0)
+    h.executor.submit(['Egg', 'Egg'])
+    h.run_until(lambda: h.executor.state == DWELLING)
+    h.executor.item_scanned('egg')
+    h.executor.item_scanned(None)    # 棚の分からない商品は今いる棚の分
+    h.finish()
+    departed = h.info('departed')[0]
+    assert departed['reason'] == 'scanned' and departed['scanned'] == 2
+    assert departed['dwell'] < 1.0
+
+
+def test_skip_policy_moves_on_after_timeout():
+    h = Harness(load_timeout=5.0, skip_policy=SKIP)
+    h.executor.submit(['Egg', 'Onion'])
+    h.finish()
+    assert sorted(h.keys('arrived')) == ['egg', 'onion']
+    assert [info['reason'] for info in h.info('departed')] == ['timeout', 'timeout']
+    assert all(info['scanned'] == 0 for info in h.info('departed'))
+
+
+def test_wait_policy_waits_for_the_scan():
+    h = Harness(load_timeout=5.0, skip_policy=WAIT)
+    h.executor.submit(['Egg'])
+    h.run_until(lambda: h.executor.state == DWELLING)
+    arrived_at = h.clock.now
+    h.run_until(lambda: h.clock.now > arrived_at + 60.0)
+    assert h.executor.state == DWELLING
+    h.executor.item_scanned('egg')
+    h.finish()
+    assert h.info('departed')[0]['reason'] == 'scanned'
+    assert h.info('departed')[0]['dwell'] > 60.0
+
+
+def test_abort_policy_skips_the_rest_and_returns():
+    h = Harness(load_timeout=5.0, skip_policy=ABORT)
+    h.executor.submit(['Egg', 'Milk', 'Onion'])
+    h.executor.tick()
+    first, *rest = [stop.key for stop in h.executor.trip.stops]
+    h.finish()
+    assert h.keys('arrived') == [first]
+    assert h.keys('skipped') == rest
+    assert [info['reason'] for info in h.info('skipped')] == ['aborted'] * 2
+    assert h.info('trip_finished')[0]['returned']
+
+
+def test_prescanned_shelf_is_skipped():
+    h = Harness(load_timeout=5.0)
+    h.executor.submit(['Egg', 'Onion'])
+    h.executor.tick()
+    first, second = [stop.key for stop in h.executor.trip.stops]
+    h.executor.item_scanned(second)    # 通りがかりに先に積んだ
+    h.finish()
+    assert h.keys('arrived') == [first]
+    assert h.keys('skipped') == [second]
+    assert h.info('skipped')[0]['reason'] == 'prescanned'
+
+
+def test_waypoints_mode_rejects_load_timeout():
+    with pytest.raises(ValueError):
+        Harness(mode='waypoints', load_timeout=5.0)
+
+
+def test_waypoints_mode_runs_in_one_goal():
+    h = Harness(mode='waypoints')
+    h.executor.submit(['Egg', 'Onion'])
+    h.finish()
+    assert sorted(h.keys('arrived')) == ['cashier', 'egg', 'onion']
+    assert h.info('trip_finished')[0]['returned']